@@ -9,9 +9,11 @@ DATASETS = (
     RawFRS,
     FRS,
     SynthFRS,
+    UpscaledSynthFRS,
     RawSPI,
     SPI,
     RawWAS,
     RawLCF,
     FRSEnhanced,
+    PooledFRS,
 )
@@ -0,0 +1,73 @@
+"""Time to read every stored input of an existing dataset-year, with one
+dataset per variable against the packed block layout.
+
+Usage:
+
+    python -m openfisca_uk_data.benchmarks.blocks frs_enhanced 2019
+"""
+
+from pathlib import Path
+import sys
+import tempfile
+from time import time
+import h5py
+import pandas as pd
+from openfisca_uk_data.storage import DatasetFile, pack
+
+
+def load_report(dataset: type, year: int, repeats: int = 5) -> pd.DataFrame:
+    """Copies a dataset-year in both layouts and times a full-input load
+    (`DatasetFile.read_all`) from each.
+
+    Args:
+        dataset (type): The model dataset.
+        year (int): The year.
+        repeats (int, optional): The loads timed per layout. Defaults to 5.
+
+    Returns:
+        pd.DataFrame: One row per layout.
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        for layout in ("columns", "blocks"):
+            path = Path(folder) / f"{layout}.h5"
+            with dataset.load(year) as source, h5py.File(
+                path, mode="w"
+            ) as target:
+                pack(source, target, blocks=layout == "blocks")
+            times = []
+            for _ in range(repeats):
+                start = time()
+                with DatasetFile(h5py.File(path, mode="r")) as data:
+                    data.read_all()
+                times.append(time() - start)
+            with h5py.File(path, mode="r") as data:
+                datasets = []
+                data.visititems(
+                    lambda name, value: (
+                        datasets.append(name)
+                        if isinstance(value, h5py.Dataset)
+                        else None
+                    )
+                )
+            rows.append(
+                dict(
+                    layout=layout,
+                    datasets=len(datasets),
+                    megabytes=path.stat().st_size / 1e6,
+                    best_seconds=min(times),
+                    mean_seconds=sum(times) / len(times),
+                )
+            )
+    return pd.DataFrame(rows).set_index("layout")
+
+
+if __name__ == "__main__":
+    from openfisca_uk_data import DATASETS
+
+    name, year = sys.argv[1], int(sys.argv[2])
+    dataset = {dataset.name: dataset for dataset in DATASETS}[name]
+    report = load_report(dataset, year)
+    print(report.to_markdown(tablefmt="pretty"))
+    speedup = report.best_seconds["columns"] / report.best_seconds["blocks"]
+    print(f"\nFull-input load {speedup:.1f}x faster with packed blocks.")
@@ -0,0 +1,156 @@
+"""Wall time and fidelity of the imputation engines, compared with the
+original synthimpute imputation.
+
+Usage:
+
+    python -m openfisca_uk_data.benchmarks.imputation was random_forest gradient_boosting
+"""
+
+from typing import List, Tuple
+import sys
+from time import time
+import numpy as np
+import pandas as pd
+from openfisca_uk_data.datasets.frs.frs_enhanced.diagnostics import (
+    weighted_quantiles,
+)
+
+
+def imputation_data(imputation: str) -> Tuple[pd.DataFrame]:
+    """Loads the donor and recipient data for one of the FRSEnhanced
+    imputations ("spi", "was" or "lcf").
+
+    Returns:
+        Tuple[pd.DataFrame]: The donor predictors and targets, the recipient
+            predictors and the recipient weights.
+    """
+    from openfisca_uk_data.datasets.frs.frs_enhanced.spi_imputation import (
+        spi_imputation_data,
+    )
+    from openfisca_uk_data.datasets.frs.frs_enhanced.was_imputation import (
+        was_imputation_data,
+    )
+    from openfisca_uk_data.datasets.frs.frs_enhanced.lcf_imputation import (
+        lcf_imputation_data,
+        load_lcfs,
+    )
+
+    if imputation == "spi":
+        data = spi_imputation_data()
+    elif imputation == "was":
+        data = was_imputation_data(2019)
+    elif imputation == "lcf":
+        data = lcf_imputation_data(load_lcfs(2019), 2019)
+    else:
+        raise ValueError(f"Unknown imputation {imputation}.")
+    x_train, y_train, x_new = data
+    weights = getattr(x_new, "weights", None)
+    return x_train, y_train, x_new, weights
+
+
+def weighted_ks(
+    a: np.array, b: np.array, a_weights: np.array, b_weights: np.array
+) -> float:
+    """The Kolmogorov-Smirnov statistic between two weighted samples."""
+    points = np.union1d(a, b)
+
+    def cdf(values, weights):
+        order = np.argsort(values)
+        cumulative = np.cumsum(weights[order]) / weights.sum()
+        index = np.searchsorted(values[order], points, side="right") - 1
+        return np.where(index >= 0, cumulative[index.clip(0)], 0)
+
+    return np.abs(cdf(a, a_weights) - cdf(b, b_weights)).max()
+
+
+def compare_imputations(
+    imputed: pd.DataFrame,
+    reference: pd.DataFrame,
+    weights: np.array = None,
+) -> pd.DataFrame:
+    """Compares the distribution of each imputed variable with a reference
+    imputation for the same recipients.
+
+    Args:
+        imputed (pd.DataFrame): The imputed values.
+        reference (pd.DataFrame): The reference imputed values.
+        weights (np.array, optional): The recipient weights. Defaults to
+            equal weights.
+
+    Returns:
+        pd.DataFrame: For each variable, the weighted KS statistic and the
+            largest relative difference between weighted deciles.
+    """
+    weights = np.ones(len(imputed)) if weights is None else np.asarray(weights)
+    deciles = np.arange(1, 10) / 10
+    rows = []
+    for column in reference.columns:
+        a = np.asarray(imputed[column], dtype=float)
+        b = np.asarray(reference[column], dtype=float)
+        a_deciles = weighted_quantiles(a, weights, deciles)
+        b_deciles = weighted_quantiles(b, weights, deciles)
+        scale = np.maximum(np.abs(b_deciles), 1)
+        rows.append(
+            dict(
+                variable=column,
+                ks=weighted_ks(a, b, weights, weights),
+                max_decile_difference=(
+                    np.abs(a_deciles - b_deciles) / scale
+                ).max(),
+            )
+        )
+    return pd.DataFrame(rows)
+
+
+def benchmark_engines(
+    imputation: str, engines: List[str] = None
+) -> pd.DataFrame:
+    """Runs an FRSEnhanced imputation with each engine and compares the
+    results with the synthimpute engine.
+
+    Args:
+        imputation (str): The imputation ("spi", "was" or "lcf").
+        engines (List[str], optional): The engines to compare. Defaults to all
+            in `ENGINES`.
+
+    Returns:
+        pd.DataFrame: The wall time and fidelity of each engine and variable.
+    """
+    from openfisca_uk_data.datasets.frs.frs_enhanced.imputation import (
+        ENGINES,
+        SynthimputeEngine,
+        get_engine,
+    )
+
+    x_train, y_train, x_new, weights = imputation_data(imputation)
+    engines = [
+        engine for engine in engines or ENGINES if engine != "synthimpute"
+    ]
+    start = time()
+    reference = SynthimputeEngine(ignore_target=True).impute(
+        x_train, y_train, x_new
+    )
+    results = [
+        compare_imputations(reference, reference, weights).assign(
+            engine="synthimpute", seconds=time() - start
+        )
+    ]
+    for engine in engines:
+        start = time()
+        imputed = get_engine(engine).impute(x_train, y_train, x_new)
+        duration = time() - start
+        results.append(
+            compare_imputations(imputed, reference, weights).assign(
+                engine=engine, seconds=duration
+            )
+        )
+    return pd.concat(results).set_index(["engine", "variable"])
+
+
+if __name__ == "__main__":
+    imputation, *engines = sys.argv[1:]
+    print(
+        benchmark_engines(imputation, engines or None).to_markdown(
+            tablefmt="pretty"
+        )
+    )
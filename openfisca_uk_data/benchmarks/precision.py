@@ -0,0 +1,79 @@
+"""Size savings and aggregate drift of the storage precision policy, applied
+to an existing dataset-year.
+
+Usage:
+
+    python -m openfisca_uk_data.benchmarks.precision frs 2019
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+from openfisca_uk_data.precision import precision_drift, storage_values
+
+
+def precision_report(dataset: type, year: int) -> pd.DataFrame:
+    """Applies the precision policy to each variable of a dataset-year, and
+    measures the drift in its weighted total, with the weights also stored at
+    their policy precision.
+
+    Args:
+        dataset (type): The model dataset.
+        year (int): The year.
+
+    Returns:
+        pd.DataFrame: One row per variable (see `precision_drift`), with the
+            relative drift in the weighted total.
+    """
+    rows = []
+    with dataset.load(year) as data:
+        index = data.entity_index
+        household_weight = data["household_weight"][...]
+        weights = {}
+        for stored in (False, True):
+            values = household_weight
+            if stored:
+                values = storage_values("household_weight", values)
+            weights[stored] = dict(
+                household=values,
+                benunit=index.broadcast(values, "household", "benunit"),
+                person=index.broadcast(values, "household", "person"),
+            )
+        for variable in data.keys():
+            values = data[variable][...]
+            stored = storage_values(variable, values)
+            row = precision_drift(variable, values, stored)
+            entity = data.entity(variable)
+            row["weighted_total_drift"] = 0.0
+            if entity in weights[False] and values.dtype.kind in "iuf":
+                total = np.dot(values, weights[False][entity])
+                stored_total = np.dot(
+                    stored.astype(np.float64), weights[True][entity]
+                )
+                if total != 0:
+                    row["weighted_total_drift"] = abs(
+                        stored_total - total
+                    ) / abs(total)
+            rows.append(row)
+    return pd.DataFrame(rows).set_index("variable")
+
+
+if __name__ == "__main__":
+    from openfisca_uk_data import DATASETS
+
+    name, year = sys.argv[1], int(sys.argv[2])
+    dataset = {dataset.name: dataset for dataset in DATASETS}[name]
+    report = precision_report(dataset, year)
+    print(
+        report.sort_values("weighted_total_drift", ascending=False)
+        .head(20)
+        .to_markdown(tablefmt="pretty")
+    )
+    print(
+        f"\nStored size: {report.stored_bytes.sum() / 1e6:.1f}MB "
+        f"(from {report.bytes.sum() / 1e6:.1f}MB)"
+    )
+    print(
+        f"Largest weighted total drift: "
+        f"{report.weighted_total_drift.max():.2e}"
+    )
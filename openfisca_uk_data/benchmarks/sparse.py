@@ -0,0 +1,74 @@
+"""Disk and memory savings of sparse storage for mostly-zero variables, on
+an existing dataset-year.
+
+Usage:
+
+    python -m openfisca_uk_data.benchmarks.sparse frs_enhanced 2019
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+from openfisca_uk_data.precision import storage_values
+from openfisca_uk_data.storage import SPARSE_DENSITY
+
+
+def sparse_report(
+    dataset: type, year: int, density: float = SPARSE_DENSITY
+) -> pd.DataFrame:
+    """Measures the size of each numeric variable of a dataset-year stored in
+    full and in sparse form (at its storage precision), which is also the
+    memory needed to hold it densely or as a sparse view.
+
+    Args:
+        dataset (type): The model dataset.
+        year (int): The year.
+        density (float, optional): The sparse storage threshold. Defaults to
+            `SPARSE_DENSITY`.
+
+    Returns:
+        pd.DataFrame: One row per numeric variable.
+    """
+    rows = []
+    with dataset.load(year) as data:
+        for variable in data.keys():
+            values = storage_values(variable, data[variable][...])
+            if values.dtype.kind not in "iuf" or len(values) <= 1:
+                continue
+            nonzero = np.count_nonzero(values)
+            sparse_bytes = nonzero * (4 + values.dtype.itemsize)
+            rows.append(
+                dict(
+                    variable=variable,
+                    density=nonzero / len(values),
+                    dense_bytes=values.nbytes,
+                    sparse_bytes=sparse_bytes,
+                    stored_sparse=nonzero <= density * len(values),
+                )
+            )
+    return pd.DataFrame(rows).set_index("variable")
+
+
+if __name__ == "__main__":
+    from openfisca_uk_data import DATASETS
+
+    name, year = sys.argv[1], int(sys.argv[2])
+    dataset = {dataset.name: dataset for dataset in DATASETS}[name]
+    report = sparse_report(dataset, year)
+    sparse = report[report.stored_sparse]
+    print(
+        sparse.sort_values("dense_bytes", ascending=False)
+        .head(20)
+        .to_markdown(tablefmt="pretty")
+    )
+    dense_total = report.dense_bytes.sum() / 1e6
+    stored_total = (
+        report.dense_bytes[~report.stored_sparse].sum()
+        + sparse.sparse_bytes.sum()
+    ) / 1e6
+    print(
+        f"\n{len(sparse)} of {len(report)} numeric variables stored sparse: "
+        f"{dense_total:.1f}MB in full, {stored_total:.1f}MB with sparse "
+        f"storage ({1 - stored_total / dense_total:.0%} saved on disk and "
+        "in memory)."
+    )
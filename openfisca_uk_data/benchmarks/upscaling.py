@@ -0,0 +1,74 @@
+"""Throughput and peak memory of upscaled synthetic population generation.
+
+Usage:
+
+    python -m openfisca_uk_data.benchmarks.upscaling 2019 1 10 100
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+import resource
+import sys
+from time import time
+import h5py
+import pandas as pd
+
+
+def run_upscaling(year: int, factor: int) -> Dict[str, float]:
+    """Generates one upscaled dataset and measures it. Run in a fresh process
+    so that peak memory is not inflated by previous runs.
+
+    Args:
+        year (int): The year of the synthetic FRS to upscale.
+        factor (int): The upscaling factor.
+
+    Returns:
+        Dict[str, float]: The measurements.
+    """
+    from openfisca_uk_data import UpscaledSynthFRS
+
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time()
+    UpscaledSynthFRS.generate(year, factor, 0)
+    duration = time() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with h5py.File(UpscaledSynthFRS.file(year), mode="r") as f:
+        records = sum(
+            len(f[key]) for key in ("person_id", "benunit_id", "household_id")
+        )
+        households = len(f["household_id"])
+    return dict(
+        factor=factor,
+        households=households,
+        records=records,
+        seconds=duration,
+        records_per_second=records / duration,
+        peak_memory_mb=peak_kb / 1024,
+        peak_memory_increase_mb=(peak_kb - baseline_kb) / 1024,
+    )
+
+
+def benchmark_upscaling(year: int, factors: List[int]) -> pd.DataFrame:
+    """Benchmarks upscaled generation for each factor in a separate process.
+
+    Args:
+        year (int): The year of the synthetic FRS to upscale.
+        factors (List[int]): The upscaling factors to measure.
+
+    Returns:
+        pd.DataFrame: One row of measurements per factor.
+    """
+    results = []
+    for factor in factors:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results.append(pool.submit(run_upscaling, year, factor).result())
+    return pd.DataFrame(results).set_index("factor")
+
+
+if __name__ == "__main__":
+    year, *factors = map(int, sys.argv[1:])
+    print(
+        benchmark_upscaling(year, factors or [1, 10, 100]).to_markdown(
+            tablefmt="pretty"
+        )
+    )
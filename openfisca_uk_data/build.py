@@ -0,0 +1,330 @@
+from argparse import ArgumentParser
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import logging
+import os
+from time import time
+from typing import Dict, List, Tuple
+import pandas as pd
+
+
+def get_dataset(name: str) -> type:
+    from openfisca_uk_data import DATASETS
+
+    datasets = {ds.name: ds for ds in DATASETS}
+    if name not in datasets:
+        raise ValueError(
+            f"Unknown dataset {name}. Options are: {', '.join(datasets)}"
+        )
+    return datasets[name]
+
+
+def run_action(name: str, action: str, year: int, **kwargs) -> float:
+    """Runs a dataset action (e.g. generate, download, upload) for a year.
+
+    Args:
+        name (str): The dataset name.
+        action (str): The dataset method to call.
+        year (int): The year.
+
+    Returns:
+        float: The seconds taken.
+    """
+    start = time()
+    getattr(get_dataset(name), action)(year, **kwargs)
+    return time() - start
+
+
+class Task:
+    """A step of a build: a dataset action for one year, run on a thread if
+    it is I/O-bound or in a worker process if it is CPU-bound.
+    """
+
+    def __init__(
+        self,
+        dataset: str,
+        action: str,
+        year: int,
+        deps: List[str] = None,
+        kwargs: dict = None,
+    ):
+        self.dataset = dataset
+        self.action = action
+        self.year = year
+        self.deps = deps or []
+        self.kwargs = kwargs or {}
+        self.kind = "cpu" if action == "generate" else "io"
+
+    @property
+    def name(self) -> str:
+        return f"{self.dataset}:{self.year}:{self.action}"
+
+    def __repr__(self) -> str:
+        return self.name
+
+
+def parse_target(target: str) -> Tuple[str, int]:
+    name, year = target.split(":")
+    return name, int(year)
+
+
+def build_graph(
+    targets: List[Tuple[str, int]], upload: bool = False, force: bool = False
+) -> Dict[str, Task]:
+    """Builds the task graph for a set of target dataset-years from the
+    dataset dependency declarations (`Dataset.requires`). Model datasets are
+    generated, which is a no-op if they are up to date; raw datasets are
+    downloaded if missing. Existing inputs whose own inputs are not available
+    locally are used as they are.
+
+    Args:
+        targets (List[Tuple[str, int]]): The (dataset name, year) targets.
+        upload (bool, optional): Whether to upload each target after it is
+            generated. Defaults to False.
+        force (bool, optional): Whether to regenerate targets even if they
+            are up to date. Defaults to False.
+
+    Returns:
+        Dict[str, Task]: The tasks, keyed by name.
+    """
+    tasks = {}
+    targets = [(name, int(year)) for name, year in targets]
+
+    def add(name: str, year: int) -> List[str]:
+        dataset = get_dataset(name)
+        if dataset.model is None:
+            if (name, year) not in targets and year in dataset.years:
+                return []
+            task = Task(name, "download", year)
+        elif (
+            (name, year) not in targets
+            and year in dataset.years
+            and not all(
+                input_dataset.file(input_year).exists()
+                for input_dataset, input_year in dataset.requires(year)
+            )
+        ):
+            # An existing input that cannot be checked is used as it is
+            return []
+        else:
+            deps = sum(
+                (
+                    add(input_dataset.name, input_year)
+                    for input_dataset, input_year in dataset.requires(year)
+                ),
+                [],
+            )
+            kwargs = (
+                dict(force=True) if force and (name, year) in targets else {}
+            )
+            task = Task(name, "generate", year, deps, kwargs)
+        tasks.setdefault(task.name, task)
+        return [task.name]
+
+    for name, year in targets:
+        built = add(name, year)
+        if upload:
+            task = Task(name, "upload", year, built)
+            tasks[task.name] = task
+    return tasks
+
+
+def topological_order(tasks: Dict[str, Task]) -> List[Task]:
+    order = []
+    visited = set()
+
+    def visit(task: Task):
+        if task.name in visited:
+            return
+        visited.add(task.name)
+        for dep in task.deps:
+            visit(tasks[dep])
+        order.append(task)
+
+    for task in tasks.values():
+        visit(task)
+    return order
+
+
+def run_graph(
+    tasks: Dict[str, Task], processes: int = None, threads: int = 8
+) -> pd.DataFrame:
+    """Runs each task as soon as its dependencies have completed: I/O tasks
+    on a thread pool and CPU tasks on a process pool, so downloads and
+    uploads overlap with generation. Tasks depending on a failed task are
+    skipped.
+
+    Args:
+        tasks (Dict[str, Task]): The task graph.
+        processes (int, optional): The number of worker processes. Defaults to
+            the number of CPUs.
+        threads (int, optional): The number of I/O threads. Defaults to 8.
+
+    Returns:
+        pd.DataFrame: The status and timing of each task.
+    """
+    remaining = {name: set(task.deps) for name, task in tasks.items()}
+    dependents = {name: [] for name in tasks}
+    for name, task in tasks.items():
+        for dep in task.deps:
+            dependents[dep].append(name)
+    results = {}
+    running = {}
+    start = time()
+
+    def record(name: str, status: str, seconds: float = None):
+        task = tasks[name]
+        results[name] = dict(
+            dataset=task.dataset,
+            year=task.year,
+            action=task.action,
+            kind=task.kind,
+            status=status,
+            seconds=seconds,
+            finished=time() - start,
+        )
+
+    def skip_dependents(name: str):
+        for dependent in dependents[name]:
+            if dependent not in results:
+                record(dependent, f"skipped ({name} failed)")
+                remaining.pop(dependent, None)
+                skip_dependents(dependent)
+
+    with ProcessPoolExecutor(
+        max_workers=processes or os.cpu_count()
+    ) as cpu_pool, ThreadPoolExecutor(max_workers=threads) as io_pool:
+        while remaining or running:
+            for name in [name for name, deps in remaining.items() if not deps]:
+                del remaining[name]
+                task = tasks[name]
+                pool = cpu_pool if task.kind == "cpu" else io_pool
+                logging.info(f"Starting {name}")
+                future = pool.submit(
+                    run_action,
+                    task.dataset,
+                    task.action,
+                    task.year,
+                    **task.kwargs,
+                )
+                running[future] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    seconds = future.result()
+                    record(name, "done", seconds)
+                    logging.info(f"Completed {name} in {seconds:.1f}s")
+                    for dependent in dependents[name]:
+                        if dependent in remaining:
+                            remaining[dependent].discard(name)
+                except Exception as e:
+                    record(name, f"failed: {e}")
+                    logging.error(f"Failed {name}: {e}")
+                    skip_dependents(name)
+    logging.info(f"Build completed in {time() - start:.1f}s")
+    return pd.DataFrame(
+        [results[task.name] for task in topological_order(tasks)]
+    )
+
+
+def build(
+    targets: List[Tuple[str, int]],
+    processes: int = None,
+    upload: bool = False,
+    dry_run: bool = False,
+    force: bool = False,
+) -> pd.DataFrame:
+    """Builds target dataset-years and their inputs, skipping any that are up
+    to date.
+
+    Args:
+        targets (List[Tuple[str, int]]): The (dataset name, year) targets.
+        processes (int, optional): The number of worker processes. Defaults to
+            the number of CPUs.
+        upload (bool, optional): Whether to upload the targets. Defaults to
+            False.
+        dry_run (bool, optional): Only list the tasks that would run.
+            Defaults to False.
+        force (bool, optional): Regenerate targets even if they are up to
+            date. Defaults to False.
+
+    Returns:
+        pd.DataFrame: The tasks, with their status and timing if run.
+    """
+    tasks = build_graph(targets, upload=upload, force=force)
+    if dry_run:
+        return pd.DataFrame(
+            [
+                dict(
+                    task=task.name,
+                    kind=task.kind,
+                    depends_on=", ".join(task.deps),
+                )
+                for task in topological_order(tasks)
+            ]
+        )
+    return run_graph(tasks, processes=processes)
+
+
+def main(args: List[str] = None):
+    parser = ArgumentParser(
+        prog="openfisca-uk-data build",
+        description="Generate datasets and their inputs in parallel.",
+    )
+    parser.add_argument(
+        "--targets",
+        nargs="*",
+        default=[],
+        help="Dataset-years to build, e.g. frs_enhanced:2019",
+    )
+    parser.add_argument(
+        "--datasets",
+        nargs="*",
+        default=[],
+        help="Datasets to build for each of --years",
+    )
+    parser.add_argument(
+        "--years", nargs="*", type=int, default=[], help="The years"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="The number of worker processes (defaults to all cores)",
+    )
+    parser.add_argument(
+        "--upload", action="store_true", help="Upload the built targets"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate targets even if they are up to date",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="List the tasks without running them",
+    )
+    args = parser.parse_args(args)
+    targets = list(map(parse_target, args.targets)) + [
+        (name, year) for name in args.datasets for year in args.years
+    ]
+    if not targets:
+        parser.error("No targets given.")
+    report = build(
+        targets,
+        processes=args.processes,
+        upload=args.upload,
+        dry_run=args.dry_run,
+        force=args.force,
+    )
+    print(report.to_markdown(index=False, tablefmt="pretty"))
+    if not args.dry_run and (report.status != "done").any():
+        raise Exception("Some tasks failed.")
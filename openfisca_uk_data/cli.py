@@ -1,4 +1,5 @@
 from argparse import ArgumentParser
+import sys
 from openfisca_uk_data import *
 import pandas as pd
 import logging
@@ -7,6 +8,10 @@ logging.basicConfig(level=logging.INFO)
 
 
 def main():
+    if sys.argv[1:2] == ["build"]:
+        from openfisca_uk_data.build import main as build_main
+
+        return build_main(sys.argv[2:])
     datasets = {ds.name: ds for ds in DATASETS}
     parser = ArgumentParser(
         description="A utility for storing OpenFisca-UK-compatible microdata."
@@ -16,13 +21,21 @@ def main():
     parser.add_argument(
         "args", nargs="*", help="The arguments to pass to the function"
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate even if the dataset is up to date",
+    )
     args = parser.parse_args()
     if args.dataset == "datasets":
         if args.action == "list":
             return dataset_summary()
     else:
         try:
-            return getattr(datasets[args.dataset], args.action)(*args.args)
+            kwargs = dict(force=True) if args.force else {}
+            return getattr(datasets[args.dataset], args.action)(
+                *args.args, **kwargs
+            )
         except Exception as e:
             print("\n\nEncountered an error:")
             raise e
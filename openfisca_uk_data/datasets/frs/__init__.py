@@ -3,3 +3,5 @@ from openfisca_uk_data.datasets.frs.raw_frs import RawFRS
 from openfisca_uk_data.datasets.frs.frs import FRS
 from openfisca_uk_data.datasets.frs.synth_frs import SynthFRS
 from openfisca_uk_data.datasets.frs.frs_enhanced import FRSEnhanced
+from openfisca_uk_data.datasets.frs.upscaled_synth_frs import UpscaledSynthFRS
+from openfisca_uk_data.datasets.frs.pooled_frs import PooledFRS
@@ -1,6 +1,17 @@
 from openfisca_uk_data.datasets.frs.raw_frs import RawFRS
 from openfisca_core.model_api import *
 from openfisca_uk_data.utils import *
+from openfisca_uk_data.entities import (
+    ID_ENTITY,
+    normalize_ids,
+    normalized_ids,
+    survey_ids,
+    write_entity_index,
+    write_survey_ids,
+)
+from openfisca_uk_data.storage import DatasetFile, DatasetWriter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
 import pandas as pd
 from pandas import DataFrame
 import h5py
@@ -17,77 +28,292 @@ class FRS:
     name = "frs"
     model = UK
 
-    def generate(year: int) -> None:
+    def requires(year: int) -> list:
+        return [(RawFRS, int(year))]
+
+    def generate(year: int, shards: int = None, processes: int = None) -> None:
         """Generates the FRS-based input dataset for OpenFisca-UK.
 
         Args:
             year (int): The year to generate for (uses the raw FRS from this year)
+            shards (int, optional): If set, split households into this many
+                shards, generated in parallel and then merged. Defaults to
+                None (one process).
+            processes (int, optional): The number of processes to generate
+                shards with. Defaults to the number of CPUs.
         """
-
-        # Load raw FRS tables
         year = int(year)
-        raw_frs_files = RawFRS.load(year)
-        frs = h5py.File(FRS.file(year), mode="w")
         logging.info("Generating FRS dataset for year {}".format(year))
+        if shards is not None and int(shards) > 1:
+            generate_sharded(
+                year,
+                int(shards),
+                None if processes is None else int(processes),
+            )
+            logging.info("Completed FRS generation")
+            return
+
         logging.info("Loading FRS tables")
-        TABLES = (
-            "adult",
-            "child",
-            "accounts",
-            "benefits",
-            "job",
-            "oddjob",
-            "benunit",
-            "househol",
-            "chldcare",
-            "pension",
-            "maint",
-            "mortgage",
-            "penprov",
-        )
-        (
-            adult,
-            child,
-            accounts,
-            benefits,
-            job,
-            oddjob,
-            benunit,
-            household,
-            childcare,
-            pension,
-            maintenance,
-            mortgage,
-            pen_prov,
-        ) = [raw_frs_files[table] for table in TABLES]
-        raw_frs_files.close()
+        tables = load_frs_tables(year)
+
+        # Generate OpenFisca-UK variables and save
+        logging.info("Generating OpenFisca-UK variables")
+        with atomic_output(FRS.file(year)) as output:
+            write_frs(output, tables, year, frs_statistics(tables))
+        logging.info("Completed FRS generation")
+
+
+TABLES = (
+    "adult",
+    "child",
+    "accounts",
+    "benefits",
+    "job",
+    "oddjob",
+    "benunit",
+    "househol",
+    "chldcare",
+    "pension",
+    "maint",
+    "mortgage",
+    "penprov",
+)
+
+
+def household_ids(table: DataFrame) -> pd.Series:
+    if table.index.name == "household_id":
+        return table.index.to_series()
+    return table.household_id
+
 
+def load_frs_tables(
+    year: int, households: Tuple[int, int] = None, tables: List[str] = TABLES
+) -> Dict[str, DataFrame]:
+    """Loads raw FRS tables, with adults and children joined into a person
+    table.
+
+    Args:
+        year (int): The year of the raw FRS.
+        households (Tuple[int, int], optional): If set, only keep records of
+            households with IDs in this (inclusive) range.
+        tables (List[str], optional): The tables to load. Defaults to all
+            tables used to generate the FRS.
+
+    Returns:
+        Dict[str, DataFrame]: The tables, keyed by raw table name ("person"
+            for adults and children).
+    """
+    raw_frs_files = RawFRS.load(year)
+    loaded = {table: raw_frs_files[table] for table in tables}
+    raw_frs_files.close()
+    if households is not None:
+        first, last = households
+        loaded = {
+            name: table[household_ids(table).between(first, last).values]
+            for name, table in loaded.items()
+        }
+    if "adult" in loaded and "child" in loaded:
         logging.info("Joining adult and child tables")
+        loaded["person"] = (
+            pd.concat([loaded.pop("adult"), loaded.pop("child")])
+            .sort_index()
+            .fillna(0)
+        )
+    return loaded
 
-        person = pd.concat([adult, child]).sort_index().fillna(0)
 
-        # Generate OpenFisca-UK variables and save
-        logging.info("Generating OpenFisca-UK variables")
-        add_id_variables(frs, person, benunit, household)
+def frs_statistics(tables: Dict[str, DataFrame]) -> dict:
+    """Computes the statistics that FRS generation needs from the whole
+    survey rather than from a single household: the council tax means by
+    region, band and single-person status, the pension contribution cap
+    and the mean reported EMA amounts.
+
+    Args:
+        tables (Dict[str, DataFrame]): The full raw tables ("househol",
+            "penprov" and "person").
+
+    Returns:
+        dict: The statistics.
+    """
+    person = tables["person"]
+    return dict(
+        council_tax_means=council_tax_means(tables["househol"]),
+        pension_contribution_cap=tables["penprov"].PENAMT.quantile(0.95),
+        adult_ema_mean=reported_mean(person, "ADEMA", "ADEMAAMT"),
+        child_ema_mean=reported_mean(person, "CHEMA", "CHEMAAMT"),
+    )
+
+
+def write_frs(
+    path: Path,
+    tables: Dict[str, DataFrame],
+    year: int,
+    statistics: dict,
+    entity_index: bool = True,
+):
+    """Writes the OpenFisca-UK input variables generated from raw FRS tables.
+
+    Args:
+        path (Path): The file to write.
+        tables (Dict[str, DataFrame]): The raw tables (see `load_frs_tables`).
+        year (int): The year.
+        statistics (dict): The survey-wide statistics (see `frs_statistics`).
+        entity_index (bool, optional): Whether to store the entity index.
+            Defaults to True.
+    """
+    person = tables["person"]
+    household = tables["househol"]
+    with h5py.File(path, mode="w") as file:
+        frs = DatasetWriter(file)
+        add_id_variables(frs, person, tables["benunit"], household)
         add_personal_variables(frs, person)
-        add_benunit_variables(frs, benunit)
-        add_household_variables(frs, household)
+        add_benunit_variables(frs, tables["benunit"])
+        add_household_variables(
+            frs, household, statistics["council_tax_means"]
+        )
         add_market_income(
-            frs, person, pension, job, accounts, household, oddjob, year
+            frs,
+            person,
+            tables["pension"],
+            tables["job"],
+            tables["accounts"],
+            household,
+            tables["oddjob"],
+            year,
+        )
+        add_benefit_income(
+            frs, person, tables["benefits"], household, statistics
         )
-        add_benefit_income(frs, person, benefits, household)
         add_expenses(
             frs,
             person,
-            job,
+            tables["job"],
             household,
-            maintenance,
-            mortgage,
-            childcare,
-            pen_prov,
+            tables["maint"],
+            tables["mortgage"],
+            tables["chldcare"],
+            tables["penprov"],
+            statistics["pension_contribution_cap"],
         )
-        frs.close()
-        logging.info("Completed FRS generation")
+        if entity_index:
+            write_entity_index(file)
+        frs.log_report()
+
+
+def shard_ranges(
+    household_id: np.array, num_shards: int
+) -> List[Tuple[int, int]]:
+    """Splits households into contiguous ID ranges of (nearly) equal size.
+
+    Args:
+        household_id (np.array): The household IDs.
+        num_shards (int): The number of shards.
+
+    Returns:
+        List[Tuple[int, int]]: The first and last household ID of each
+            non-empty shard.
+    """
+    ids = np.sort(np.unique(household_id))
+    return [
+        (int(shard[0]), int(shard[-1]))
+        for shard in np.array_split(ids, num_shards)
+        if len(shard) > 0
+    ]
+
+
+def generate_shard(
+    year: int, households: Tuple[int, int], statistics: dict, path: Path
+):
+    """Generates the FRS variables for a range of households.
+
+    Args:
+        year (int): The year of the raw FRS.
+        households (Tuple[int, int]): The first and last household ID.
+        statistics (dict): The survey-wide statistics (see `frs_statistics`).
+        path (Path): The shard file to write.
+    """
+    tables = load_frs_tables(year, households)
+    write_frs(path, tables, year, statistics, entity_index=False)
+
+
+def merge_shards(paths: List[Path], path: Path):
+    """Merges shard files, in household ID order, into one dataset file,
+    one variable at a time. The IDs of each shard are numbered from zero and
+    offset by the number of records in the shards before it. State variables,
+    which every shard stores in full, are taken from the first.
+
+    Args:
+        paths (List[Path]): The shard files, in household ID order.
+        path (Path): The merged file to write.
+    """
+    shards = [DatasetFile(h5py.File(shard, mode="r")) for shard in paths]
+    try:
+        with h5py.File(path, mode="w") as file:
+            # The shards are already stored at their storage precision
+            merged = DatasetWriter(file, policy=())
+            for variable in shards[0].keys():
+                if variable in ID_ENTITY:
+                    entity = ID_ENTITY[variable]
+                    offsets = np.cumsum(
+                        [0] + [shard.sizes[entity] for shard in shards[:-1]]
+                    )
+                    parts = [
+                        normalized_ids(shard)[variable] + offset
+                        for shard, offset in zip(shards, offsets)
+                    ]
+                elif shards[0].entity(variable) == "state":
+                    parts = [shards[0][variable][...]]
+                else:
+                    parts = [shard[variable][...] for shard in shards]
+                merged[variable] = np.concatenate(parts)
+            shard_ids = [survey_ids(shard) for shard in shards]
+            write_survey_ids(
+                file,
+                {
+                    entity: np.concatenate([ids[entity] for ids in shard_ids])
+                    for entity in shard_ids[0]
+                },
+            )
+            write_entity_index(file)
+    finally:
+        for shard in shards:
+            shard.close()
+
+
+def generate_sharded(year: int, num_shards: int, processes: int = None):
+    """Generates the FRS in household shards on separate processes: the
+    survey-wide statistics are computed first, then each shard is generated
+    independently and the shards are merged.
+
+    Args:
+        year (int): The year of the raw FRS.
+        num_shards (int): The number of shards.
+        processes (int, optional): The number of processes. Defaults to the
+            number of CPUs.
+    """
+    logging.info("Computing survey-wide statistics")
+    tables = load_frs_tables(
+        year, tables=("adult", "child", "househol", "penprov")
+    )
+    statistics = frs_statistics(tables)
+    ranges = shard_ranges(tables["househol"].index, num_shards)
+    del tables
+    with scratch_folder(FRS.data_dir) as folder:
+        paths = [folder / f"shard_{i}.h5" for i in range(len(ranges))]
+        logging.info(f"Generating {len(ranges)} shards")
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            list(
+                pool.map(
+                    generate_shard,
+                    [year] * len(ranges),
+                    ranges,
+                    [statistics] * len(ranges),
+                    paths,
+                )
+            )
+        logging.info("Merging shards")
+        with atomic_output(FRS.file(year)) as output:
+            merge_shards(paths, output)
 
 
 def sum_to_entity(
@@ -138,12 +364,24 @@ def add_id_variables(
         benunit (DataFrame)
         household (DataFrame)
     """
-    # Add primary and foreign keys
-    frs["person_id"] = person.index
-    frs["person_benunit_id"] = person.benunit_id
-    frs["person_household_id"] = person.household_id
-    frs["benunit_id"] = person.benunit_id.sort_values().unique()
-    frs["household_id"] = person.household_id.sort_values().unique()
+    # Add primary and foreign keys, numbered from zero, keeping the survey IDs
+    survey = dict(
+        person=person.index.values,
+        benunit=person.benunit_id.sort_values().unique(),
+        household=person.household_id.sort_values().unique(),
+    )
+    ids = normalize_ids(
+        dict(
+            person_id=survey["person"],
+            person_benunit_id=person.benunit_id.values,
+            person_household_id=person.household_id.values,
+            benunit_id=survey["benunit"],
+            household_id=survey["household"],
+        )
+    )
+    for name, values in ids.items():
+        frs[name] = values
+    write_survey_ids(frs, survey)
 
     # Add grossing weights
     frs["raw_person_weight"] = pd.Series(
@@ -259,12 +497,16 @@ def add_personal_variables(frs: h5py.File, person: DataFrame):
     )
 
 
-def add_household_variables(frs: h5py.File, household: DataFrame):
+def add_household_variables(
+    frs: h5py.File, household: DataFrame, CT_mean: pd.Series = None
+):
     """Adds household variables (region, tenure, council tax imputation).
 
     Args:
         frs (h5py.File)
         household (DataFrame)
+        CT_mean (pd.Series, optional): The mean council tax table (see
+            `council_tax_means`). Defaults to the table for these households.
     """
     # Add region
     from openfisca_uk.variables.household.demographic.household import Region
@@ -314,22 +556,8 @@ def add_household_variables(frs: h5py.File, household: DataFrame):
 
     # Impute Council Tax
 
-    # Only ~25% of household report Council Tax bills - use
-    # these to build a model to impute missing values
-    CT_valid = household.CTANNUAL > 0
-
-    # Find the mean reported Council Tax bill for a given
-    # (region, CT band, is-single-person-household) triplet
-    region = household.GVTREGNO[CT_valid]
-    band = household.CTBAND[CT_valid]
-    single_person = (household.ADULTH == 1)[CT_valid]
-    ctannual = household.CTANNUAL[CT_valid]
-
-    # Build the table
-    CT_mean = ctannual.groupby(
-        [region, band, single_person], dropna=False
-    ).mean()
-    CT_mean = CT_mean.replace(-1, CT_mean.mean())
+    if CT_mean is None:
+        CT_mean = council_tax_means(household)
 
     # For every household consult the table to find the imputed
     # Council Tax bill
@@ -361,6 +589,34 @@ def add_household_variables(frs: h5py.File, household: DataFrame):
     )
 
 
+def council_tax_means(household: DataFrame) -> pd.Series:
+    """Builds the table of mean reported Council Tax bills.
+
+    Args:
+        household (DataFrame): The raw household table.
+
+    Returns:
+        pd.Series: The mean bill for each (region, CT band,
+            is-single-person-household) triplet.
+    """
+    # Only ~25% of household report Council Tax bills - use
+    # these to build a model to impute missing values
+    CT_valid = household.CTANNUAL > 0
+
+    # Find the mean reported Council Tax bill for a given
+    # (region, CT band, is-single-person-household) triplet
+    region = household.GVTREGNO[CT_valid]
+    band = household.CTBAND[CT_valid]
+    single_person = (household.ADULTH == 1)[CT_valid]
+    ctannual = household.CTANNUAL[CT_valid]
+
+    # Build the table
+    CT_mean = ctannual.groupby(
+        [region, band, single_person], dropna=False
+    ).mean()
+    return CT_mean.replace(-1, CT_mean.mean())
+
+
 def add_market_income(
     frs: h5py.File,
     person: DataFrame,
@@ -569,8 +825,18 @@ def sum_positive_variables(variables: List[str]) -> np.array:
     return sum([np.where(variable > 0, variable, 0) for variable in variables])
 
 
+def reported_mean(table: pd.DataFrame, code: str, amount: str) -> float:
+    """The mean of the reported (non-negative) amounts in a column."""
+    has_value = (table[code] == 1) & (table[amount] >= 0)
+    return table[amount][has_value].mean()
+
+
 def fill_with_mean(
-    table: pd.DataFrame, code: str, amount: str, multiplier: float = 52
+    table: pd.DataFrame,
+    code: str,
+    amount: str,
+    multiplier: float = 52,
+    fill_mean: float = None,
 ) -> np.array:
     """Fills missing values in a table with the mean of the column.
 
@@ -579,13 +845,15 @@ def fill_with_mean(
         code (str): Column signifying existence.
         amount (str): Column with values.
         multiplier (float): Multiplier to apply to amount.
+        fill_mean (float, optional): The value to fill with. Defaults to the
+            mean of the reported values in the table.
 
     Returns:
         np.array: Filled values.
     """
     needs_fill = (table[code] == 1) & (table[amount] < 0)
-    has_value = (table[code] == 1) & (table[amount] >= 0)
-    fill_mean = table[amount][has_value].mean()
+    if fill_mean is None:
+        fill_mean = reported_mean(table, code, amount)
     filled_values = np.where(needs_fill, fill_mean, table[amount])
     return np.maximum(filled_values, 0) * multiplier
 
@@ -595,6 +863,7 @@ def add_benefit_income(
     person: DataFrame,
     benefits: DataFrame,
     household: DataFrame,
+    statistics: dict = None,
 ):
     """Adds benefit variables.
 
@@ -603,7 +872,10 @@ def add_benefit_income(
         person (DataFrame)
         benefits (DataFrame)
         household (DataFrame)
+        statistics (dict, optional): Survey-wide statistics (see
+            `frs_statistics`). Defaults to those of these records.
     """
+    statistics = statistics or {}
     BENEFIT_CODES = dict(
         child_benefit=3,
         income_support=19,
@@ -697,8 +969,18 @@ def add_benefit_income(
 
     frs["student_loans"] = np.maximum(person.TUBORR, 0)
 
-    frs["adult_ema"] = fill_with_mean(person, "ADEMA", "ADEMAAMT")
-    frs["child_ema"] = fill_with_mean(person, "CHEMA", "CHEMAAMT")
+    frs["adult_ema"] = fill_with_mean(
+        person,
+        "ADEMA",
+        "ADEMAAMT",
+        fill_mean=statistics.get("adult_ema_mean"),
+    )
+    frs["child_ema"] = fill_with_mean(
+        person,
+        "CHEMA",
+        "CHEMAAMT",
+        fill_mean=statistics.get("child_ema_mean"),
+    )
 
     frs["access_fund"] = np.maximum(person.ACCSSAMT, 0) * 52
 
@@ -725,6 +1007,7 @@ def add_expenses(
     mortgage: DataFrame,
     childcare: DataFrame,
     pen_prov: DataFrame,
+    pension_contribution_cap: float = None,
 ):
     """Adds expense variables
 
@@ -736,7 +1019,12 @@ def add_expenses(
         mortgage (DataFrame)
         childcare (DataFrame)
         pen_prov (DataFrame)
+        pension_contribution_cap (float, optional): The cap on reported
+            pension contributions. Defaults to the 95th percentile of
+            `pen_prov.PENAMT`.
     """
+    if pension_contribution_cap is None:
+        pension_contribution_cap = pen_prov.PENAMT.quantile(0.95)
     frs["maintenance_expenses"] = (
         pd.Series(
             np.where(
@@ -785,7 +1073,7 @@ def add_expenses(
             pen_prov.PENAMT[pen_prov.STEMPPEN.isin((5, 6))],
             pen_prov.person_id,
             person.index,
-        ).clip(0, pen_prov.PENAMT.quantile(0.95))
+        ).clip(0, pension_contribution_cap)
         * 52,
     )
     frs["occupational_pension_contributions"] = max_(
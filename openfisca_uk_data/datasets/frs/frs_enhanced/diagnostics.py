@@ -0,0 +1,233 @@
+import logging
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+from openfisca_uk_data.datasets.frs.frs_enhanced.spi_imputation import (
+    IMPUTATIONS as SPI_VARIABLES,
+)
+from openfisca_uk_data.datasets.frs.frs_enhanced.was_imputation import (
+    IMPUTE_COLS as WAS_VARIABLES,
+)
+from openfisca_uk_data.datasets.frs.frs_enhanced.lcf_imputation import (
+    CATEGORY_VARIABLES as LCF_VARIABLES,
+)
+from openfisca_uk_data.storage import DatasetFile
+
+IMPUTED_VARIABLES = dict(
+    spi=SPI_VARIABLES,
+    was=WAS_VARIABLES,
+    lcf=LCF_VARIABLES,
+)
+
+# Stored person-level market income components, summed to households to rank
+# them into deciles without running a simulation
+MARKET_INCOME_VARIABLES = [
+    "employment_income",
+    "self_employment_income",
+    "pension_income",
+    "savings_interest_income",
+    "dividend_income",
+    "property_income",
+]
+
+
+def weighted_quantiles(
+    values: np.array, weights: np.array, quantiles: np.array
+) -> np.array:
+    """Finds weighted quantiles of a set of values.
+
+    Args:
+        values (np.array): The values.
+        weights (np.array): The weight of each value.
+        quantiles (np.array): The quantiles to find, between 0 and 1.
+
+    Returns:
+        np.array: The value at each quantile.
+    """
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    return values[order][
+        np.searchsorted(cumulative, quantiles * cumulative[-1]).clip(
+            0, len(values) - 1
+        )
+    ]
+
+
+def weighted_deciles(values: np.array, weights: np.array) -> np.array:
+    """Ranks values into weighted deciles.
+
+    Args:
+        values (np.array): The values.
+        weights (np.array): The weight of each value.
+
+    Returns:
+        np.array: The decile (1 to 10) of each value.
+    """
+    order = np.argsort(values, kind="stable")
+    cumulative = np.cumsum(weights[order])
+    # Rank by the weight below each record's midpoint
+    midpoint = (cumulative - weights[order] / 2) / cumulative[-1]
+    deciles = np.empty(len(values), dtype=int)
+    deciles[order] = np.floor(midpoint * 10).clip(0, 9) + 1
+    return deciles
+
+
+def summarise(values: np.array, weights: np.array) -> Dict[str, float]:
+    """Weighted summary statistics of one imputed variable."""
+    total_weight = weights.sum()
+    p10, median, p90 = weighted_quantiles(
+        values, weights, np.array([0.1, 0.5, 0.9])
+    )
+    return dict(
+        mean=(values * weights).sum() / total_weight,
+        p10=p10,
+        median=median,
+        p90=p90,
+        total=(values * weights).sum(),
+        share_nonzero=weights[values != 0].sum() / total_weight,
+    )
+
+
+def household_diagnostics(data: DatasetFile) -> pd.DataFrame:
+    """Builds a household table of market income, weighted decile and the
+    stored WAS and LCF imputations, from the stored arrays.
+
+    Args:
+        data (DatasetFile): The model dataset file.
+
+    Returns:
+        pd.DataFrame: One row per household.
+    """
+    index = data.entity_index
+    people = np.diff(index.arrays["household_offsets"])
+    market_income = sum(
+        index.sum(data[variable][...], "person", "household")
+        for variable in MARKET_INCOME_VARIABLES
+        if variable in data
+    )
+    weight = data["household_weight"][...] * people
+    households = pd.DataFrame(
+        dict(
+            household_id=data["household_id"][...],
+            weight=weight,
+            household_market_income=market_income,
+            decile=weighted_deciles(market_income, weight),
+        )
+    )
+    for variable in WAS_VARIABLES + LCF_VARIABLES:
+        if variable in data:
+            households[variable] = data[variable][...]
+    return households
+
+
+def imputation_summary(
+    data: DatasetFile, cloned_persons: int = None
+) -> pd.DataFrame:
+    """Summarises each stored imputed variable, overall and by household
+    market income decile.
+
+    Args:
+        data (DatasetFile): The model dataset file.
+        cloned_persons (int, optional): If the SPI incomes were written into
+            cloned persons (as in `FRSEnhanced`), the number of original
+            persons: rows `cloned_persons` to `2 * cloned_persons` are then
+            summarised, weighted by the weights of the persons they were
+            cloned from. Defaults to None (all persons).
+
+    Returns:
+        pd.DataFrame: One row per imputed variable.
+    """
+    index = data.entity_index
+    households = household_diagnostics(data)
+    weights = dict(
+        household=households.weight.values,
+        person=index.broadcast(
+            data["household_weight"][...], "household", "person"
+        ),
+    )
+    deciles = dict(
+        household=households.decile.values,
+        person=index.broadcast(
+            households.decile.values, "household", "person"
+        ),
+    )
+    rows = []
+    for imputation, variables in IMPUTED_VARIABLES.items():
+        for variable in variables:
+            if variable not in data:
+                continue
+            values = data[variable][...]
+            entity = data.entity(variable)
+            if entity not in weights:
+                continue
+            weight, decile = weights[entity], deciles[entity]
+            if imputation == "spi" and cloned_persons is not None:
+                clones = slice(cloned_persons, 2 * cloned_persons)
+                values = values[clones]
+                weight = weight[:cloned_persons]
+                decile = decile[:cloned_persons]
+            row = dict(
+                imputation=imputation,
+                variable=variable,
+                entity=entity,
+                **summarise(values.astype(float), weight),
+            )
+            decile_totals = np.bincount(
+                decile, weights=values * weight, minlength=11
+            )
+            decile_weights = np.bincount(decile, weights=weight, minlength=11)
+            for i in range(1, 11):
+                row[f"decile_{i}_mean"] = decile_totals[i] / max(
+                    decile_weights[i], 1e-9
+                )
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def write_diagnostics(
+    dataset: type,
+    year: int,
+    folder: Path,
+    cloned_persons: int = None,
+    csv: bool = False,
+    simulate: bool = False,
+) -> List[Path]:
+    """Writes the household diagnostics table and the imputation summary as
+    Parquet files.
+
+    Args:
+        dataset (type): The dataset.
+        year (int): The year.
+        folder (Path): The folder to write to.
+        cloned_persons (int, optional): See `imputation_summary`.
+        csv (bool, optional): Whether to also write the household table as
+            CSV. Defaults to False.
+        simulate (bool, optional): Whether to add household net income from a
+            full microsimulation. Defaults to False.
+
+    Returns:
+        List[Path]: The files written.
+    """
+    with dataset.load(year) as data:
+        households = household_diagnostics(data)
+        summary = imputation_summary(data, cloned_persons)
+    if simulate:
+        from openfisca_uk import Microsimulation
+
+        logging.info("Computing household net income")
+        sim = Microsimulation(dataset=dataset, year=year, adjust_weights=False)
+        households["household_net_income"] = sim.calc(
+            "household_net_income"
+        ).values
+    folder = Path(folder)
+    files = [
+        folder / f"imputations_{year}.parquet",
+        folder / f"imputation_summary_{year}.parquet",
+    ]
+    households.to_parquet(files[0], index=False)
+    summary.to_parquet(files[1], index=False)
+    if csv:
+        files.append(folder / f"imputations_{year}.csv")
+        households.to_csv(files[-1], index=False)
+    return files
@@ -0,0 +1,75 @@
+import hashlib
+import logging
+from pathlib import Path
+import sys
+from typing import Callable
+import pandas as pd
+from microdf import MicroDataFrame
+from openfisca_uk_data.utils import (
+    DATA_DIR,
+    atomic_output,
+    file_hash,
+    file_lock,
+)
+
+DONOR_DIR = DATA_DIR / "donors"
+
+# The column holding the donor weights in a stored artifact
+DONOR_WEIGHT = "donor_weight"
+
+
+def donor_artifact_file(
+    name: str, raw_file: Path, build: Callable[[], MicroDataFrame]
+) -> Path:
+    """Finds the path of a donor artifact, keyed by the contents of the raw
+    survey file and of the module that preprocesses it.
+
+    Args:
+        name (str): The artifact name, e.g. "was_2019".
+        raw_file (Path): The raw survey file the donors are built from.
+        build (Callable[[], MicroDataFrame]): The preprocessing function.
+
+    Returns:
+        Path: The artifact path.
+    """
+    source = Path(sys.modules[build.__module__].__file__)
+    key = hashlib.sha256(
+        (file_hash(raw_file) + file_hash(source)).encode()
+    ).hexdigest()
+    return DONOR_DIR / f"{name}_{key[:16]}.parquet"
+
+
+def donor_artifact(
+    name: str, raw_file: Path, build: Callable[[], MicroDataFrame]
+) -> MicroDataFrame:
+    """Loads preprocessed donor survey records, building and storing them
+    first if the raw survey file (or the preprocessing code) has changed
+    since they were last built.
+
+    Args:
+        name (str): The artifact name, e.g. "was_2019".
+        raw_file (Path): The raw survey file the donors are built from.
+        build (Callable[[], MicroDataFrame]): The preprocessing function.
+
+    Returns:
+        MicroDataFrame: The weighted donor records.
+    """
+    path = donor_artifact_file(name, raw_file, build)
+    DONOR_DIR.mkdir(parents=True, exist_ok=True)
+    # Concurrent builds of the same artifact wait for each other, and the
+    # second loads what the first stored
+    with file_lock(DONOR_DIR / f"{name}.parquet"):
+        if path.exists():
+            frame = pd.read_parquet(path)
+            weights = frame.pop(DONOR_WEIGHT)
+            return MicroDataFrame(frame, weights=weights)
+        logging.info(f"Building donor artifact {path.name}")
+        donors = build()
+        frame = pd.DataFrame(donors)
+        frame[DONOR_WEIGHT] = donors.weights.values
+        with atomic_output(path) as output:
+            frame.to_parquet(output)
+        for previous in DONOR_DIR.glob(f"{name}_*.parquet"):
+            if previous != path:
+                previous.unlink()
+    return donors
@@ -1,104 +1,181 @@
 import logging
 from pathlib import Path
 from openfisca_uk_data.datasets.frs.frs_enhanced.general import (
-    add_variables,
+    append_clones as append_stored_clones,
     clone_and_replace_half,
+    split_clones,
     subsample,
 )
 from openfisca_uk_data.datasets.frs.frs_enhanced.spi_imputation import (
     impute_incomes,
 )
+from openfisca_uk_data.datasets.frs.frs_enhanced.diagnostics import (
+    write_diagnostics,
+)
 from openfisca_uk_data.datasets.frs.frs_enhanced.uc_transition import (
     migrate_to_universal_credit,
 )
-from openfisca_uk_data.utils import dataset, UK, PACKAGE_DIR
+from openfisca_uk_data.utils import (
+    dataset,
+    UK,
+    PACKAGE_DIR,
+    atomic_output,
+    file_lock,
+)
 from openfisca_uk_data.datasets.frs.frs import FRS
+from openfisca_uk_data.datasets.spi import SPI
+from openfisca_uk_data.datasets.was import RawWAS
+from openfisca_uk_data.datasets.lcf import RawLCF
 from openfisca_uk_data.datasets.frs.frs_enhanced.was_imputation import (
     impute_wealth,
 )
 from openfisca_uk_data.datasets.frs.frs_enhanced.lcf_imputation import (
     impute_consumption,
 )
+from openfisca_uk_data.entities import SURVEY_IDS
+from openfisca_uk_data.layers import (
+    base_version,
+    link_variable,
+    record_layer,
+)
+from openfisca_uk_data.storage import DatasetFile
 import h5py
 import numpy as np
 from time import time
 import pandas as pd
 
 
+def copy_base(base: DatasetFile, target: h5py.File, layered: bool = True):
+    """Writes the variables and survey IDs of the base dataset to the start
+    of an enhanced dataset.
+
+    Args:
+        base (DatasetFile): The base dataset (the FRS).
+        target (h5py.File): The enhanced dataset, open for writing.
+        layered (bool, optional): Whether to reference the base variables
+            rather than store copies (see `layers.py`). A pinned version of
+            the base file is referenced (see `base_version`), so that
+            rebuilding the base leaves the enhanced dataset readable.
+            Defaults to True.
+    """
+    version = None
+    if layered:
+        version = h5py.File(base_version(base.file), mode="r")
+    try:
+        for key in base.keys():
+            # Sparse and packed variables are copied rather than linked
+            if version is not None and isinstance(base[key], h5py.Dataset):
+                link_variable(target, key, version[key])
+            else:
+                target[key] = base[key][...]
+        if SURVEY_IDS in base.file:
+            base.file.copy(base.file[SURVEY_IDS], target)
+        if version is not None:
+            record_layer(target, version)
+    finally:
+        if version is not None:
+            version.close()
+
+
 @dataset
 class FRSEnhanced:
     name = "frs_enhanced"
     model = UK
 
-    def generate(year: int) -> None:
+    def requires(year: int) -> list:
+        # The WAS and LCF imputations use the 2019 releases
+        return [
+            (FRS, int(year)),
+            (SPI, int(year)),
+            (RawWAS, 2019),
+            (RawLCF, 2019),
+        ]
+
+    def generate(
+        year: int,
+        engines: dict = None,
+        csv: bool = False,
+        simulate: bool = False,
+        layered: bool = True,
+        separate_clones: bool = False,
+    ) -> None:
+        """Generates the enhanced FRS.
+
+        Args:
+            year (int): The year to generate for.
+            engines (dict, optional): The imputation engine to use for each
+                imputation ("spi", "was" and "lcf"), as names, specifications
+                or instances (see `get_engine`). Defaults to synthimpute.
+            csv (bool, optional): Whether to also write the imputation
+                diagnostics as CSV. Defaults to False.
+            simulate (bool, optional): Whether to add household net income
+                from a full microsimulation to the diagnostics. Defaults to
+                False.
+            layered (bool, optional): Whether to reference the FRS variables
+                the enhancement leaves unchanged rather than store copies
+                (see `layers.py`). Defaults to True.
+            separate_clones (bool, optional): Whether to store the
+                zero-weight cloned records apart from the others, so that
+                loads and simulations skip them (see `split_clones`).
+                Defaults to False.
+        """
+        year = int(year)
+        engines = engines or {}
         logging.info(f"Generating FRSEnhanced for year {year}")
-        logging.info("Loading FRS")
+        logging.info("Generating FRS (if changed)")
         FRS.generate(year)
 
-        frs = FRS.load(year)
-        frs_enhanced = h5py.File(FRSEnhanced.file(year), mode="w")
-        for key in frs.keys():
-            frs_enhanced[key] = frs[key][...]
-        frs.close()
-        frs_enhanced.close()
+        with FRS.load(year) as frs, atomic_output(
+            FRSEnhanced.file(year)
+        ) as output, h5py.File(output, mode="w") as frs_enhanced:
+            num_persons = len(frs["person_id"])
+            copy_base(frs, frs_enhanced, layered)
 
         logging.info("Adding high incomes imputed from the SPI")
-        pred_income = impute_incomes()
-        clone_and_replace_half(
-            FRSEnhanced,
-            year,
-            {field: pred_income[field] for field in pred_income.columns},
-            weighting=0,
+        # The imputed incomes are written into the cloned half of each person
+        # column, after the original persons
+        clone_and_replace_half(FRSEnhanced, year, {}, weighting=0)
+        impute_incomes(
+            engine=engines.get("spi"),
+            output_file=FRSEnhanced.file(year),
+            offset=num_persons,
         )
 
         logging.info("Adding wealth imputed from the WAS")
-        pred_wealth = impute_wealth(year, dataset=FRSEnhanced)
-        add_variables(
-            FRSEnhanced,
+        impute_wealth(
             year,
-            {field: pred_wealth[field] for field in pred_wealth.columns},
+            dataset=FRSEnhanced,
+            engine=engines.get("was"),
+            output_file=FRSEnhanced.file(year),
         )
 
         logging.info("Adding consumption imputed from the LCFS")
-        pred_consumption = impute_consumption(year, dataset=FRSEnhanced)
-        add_variables(
-            FRSEnhanced,
+        impute_consumption(
             year,
-            {
-                field: pred_consumption[field]
-                for field in pred_consumption.columns
-            },
+            dataset=FRSEnhanced,
+            engine=engines.get("lcf"),
+            output_file=FRSEnhanced.file(year),
         )
 
         logging.info("Adding UC-migrated households")
         uc_migrated = migrate_to_universal_credit(FRSEnhanced, year)
         clone_and_replace_half(FRSEnhanced, year, uc_migrated, weighting=0)
 
-        # Save imputed variables to a CSV file
-
-        logging.info("Saving imputed variables to CSV")
-
-        from openfisca_uk import Microsimulation
+        logging.info("Writing imputation diagnostics")
+        write_diagnostics(
+            FRSEnhanced,
+            year,
+            PACKAGE_DIR / "imputations",
+            cloned_persons=num_persons,
+            csv=csv,
+            simulate=simulate,
+        )
+        if separate_clones:
+            logging.info("Storing zero-weight clones separately")
+            split_clones(FRSEnhanced, year)
 
-        sim = Microsimulation(dataset=FRSEnhanced, adjust_weights=False)
-        hnet = sim.calc("household_net_income")
-        hnet.weights *= sim.calc("people", map_to="household").values
-        pd.concat(
-            [
-                sim.df(
-                    [
-                        "household_net_income",
-                        "household_market_income",
-                        "household_id",
-                    ]
-                ),
-                pred_wealth,
-                pred_consumption,
-                pd.DataFrame(
-                    {
-                        "decile": hnet.decile_rank(),
-                    }
-                ),
-            ],
-            axis=1,
-        ).to_csv(PACKAGE_DIR / "imputations" / f"imputations_{year}.csv")
+    def append_clones(year: int):
+        """Restores zero-weight clones stored apart by
+        `generate(separate_clones=True)`, e.g. for reweighting."""
+        with file_lock(FRSEnhanced.file(int(year))):
+            append_stored_clones(FRSEnhanced, int(year))
@@ -1,7 +1,29 @@
-from typing import Dict
+import logging
+from typing import Dict, Tuple
 import h5py
 from numpy.typing import ArrayLike
 import numpy as np
+from openfisca_uk_data.entities import (
+    ENTITY_ID_VARIABLES,
+    ID_ENTITY,
+    entity_sizes,
+    id_positions,
+    normalize_ids,
+    normalized_ids,
+    survey_ids,
+    write_entity_index,
+    write_survey_ids,
+    write_variable_entities,
+)
+from openfisca_uk_data.layers import LAYERS, virtual_blocks, write_virtual
+from openfisca_uk_data.storage import (
+    CLONES,
+    DONORS,
+    ENTITY_LEVELS,
+    DatasetWriter,
+    write_value_index,
+)
+from openfisca_uk_data.utils import atomic_output
 
 
 def clone_and_replace_half(
@@ -12,6 +34,10 @@ def clone_and_replace_half(
     target_dataset: type = None,
 ):
     """Clones a dataset and replaces half of the values with the values in the mapping.
+    Unchanged variables which reference a base file (see `layers.py`) are cloned by
+    referencing the base variables twice, rather than storing the values. Records
+    left with zero weight are marked as donors (see `DatasetFile.donors`). IDs
+    are numbered from zero, the clones following the originals.
 
     Args:
         dataset (type): The dataset to clone.
@@ -24,128 +50,419 @@ def clone_and_replace_half(
     if target_dataset is None:
         target_dataset = dataset
     data = dataset.load(year)
-    previous_data = {key: data[key][...] for key in data.keys()}
+    previous_data = {}
+    linked = {}
+    for key in data.keys():
+        is_id = key in ID_ENTITY
+        is_weight = "_weight" in key and "state" not in key
+        if data[key].is_virtual and not (is_id or is_weight or key in mapping):
+            linked[key] = virtual_blocks(data[key]), data[key].dtype
+        else:
+            previous_data[key] = data[key][...]
+    layers = data.attrs.get(LAYERS)
+    sizes = entity_sizes(data)
+    ids = normalized_ids(data)
+    survey = survey_ids(data)
+    donors = {}
+    for entity in ENTITY_LEVELS:
+        previous = data.donors(entity)
+        if previous is None:
+            previous = np.zeros(sizes[entity], dtype=bool)
+        donors[entity] = np.concatenate(
+            [previous | (weighting == 1), previous | (weighting == 0)]
+        )
     data.close()
-    file = h5py.File(target_dataset.file(year), "w")
-    for field in previous_data:
-        if "_id" in field and "state" not in field:
-            values = np.concatenate(
-                [previous_data[field] * 10, previous_data[field] * 10 + 1]
-            )
-        elif "_weight" in field and "state" not in field:
-            values = np.concatenate(
+    with atomic_output(target_dataset.file(year)) as output, h5py.File(
+        output, "w"
+    ) as h5_file:
+        file = DatasetWriter(h5_file)
+        if layers is not None:
+            file.attrs[LAYERS] = layers
+        donor_group = file.create_group(DONORS)
+        for entity, mask in donors.items():
+            donor_group[entity] = mask
+        write_survey_ids(
+            file,
+            {
+                entity: np.concatenate([values, values])
+                for entity, values in survey.items()
+            },
+        )
+        for field, (blocks, dtype) in linked.items():
+            write_virtual(file, field, blocks * 2, dtype)
+        for field in previous_data:
+            if field in ID_ENTITY:
+                offset = sizes[ID_ENTITY[field]]
+                values = np.concatenate([ids[field], ids[field] + offset])
+            elif "_weight" in field and "state" not in field:
+                values = np.concatenate(
+                    [
+                        previous_data[field] * (1 - weighting),
+                        previous_data[field] * weighting,
+                    ]
+                )
+            elif field in mapping:
+                values = np.concatenate([previous_data[field], mapping[field]])
+            elif len(previous_data[field]) > 1:
+                values = np.concatenate(
+                    [previous_data[field], previous_data[field]]
+                )
+            else:
+                values = previous_data[field]
+            try:
+                file[field] = values
+            except TypeError:
+                file[field] = values.astype("S")
+        write_entity_index(h5_file)
+
+
+def split_variable(
+    source: h5py.Dataset,
+    donors: np.array,
+    main: h5py.Group,
+    clones: h5py.Group,
+):
+    """Writes the records of a variable that are not donors to one group and
+    the donor records to another. A variable referencing a base file whose
+    donors all follow the other records is split into references too.
+
+    Args:
+        source (h5py.Dataset): The variable.
+        donors (np.array): Whether each record is a donor.
+        main (h5py.Group): The group for the other records.
+        clones (h5py.Group): The group for the donor records.
+    """
+    name = source.name.split("/")[-1]
+    num_kept = (~donors).sum()
+    if source.is_virtual and not donors[:num_kept].any():
+        blocks = virtual_blocks(source)
+        boundaries = np.cumsum([length for _, _, length in blocks])
+        if num_kept in boundaries:
+            split = list(boundaries).index(num_kept) + 1
+            write_virtual(main, name, blocks[:split], source.dtype)
+            write_virtual(clones, name, blocks[split:], source.dtype)
+            return
+    values = source[...]
+    main[name] = values[~donors]
+    clones[name] = values[donors]
+
+
+def split_clones(dataset: type, year: int):
+    """Moves the zero-weight donor records of a dataset into a separate group,
+    so that loads and simulations see only the weighted records. The donors
+    can be restored with `append_clones`.
+
+    Args:
+        dataset (type): The dataset.
+        year (int): The year.
+    """
+    with dataset.load(year) as data, atomic_output(
+        dataset.file(year)
+    ) as output, h5py.File(output, "w") as h5_file:
+        file = DatasetWriter(h5_file)
+        if DONORS not in data:
+            raise ValueError(f"{dataset.name} ({year}) records no donors.")
+        donors = {entity: data.donors(entity) for entity in ENTITY_LEVELS}
+        clones = file.create_group(CLONES)
+        # Number the records with the donors last, so that each part (and
+        # their concatenation) is numbered from zero
+        order = {
+            entity: np.argsort(mask, kind="stable")
+            for entity, mask in donors.items()
+        }
+        ids = normalize_ids(
+            {
+                name: data[name][...][order[data.entity(name)]]
+                for name in ID_ENTITY
+                if name in data
+            }
+        )
+        survey = survey_ids(data)
+        write_survey_ids(
+            file,
+            {
+                entity: values[~donors[entity]]
+                for entity, values in survey.items()
+            },
+        )
+        write_survey_ids(
+            clones,
+            {
+                entity: values[donors[entity]]
+                for entity, values in survey.items()
+            },
+        )
+        for field in data.keys():
+            entity = data.entity(field)
+            if field in ids:
+                num_kept = (~donors[entity]).sum()
+                file[field] = ids[field][:num_kept]
+                clones[field] = ids[field][num_kept:]
+            elif entity in donors:
+                split_variable(data[field], donors[entity], file, clones)
+            else:
+                file[field] = data[field][...]
+        for key, value in data.attrs.items():
+            file.attrs[key] = value
+        write_entity_index(h5_file)
+        write_value_index(h5_file)
+
+
+def append_clones(dataset: type, year: int):
+    """Appends the donor records stored apart by `split_clones` back to each
+    variable, marking them as donors.
+
+    Args:
+        dataset (type): The dataset.
+        year (int): The year.
+    """
+    with dataset.load(year) as data, atomic_output(
+        dataset.file(year)
+    ) as output, h5py.File(output, "w") as h5_file:
+        file = DatasetWriter(h5_file)
+        if CLONES not in data:
+            raise ValueError(f"{dataset.name} ({year}) has no stored clones.")
+        clones = data[CLONES]
+        ids = {}
+        for field in data.keys():
+            main = data[field]
+            if field in ID_ENTITY:
+                ids[field] = np.concatenate([main[...], clones[field][...]])
+            elif field not in clones:
+                file[field] = main[...]
+            elif main.is_virtual and clones[field].is_virtual:
+                blocks = virtual_blocks(main) + virtual_blocks(clones[field])
+                write_virtual(file, field, blocks, main.dtype)
+            else:
+                file[field] = np.concatenate([main[...], clones[field][...]])
+        for field, values in normalize_ids(ids).items():
+            file[field] = values
+        main_ids, clone_ids = survey_ids(data), survey_ids(clones)
+        write_survey_ids(
+            file,
+            {
+                entity: np.concatenate([values, clone_ids[entity]])
+                for entity, values in main_ids.items()
+            },
+        )
+        donors = file.create_group(DONORS)
+        for entity in ENTITY_LEVELS:
+            num_clones = len(clones[ENTITY_ID_VARIABLES[entity]])
+            donors[entity] = np.concatenate(
                 [
-                    previous_data[field] * (1 - weighting),
-                    previous_data[field] * weighting,
+                    np.zeros(data.sizes[entity], dtype=bool),
+                    np.ones(num_clones, dtype=bool),
                 ]
             )
-        elif field in mapping:
-            values = np.concatenate([previous_data[field], mapping[field]])
-        elif len(previous_data[field]) > 1:
-            values = np.concatenate(
-                [previous_data[field], previous_data[field]]
-            )
-        else:
-            values = previous_data[field]
-        try:
-            file[field] = values
-        except TypeError:
-            file[field] = values.astype("S")
-    file.close()
+        for key, value in data.attrs.items():
+            file.attrs[key] = value
+        write_entity_index(h5_file)
+        write_value_index(h5_file)
 
 
 def add_variables(dataset: type, year: int, variables: Dict[str, ArrayLike]):
     data = dataset.load(year)
     previous_data = {key: data[key][...] for key in data.keys()}
+    previous_data.update(normalized_ids(data))
+    survey = survey_ids(data)
     data.close()
-    f = h5py.File(dataset.file(year), "w")
-    for field in previous_data:
-        try:
-            f[field] = previous_data[field]
-        except TypeError:
-            f[field] = previous_data[field].astype("S")
-    for field in variables:
-        try:
-            f[field] = variables[field]
-        except TypeError:
-            f[field] = variables[field].astype("S")
-    f.close()
-
-
-def subsample(dataset: type, year: int, frac: float = 0.5):
-    # Not yet working
-    """Subsamples a dataset.
+    with atomic_output(dataset.file(year)) as output, h5py.File(
+        output, "w"
+    ) as f:
+        write_survey_ids(f, survey)
+        for field in previous_data:
+            try:
+                f[field] = previous_data[field]
+            except TypeError:
+                f[field] = previous_data[field].astype("S")
+        for field in variables:
+            try:
+                f[field] = variables[field]
+            except TypeError:
+                f[field] = variables[field].astype("S")
+        write_entity_index(f)
+
+
+def select_households(
+    dataset: type, year: int, where, target_dataset: type = None
+):
+    """Writes the households matching a condition, with their benefit units
+    and persons, as a new dataset (e.g. a Scottish or renters-only FRS).
+    Weights are unchanged, so totals are those of the matching population,
+    and IDs are numbered from zero.
+
+    Args:
+        dataset (type): The dataset to filter.
+        year (int): The year to filter.
+        where: The condition (see `DatasetFile.households`).
+        target_dataset (type, optional): The dataset to write to. Defaults to None
+            (overwrite the dataset).
+    """
+    if target_dataset is None:
+        target_dataset = dataset
+    with dataset.load(year) as data:
+        selection = data.subset(data.households(where), reindex=True)
+        survey = survey_ids(data)
+    with atomic_output(target_dataset.file(year)) as output, h5py.File(
+        output, "w"
+    ) as file:
+        selection.write(file)
+        write_survey_ids(
+            file,
+            {
+                entity: values[selection.positions[entity]]
+                for entity, values in survey.items()
+            },
+        )
+
+
+def stratum_codes(data: h5py.File, stratify_by: Tuple[str]) -> np.array:
+    """Assigns each household a stratum code from household-level variables.
+
+    Args:
+        data (h5py.File): The model dataset file.
+        stratify_by (Tuple[str]): The household variables to stratify by.
+
+    Returns:
+        np.array: A stratum code (0..k-1) for each household.
+    """
+    num_households = len(data["household_id"])
+    columns = [np.zeros(num_households, dtype=int)]
+    for variable in stratify_by:
+        if variable not in data:
+            logging.warning(
+                f"Stratification variable {variable} not found, ignoring."
+            )
+            continue
+        columns.append(np.unique(data[variable][...], return_inverse=True)[1])
+    return np.unique(np.stack(columns), axis=1, return_inverse=True)[1]
+
+
+def subsample(
+    dataset: type,
+    year: int,
+    frac: float = 0.5,
+    stratify_by: Tuple[str] = ("region", "tenure_type"),
+    seed: int = None,
+    target_dataset: type = None,
+    entities: Dict[str, str] = None,
+):
+    """Subsamples a dataset by households, using only the stored ID arrays. A
+    fraction of households is sampled from each stratum, and weights are
+    scaled so that each stratum keeps its weighted total. IDs are numbered
+    from zero.
+
+    Each variable's entity is found from its length and name, or from the
+    entities recorded in the file. Where entities have the same number of
+    records and neither says which a variable belongs to, it must be given in
+    `entities`, and is recorded in the subsample. Donor records and layer
+    references are kept.
 
     Args:
         dataset (type): The dataset to subsample.
         year (int): The year to subsample.
-        frac (float, optional): The fraction of the data to subsample. Defaults to 0.5.
+        frac (float, optional): The fraction of households to keep. Defaults to 0.5.
+        stratify_by (Tuple[str], optional): Household variables to stratify by.
+            Defaults to ("region", "tenure_type").
+        seed (int, optional): The random seed. Defaults to None.
+        target_dataset (type, optional): The dataset to write to. Defaults to None
+            (overwrite the dataset).
+        entities (Dict[str, str], optional): The entity of each variable
+            whose length and name do not determine it.
     """
-    from openfisca_uk import Microsimulation
-
-    sim = Microsimulation(
-        dataset=dataset,
-        year=year,
-        adjust_weights=False,
-        add_baseline_variables=False,
-        duplicate_records=False,
-    )
-
-    household_ids = sim.calc("household_id").sample(frac=frac)
-    person_in_sample = sim.calc("household_id", map_to="person").isin(
-        household_ids
-    )
-    benunit_in_sample = sim.map_to(
-        sim.calc("household_id", map_to="person").values,
-        "person",
-        "benunit",
-        how="value_from_first_person",
-    )
-    household_in_sample = sim.calc("household_id").isin(household_ids)
-    state_in_sample = np.array([True])
-
-    weight_multiplier = (
-        sim.calc("households").sum()
-        / sim.calc("households")[household_in_sample].sum()
-    )
+    if target_dataset is None:
+        target_dataset = dataset
+    rng = np.random.default_rng(seed)
+    with dataset.load(year) as data:
+        data.entities.update(entities or {})
+        household_id = data["household_id"][...]
+        household_weight = data["household_weight"][...]
+        stratum = stratum_codes(data, stratify_by)
 
-    data = dataset.load(year)
-    previous_data = {key: data[key][...] for key in data.keys()}
-    data.close()
+        # Shuffle households within strata, and keep the first frac of each
+        num_strata = stratum.max() + 1
+        order = np.lexsort((rng.random(len(household_id)), stratum))
+        stratum_size = np.bincount(stratum, minlength=num_strata)
+        stratum_start = np.cumsum(stratum_size) - stratum_size
+        rank = np.empty(len(household_id), dtype=int)
+        rank[order] = (
+            np.arange(len(household_id)) - stratum_start[stratum[order]]
+        )
+        num_sampled = np.maximum(np.round(stratum_size * frac), 1)
+        household_in_sample = rank < num_sampled[stratum]
 
-    for variable in previous_data:
-        try:
-            entity = sim.simulation.tax_benefit_system.variables[
-                variable
-            ].entity.key
-        except KeyError:
-            if len(previous_data[variable]) == len(person_in_sample):
-                entity = "person"
-            elif len(previous_data[variable]) == len(benunit_in_sample):
-                entity = "benunit"
-            else:
-                entity = "household"
+        # Scale weights so each stratum keeps its weighted total
+        stratum_weight = np.bincount(
+            stratum, weights=household_weight, minlength=num_strata
+        )
+        sampled_weight = np.bincount(
+            stratum[household_in_sample],
+            weights=household_weight[household_in_sample],
+            minlength=num_strata,
+        )
+        weight_multiplier = np.where(
+            sampled_weight > 0,
+            stratum_weight / np.where(sampled_weight > 0, sampled_weight, 1),
+            stratum_size / num_sampled,
+        )[stratum]
+
+        person_household = id_positions(
+            household_id, data["person_household_id"][...]
+        )
+        benunit_id = data["benunit_id"][...]
+        person_benunit = id_positions(
+            benunit_id, data["person_benunit_id"][...]
+        )
+        benunit_household = np.empty(len(benunit_id), dtype=int)
+        benunit_household[person_benunit] = person_household
 
         in_sample = dict(
-            person=person_in_sample,
-            benunit=benunit_in_sample,
+            person=household_in_sample[person_household],
+            benunit=household_in_sample[benunit_household],
             household=household_in_sample,
-            state=state_in_sample,
-        )[entity]
-
-        previous_data[variable] = previous_data[variable][in_sample]
-
-    previous_data["household_weight"] = (
-        previous_data["household_weight"].astype(float) * weight_multiplier
-    )
-    previous_data["benunit_weight"] = (
-        previous_data["benunit_weight"].astype(float) * weight_multiplier
-    )
-
-    file = h5py.File(dataset.file(year), "w")
-    for field in previous_data:
-        try:
-            file[field] = previous_data[field]
-        except TypeError:
-            file[field] = previous_data[field].astype("S")
-    file.close()
+        )
+        multiplier = dict(
+            person=weight_multiplier[person_household],
+            benunit=weight_multiplier[benunit_household],
+            household=weight_multiplier,
+        )
+        survey = survey_ids(data)
+
+        with atomic_output(target_dataset.file(year)) as output, h5py.File(
+            output, "w"
+        ) as h5_file:
+            file = DatasetWriter(h5_file)
+            ids = {}
+            for field in data.keys():
+                values = data[field][...]
+                entity = data.entity(field)
+                if entity == "state":
+                    file[field] = values
+                    continue
+                values = values[in_sample[entity]]
+                if field in ID_ENTITY:
+                    ids[field] = values
+                    continue
+                if "_weight" in field:
+                    values = values * multiplier[entity][in_sample[entity]]
+                file[field] = values
+            for field, values in normalize_ids(ids).items():
+                file[field] = values
+            write_survey_ids(
+                h5_file,
+                {
+                    entity: values[in_sample[entity]]
+                    for entity, values in survey.items()
+                },
+            )
+            if DONORS in data:
+                donor_group = h5_file.create_group(DONORS)
+                for entity in ENTITY_LEVELS:
+                    donor_group[entity] = data.donors(entity)[
+                        in_sample[entity]
+                    ]
+            if entities:
+                write_variable_entities(h5_file, entities)
+            if LAYERS in data.attrs:
+                h5_file.attrs[LAYERS] = data.attrs[LAYERS]
+            write_entity_index(h5_file)
@@ -0,0 +1,579 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+import os
+from pathlib import Path
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+import h5py
+import numpy as np
+import pandas as pd
+from openfisca_uk_data.storage import DatasetWriter, densify, unpack_column
+from openfisca_uk_data.utils import atomic_update
+
+DEFAULT_CHUNK_SIZE = 50_000
+
+
+def training_weights(x: pd.DataFrame, weights: np.array = None) -> np.array:
+    """Finds the donor weights, from a MicroDataFrame if none are given."""
+    if weights is None and hasattr(x, "weights"):
+        weights = x.weights
+    if weights is None:
+        return None
+    return np.asarray(weights, dtype=float)
+
+
+class RecipientSource(ABC):
+    """Recipient predictors, read in chunks of rows."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abstractmethod
+    def chunks(self, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """Yields the predictors for consecutive chunks of rows."""
+
+
+class FrameSource(RecipientSource):
+    """Recipient predictors held in a data frame."""
+
+    def __init__(self, frame: pd.DataFrame):
+        self.frame = frame
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def chunks(self, chunk_size: int) -> Iterator[pd.DataFrame]:
+        for start in range(0, len(self), chunk_size):
+            yield pd.DataFrame(self.frame.iloc[start : start + chunk_size])
+
+
+class HDF5Source(RecipientSource):
+    """Recipient predictors stored as variables of one entity in a model
+    dataset file, read a chunk of rows at a time.
+
+    Args:
+        data (h5py.File): The model dataset file.
+        columns (List[str]): The predictor variables.
+        transforms (Dict[str, callable], optional): Functions applied to
+            the values of a predictor in each chunk, e.g. to encode regions.
+    """
+
+    def __init__(
+        self, data: h5py.File, columns: List[str], transforms: dict = None
+    ):
+        self.data = data
+        self.columns = columns
+        self.transforms = transforms or {}
+
+    def __len__(self) -> int:
+        return len(self.data[self.columns[0]])
+
+    def chunks(self, chunk_size: int) -> Iterator[pd.DataFrame]:
+        for start in range(0, len(self), chunk_size):
+            chunk = {}
+            for column in self.columns:
+                values = self.data[column][start : start + chunk_size]
+                if column in self.transforms:
+                    values = self.transforms[column](values)
+                chunk[column] = values
+            # Rows are labelled by position, as in a `FrameSource`
+            yield pd.DataFrame(
+                chunk, index=pd.RangeIndex(start, start + len(values))
+            )
+
+
+@contextmanager
+def stored_recipients(
+    columns: Iterable[Tuple[str, np.array]],
+) -> Iterator[HDF5Source]:
+    """Stores recipient predictors in a scratch file as they are computed,
+    so that only one predictor is held in memory at a time, and provides
+    them as an `HDF5Source`.
+
+    Args:
+        columns (Iterable[Tuple[str, np.array]]): The name and values of
+            each predictor, e.g. from a generator.
+
+    Yields:
+        HDF5Source: The stored predictors.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "recipients.h5"
+        names = []
+        with h5py.File(path, mode="w") as f:
+            for name, values in columns:
+                f[name] = np.asarray(values, dtype=float)
+                names.append(name)
+        with h5py.File(path, mode="r") as f:
+            yield HDF5Source(f, names)
+
+
+def recipient_source(
+    x: Union[pd.DataFrame, RecipientSource],
+) -> RecipientSource:
+    if isinstance(x, RecipientSource):
+        return x
+    return FrameSource(x)
+
+
+class ImputationEngine(ABC):
+    """Base class for imputation models: fitted on donor predictors and
+    targets, then used to predict targets for recipients.
+
+    Args:
+        max_donors (int, optional): If set, fit on a sample of at most this
+            many donors, drawn with probability proportional to their weight.
+        random_state (int, optional): The random seed.
+    """
+
+    # Whether predictions for separate chunks of recipients can be made
+    # independently (and in parallel) once fitted. If not, all recipients are
+    # predicted together, and memory use grows with their number
+    chunkable = True
+
+    def __init__(self, max_donors: int = None, random_state: int = None):
+        self.max_donors = max_donors
+        self.random_state = random_state
+        self.rng = np.random.default_rng(random_state)
+
+    def donors(
+        self, x: pd.DataFrame, y: pd.DataFrame, weights: np.array
+    ) -> Tuple[np.array, np.array, np.array]:
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if self.max_donors is None or len(x) <= self.max_donors:
+            return x, y, weights
+        p = None if weights is None else weights / weights.sum()
+        sample = self.rng.choice(
+            len(x), size=self.max_donors, replace=False, p=p
+        )
+        # Weights are accounted for by the sampling probabilities
+        return x[sample], y[sample], None
+
+    def fit(
+        self, x: pd.DataFrame, y: pd.DataFrame, weights: np.array = None
+    ) -> "ImputationEngine":
+        """Fits the model on donor records.
+
+        Args:
+            x (pd.DataFrame): The donor predictors.
+            y (pd.DataFrame): The donor targets.
+            weights (np.array, optional): The donor weights. Defaults to the
+                weights of `x` if it is a MicroDataFrame.
+
+        Returns:
+            ImputationEngine: The fitted engine.
+        """
+        self.predictors = list(x.columns)
+        self.columns = list(y.columns)
+        self._fit(*self.donors(x, y, training_weights(x, weights)))
+        return self
+
+    def predict(
+        self, x: pd.DataFrame, rng: np.random.Generator = None
+    ) -> pd.DataFrame:
+        """Imputes targets for recipient records.
+
+        Args:
+            x (pd.DataFrame): The recipient predictors, selected (and
+                ordered) by name as in the donor predictors.
+            rng (np.random.Generator, optional): The random number generator
+                to sample with. Defaults to the engine's.
+
+        Returns:
+            pd.DataFrame: The imputed targets.
+        """
+        x = np.asarray(x[self.predictors], dtype=float)
+        return pd.DataFrame(
+            self._predict(x, rng or self.rng),
+            columns=self.columns,
+        )
+
+    def impute(
+        self,
+        x_train: pd.DataFrame,
+        y_train: pd.DataFrame,
+        x_new: Union[pd.DataFrame, RecipientSource],
+        weights: np.array = None,
+    ) -> pd.DataFrame:
+        if isinstance(x_new, RecipientSource):
+            x_new = pd.concat(list(x_new.chunks(DEFAULT_CHUNK_SIZE)))
+        return self.fit(x_train, y_train, weights).predict(x_new)
+
+    def impute_to(
+        self,
+        x_train: pd.DataFrame,
+        y_train: pd.DataFrame,
+        x_new: Union[pd.DataFrame, RecipientSource],
+        target: h5py.File,
+        offset: int = 0,
+        weights: np.array = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        threads: int = None,
+    ):
+        """Fits the model and writes imputed targets for recipients straight
+        into the columns of a dataset file, a chunk of recipients at a time.
+        Chunks are predicted on a thread pool, a few at a time, so memory use
+        does not grow with the number of recipients. Engines that are not
+        `chunkable` (`SynthimputeEngine`, the default) are the exception: they
+        predict every recipient at once, so memory use grows with the number
+        of recipients.
+
+        Args:
+            x_train (pd.DataFrame): The donor predictors.
+            y_train (pd.DataFrame): The donor targets.
+            x_new (Union[pd.DataFrame, RecipientSource]): The recipients.
+            target (h5py.File): The file to write to, open for writing.
+                Existing columns are written from row `offset`; missing
+                columns are created with `offset + len(x_new)` rows. Each
+                column is then stored by the precision and sparse policies
+                (see `DatasetWriter`).
+            offset (int, optional): The row of the first recipient in the
+                target columns. Defaults to 0.
+            weights (np.array, optional): The donor weights.
+            chunk_size (int, optional): The recipients per chunk.
+            threads (int, optional): The chunks to predict at once. Defaults
+                to the number of CPUs.
+        """
+        source = recipient_source(x_new)
+        self.fit(x_train, y_train, weights)
+        writer = DatasetWriter(target)
+        # Columns are written at full precision, then stored by the writer's
+        # policies once complete
+        for column in self.columns:
+            densify(target, column)
+            unpack_column(target, column)
+            if column not in target:
+                target.create_dataset(
+                    column, shape=(offset + len(source),), dtype=float
+                )
+            else:
+                values = target[column][...].astype(float)
+                del target[column]
+                target[column] = values
+        if self.chunkable:
+            chunks = source.chunks(chunk_size)
+        else:
+            chunks = iter([pd.concat(list(source.chunks(chunk_size)))])
+        threads = threads or os.cpu_count()
+        # One random stream per chunk, so results do not depend on threading
+        seeds = np.random.SeedSequence(self.random_state)
+        start = offset
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            while True:
+                window = list(islice(chunks, threads))
+                if not window:
+                    break
+                rngs = map(np.random.default_rng, seeds.spawn(len(window)))
+                for prediction in pool.map(self.predict, window, rngs):
+                    stop = start + len(prediction)
+                    for column in self.columns:
+                        target[column][start:stop] = prediction[column].values
+                    start = stop
+        for column in self.columns:
+            writer.rewrite(column)
+
+    @abstractmethod
+    def _fit(self, x: np.array, y: np.array, weights: np.array):
+        """Fits the model on donor predictor and target arrays."""
+
+    @abstractmethod
+    def _predict(self, x: np.array, rng: np.random.Generator) -> np.array:
+        """Predicts an array of targets from recipient predictors."""
+
+
+class SynthimputeEngine(ImputationEngine):
+    """Random forest quantile imputation with `synthimpute.rf_impute`, the
+    original imputation method. Keyword arguments are passed to `rf_impute`.
+    The forest is fitted when predicting, so recipients are not chunked: all
+    of them are held in memory at once, even when read from a file (see
+    `ImputationEngine.impute_to`). Use another engine to bound memory use.
+    """
+
+    chunkable = False
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self.kwargs = kwargs
+
+    def _fit(self, x, y, weights):
+        self.x_train = pd.DataFrame(x, columns=self.predictors)
+        self.y_train = pd.DataFrame(y, columns=self.columns)
+
+    def _predict(self, x, rng):
+        import synthimpute as si
+
+        return np.asarray(
+            si.rf_impute(
+                x_train=self.x_train,
+                y_train=self.y_train,
+                x_new=pd.DataFrame(x, columns=self.predictors),
+                **self.kwargs,
+            )
+        )
+
+
+class RandomForestEngine(ImputationEngine):
+    """Random forest imputation using all cores. Each recipient's values are
+    the prediction of one randomly chosen tree, which samples from the
+    forest's predictive distribution rather than taking its mean.
+
+    Args:
+        n_estimators (int, optional): The number of trees. Defaults to 100.
+        n_jobs (int, optional): The number of threads. Defaults to -1 (all).
+        min_samples_leaf (int, optional): Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        n_estimators: int = 100,
+        n_jobs: int = -1,
+        min_samples_leaf: int = 1,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.n_estimators = n_estimators
+        self.n_jobs = n_jobs
+        self.min_samples_leaf = min_samples_leaf
+
+    def _fit(self, x, y, weights):
+        from sklearn.ensemble import RandomForestRegressor
+
+        self.model = RandomForestRegressor(
+            n_estimators=self.n_estimators,
+            n_jobs=self.n_jobs,
+            min_samples_leaf=self.min_samples_leaf,
+            random_state=self.random_state,
+        ).fit(x, y, sample_weight=weights)
+
+    def _predict(self, x, rng):
+        trees = self.model.estimators_
+        choice = rng.integers(len(trees), size=len(x))
+        result = np.zeros((len(x), len(self.columns)))
+        for i, tree in enumerate(trees):
+            rows = choice == i
+            if rows.any():
+                result[rows] = tree.predict(x[rows]).reshape(rows.sum(), -1)
+        return result
+
+
+class QuantileGradientBoostingEngine(ImputationEngine):
+    """Histogram gradient boosting quantile regression. One model is fitted per
+    target and quantile; each recipient is given a random quantile (shared
+    across targets) and the corresponding predictions. The quantile loss
+    needs scikit-learn 1.1 or later (and so Python 3.8 or later).
+
+    Args:
+        quantiles (Tuple[float], optional): The quantiles to model. Defaults
+            to the deciles 0.05, 0.15, ..., 0.95.
+        max_iter (int, optional): Boosting iterations per model. Defaults to
+            100.
+    """
+
+    def __init__(
+        self,
+        quantiles: Tuple[float] = tuple(np.arange(0.05, 1, 0.1)),
+        max_iter: int = 100,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.quantiles = quantiles
+        self.max_iter = max_iter
+
+    def _fit(self, x, y, weights):
+        from sklearn.ensemble import HistGradientBoostingRegressor
+
+        self.models = [
+            [
+                HistGradientBoostingRegressor(
+                    loss="quantile",
+                    quantile=quantile,
+                    max_iter=self.max_iter,
+                    random_state=self.random_state,
+                ).fit(x, y[:, target], sample_weight=weights)
+                for quantile in self.quantiles
+            ]
+            for target in range(y.shape[1])
+        ]
+
+    def _predict(self, x, rng):
+        choice = rng.integers(len(self.quantiles), size=len(x))
+        result = np.zeros((len(x), len(self.columns)))
+        for i in range(len(self.quantiles)):
+            rows = choice == i
+            if rows.any():
+                for target, models in enumerate(self.models):
+                    result[rows, target] = models[i].predict(x[rows])
+        return result
+
+
+def cell_keys(x: np.array) -> Tuple[np.array, np.array]:
+    """Finds the distinct rows of the exact-match columns, and the cell of
+    each record."""
+    if x.shape[1] == 0:
+        return np.zeros((1, 0)), np.zeros(len(x), dtype=int)
+    keys, inverse = np.unique(x, axis=0, return_inverse=True)
+    return keys, inverse.reshape(-1)
+
+
+class NearestNeighbourEngine(ImputationEngine):
+    """Weighted nearest-neighbour hot-deck (statistical matching). Within each
+    cell of exact-match predictors (e.g. region), recipients are matched to
+    one of their `k` nearest donors on the other (standardised) predictors,
+    chosen with probability proportional to donor weight. Whole donor target
+    vectors are transferred, preserving their joint distribution. Recipients
+    in a cell without donors are matched against all donors.
+
+    Args:
+        k (int, optional): The number of neighbours to choose from. Defaults
+            to 10.
+        cells (Tuple[str], optional): The exact-match predictors, where
+            present. Defaults to ("region",).
+        workers (int, optional): The threads used for neighbour queries.
+            Defaults to -1 (all).
+    """
+
+    def __init__(
+        self,
+        k: int = 10,
+        cells: Tuple[str] = ("region",),
+        workers: int = -1,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.k = k
+        self.cells = cells
+        self.workers = workers
+
+    def _fit(self, x, y, weights):
+        from scipy.spatial import cKDTree
+
+        self.cell_columns = [
+            self.predictors.index(cell)
+            for cell in self.cells
+            if cell in self.predictors
+        ]
+        self.distance_columns = [
+            i for i in range(x.shape[1]) if i not in self.cell_columns
+        ]
+        distances = x[:, self.distance_columns]
+        self.mean = distances.mean(axis=0)
+        self.std = distances.std(axis=0)
+        self.std[self.std == 0] = 1
+        z = (distances - self.mean) / self.std
+        self.y = y
+        self.weights = np.ones(len(x)) if weights is None else weights
+        keys, inverse = cell_keys(x[:, self.cell_columns])
+        self.trees = {None: (np.arange(len(x)), cKDTree(z))}
+        for i, key in enumerate(keys):
+            donors = np.flatnonzero(inverse == i)
+            self.trees[tuple(key)] = donors, cKDTree(z[donors])
+
+    def match(
+        self,
+        z: np.array,
+        donors: np.array,
+        tree,
+        rng: np.random.Generator,
+    ) -> np.array:
+        """Chooses a donor for each recipient among its nearest neighbours.
+
+        Args:
+            z (np.array): The standardised recipient predictors.
+            donors (np.array): The donor positions in the tree.
+            tree (cKDTree): The tree of standardised donor predictors.
+            rng (np.random.Generator): The random number generator.
+
+        Returns:
+            np.array: The chosen donor positions.
+        """
+        k = min(self.k, len(donors))
+        _, neighbours = tree.query(z, k=k, workers=self.workers)
+        neighbours = neighbours.reshape(len(z), k)
+        cumulative = np.cumsum(self.weights[donors[neighbours]], axis=1)
+        draw = rng.random(len(z)) * cumulative[:, -1]
+        choice = (cumulative < draw[:, None]).sum(axis=1).clip(max=k - 1)
+        return donors[neighbours[np.arange(len(z)), choice]]
+
+    def _predict(self, x, rng):
+        z = (x[:, self.distance_columns] - self.mean) / self.std
+        result = np.zeros((len(x), len(self.columns)))
+        keys, inverse = cell_keys(x[:, self.cell_columns])
+        for i, key in enumerate(keys):
+            rows = np.flatnonzero(inverse == i)
+            donors, tree = self.trees.get(tuple(key), self.trees[None])
+            result[rows] = self.y[self.match(z[rows], donors, tree, rng)]
+        return result
+
+
+ENGINES = dict(
+    synthimpute=SynthimputeEngine,
+    random_forest=RandomForestEngine,
+    gradient_boosting=QuantileGradientBoostingEngine,
+    nearest_neighbour=NearestNeighbourEngine,
+)
+
+
+def get_engine(
+    engine: Union[str, dict, ImputationEngine] = None,
+    default: ImputationEngine = None,
+) -> ImputationEngine:
+    """Creates an imputation engine from a name in `ENGINES`, a specification
+    dictionary (a `name` key plus engine arguments, e.g.
+    `dict(name="random_forest", n_estimators=50, max_donors=100_000)`) or an
+    engine instance.
+
+    Args:
+        engine (Union[str, dict, ImputationEngine], optional): The engine.
+        default (ImputationEngine, optional): The engine to use if `engine`
+            is None. Defaults to `SynthimputeEngine()`.
+
+    Returns:
+        ImputationEngine: The engine.
+    """
+    if engine is None:
+        return default or SynthimputeEngine()
+    if isinstance(engine, ImputationEngine):
+        return engine
+    if isinstance(engine, dict):
+        engine = dict(engine)
+        return ENGINES[engine.pop("name")](**engine)
+    return ENGINES[engine]()
+
+
+def run_imputation(
+    engine: ImputationEngine,
+    x_train: pd.DataFrame,
+    y_train: pd.DataFrame,
+    x_new: Union[pd.DataFrame, RecipientSource],
+    output_file: Path = None,
+    offset: int = 0,
+    **kwargs,
+) -> pd.DataFrame:
+    """Runs an imputation, returning the imputed targets or, if an output
+    file is given, writing them into its columns chunk by chunk (see
+    `ImputationEngine.impute_to`).
+
+    Args:
+        engine (ImputationEngine): The engine.
+        x_train (pd.DataFrame): The donor predictors.
+        y_train (pd.DataFrame): The donor targets.
+        x_new (Union[pd.DataFrame, RecipientSource]): The recipients.
+        output_file (Path, optional): The dataset file to write to, which is
+            replaced atomically (see `atomic_update`).
+        offset (int, optional): The row of the first recipient in the output
+            columns. Defaults to 0.
+        **kwargs: Other arguments to `ImputationEngine.impute_to`.
+
+    Returns:
+        pd.DataFrame: The imputed targets, or None if written to a file.
+    """
+    if output_file is None:
+        return engine.impute(x_train, y_train, x_new)
+    with atomic_update(output_file) as path, h5py.File(
+        path, mode="a"
+    ) as target:
+        engine.impute_to(x_train, y_train, x_new, target, offset, **kwargs)
@@ -1,10 +1,18 @@
-from typing import Tuple
+from typing import Iterator, Tuple
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from openfisca_uk_data.datasets.frs.frs import FRS
 from openfisca_uk_data.datasets.lcf import RawLCF
 from microdf import MicroDataFrame
-import synthimpute as si
+from openfisca_uk_data.datasets.frs.frs_enhanced.donors import donor_artifact
+from openfisca_uk_data.datasets.frs.frs_enhanced.imputation import (
+    ImputationEngine,
+    SynthimputeEngine,
+    get_engine,
+    run_imputation,
+    stored_recipients,
+)
 
 CATEGORY_NAMES = dict(
     # Top-level COICOP categories
@@ -62,13 +70,29 @@ REGIONS = {
     12: "NORTHERN_IRELAND",
 }
 
+# The code of each region, as an imputation predictor
+REGION_CODES = {name: float(i) for i, name in REGIONS.items()}
+
 
-def impute_consumption(year: int, dataset: type = FRS) -> pd.Series:
+def impute_consumption(
+    year: int,
+    dataset: type = FRS,
+    engine: ImputationEngine = None,
+    output_file: Path = None,
+    offset: int = 0,
+) -> pd.Series:
     """Impute consumption by fitting a random forest model.
 
     Args:
         year (int): The year of LCFS to use.
         dataset (type): The dataset to use.
+        engine (ImputationEngine, optional): The imputation engine (or its
+            name or specification, see `get_engine`). Defaults to synthimpute.
+        output_file (Path, optional): If given, the imputed values are
+            written into this dataset file (from row `offset`) a chunk at a
+            time, and None is returned.
+        offset (int, optional): The row of the first recipient in the
+            output columns. Defaults to 0.
 
     Returns:
         pd.Series: The imputed consumption categories.
@@ -78,11 +102,18 @@ def impute_consumption(year: int, dataset: type = FRS) -> pd.Series:
     lcf = load_lcfs(year)
 
     # Impute LCF consumption to FRS households
-    return impute_consumption_to_FRS(lcf, year, dataset)
+    return impute_consumption_to_FRS(
+        lcf, year, dataset, engine, output_file, offset
+    )
 
 
 def impute_consumption_to_FRS(
-    lcf: MicroDataFrame, year: int, dataset: type = FRS
+    lcf: MicroDataFrame,
+    year: int,
+    dataset: type = FRS,
+    engine: ImputationEngine = None,
+    output_file: Path = None,
+    offset: int = 0,
 ) -> pd.Series:
     """Impute consumption to the FRS.
 
@@ -90,50 +121,95 @@ def impute_consumption_to_FRS(
         lcf (MicroDataFrame): The LCF data.
         year (int): The year of the FRS to use.
         dataset (type): The dataset to use.
+        engine (ImputationEngine, optional): The imputation engine.
+        output_file (Path, optional): The dataset file to write to, if any.
+        offset (int, optional): The row of the first recipient in the
+            output columns. Defaults to 0.
 
     Returns:
         MicroDataFrame: The imputed consumption.
     """
+    x_train, y_train = lcf_donor_data(lcf)
+    with stored_recipients(lcf_recipients(year, dataset)) as x_new:
+        return run_imputation(
+            get_engine(
+                engine, SynthimputeEngine(verbose=True, ignore_target=True)
+            ),
+            x_train,
+            y_train,
+            x_new,
+            output_file,
+            offset,
+        )
+
+
+def lcf_donor_data(lcf: MicroDataFrame) -> Tuple[pd.DataFrame]:
+    """Prepares the LCF donor predictors and targets.
 
-    from openfisca_uk import Microsimulation
+    Args:
+        lcf (MicroDataFrame): The LCF data.
 
-    sim = Microsimulation(
-        dataset=dataset,
-        year=year,
-        adjust_weights=False,
-        add_baseline_variables=False,
-    )
+    Returns:
+        Tuple[pd.DataFrame]: The donor predictors and donor targets.
+    """
+    lcf.region = lcf.region.map(REGION_CODES)
+    # The donor weights are used as weights, not as a predictor
+    x_train = lcf.drop(CATEGORY_VARIABLES + ["weight"], axis=1)
+    return x_train, lcf[CATEGORY_VARIABLES]
 
-    frs = sim.df(
-        [
-            "is_adult",
-            "is_child",
-            "region",
-            "employment_income",
-            "self_employment_income",
-            "state_pension",
-            "pension_income",
-        ],
-        map_to="household",
-    )
 
-    frs.region = frs.region.map(
-        {name: float(i) for i, name in REGIONS.items()}
-    )
-    lcf.region = lcf.region.map(
-        {name: float(i) for i, name in REGIONS.items()}
-    )
-    return si.rf_impute(
-        x_train=lcf.drop(CATEGORY_VARIABLES, axis=1),
-        y_train=lcf[CATEGORY_VARIABLES],
-        x_new=frs,
-        verbose=True,
-        ignore_target=True,
-    )
+def lcf_recipients(
+    year: int, dataset: type = FRS
+) -> Iterator[Tuple[str, np.array]]:
+    """Reads the FRS household recipient predictors, one at a time.
+
+    Args:
+        year (int): The year of the FRS to use.
+        dataset (type): The recipient dataset.
+
+    Yields:
+        Tuple[str, np.array]: The name and values of each predictor.
+    """
+    # The predictors are stored inputs (or simple functions of them), so
+    # they are read without a simulation
+    with dataset.load(year) as data:
+        age = data.calc("age")
+        index = data.entity_index
+        yield "is_adult", index.sum(age >= 18, "person", "household")
+        yield "is_child", index.sum(age < 18, "person", "household")
+        yield "region", pd.Series(data.calc("region")).map(REGION_CODES).values
+        for predictor, variable in (
+            ("employment_income", "employment_income"),
+            ("self_employment_income", "self_employment_income"),
+            ("state_pension", "state_pension_reported"),
+            ("pension_income", "pension_income"),
+        ):
+            yield predictor, data.calc(variable, map_to="household")
+
+
+def lcf_imputation_data(
+    lcf: MicroDataFrame, year: int, dataset: type = FRS
+) -> Tuple[pd.DataFrame]:
+    """Prepares the LCF donor predictors and targets, and the FRS recipient
+    predictors.
+
+    Args:
+        lcf (MicroDataFrame): The LCF data.
+        year (int): The year of the FRS to use.
+        dataset (type): The recipient dataset.
+
+    Returns:
+        Tuple[pd.DataFrame]: The donor predictors, donor targets and
+            recipient predictors.
+    """
+    x_train, y_train = lcf_donor_data(lcf)
+    x_new = pd.DataFrame(dict(lcf_recipients(year, dataset)))
+    return x_train, y_train, x_new
 
 
 def load_lcfs(year: int) -> MicroDataFrame:
-    """Load LCF data.
+    """Load LCF data, from the stored donor artifact if the raw survey file
+    is unchanged.
 
     Args:
         year (int): The year of LCFS to use.
@@ -141,28 +217,38 @@ def load_lcfs(year: int) -> MicroDataFrame:
     Returns:
         MicroDataFrame: The LCF data
     """
-    households, people = load_and_process_lcf(year)
-    spending = households[list(CATEGORY_NAMES.keys())].unstack().reset_index()
-    spending.columns = "category", "household", "spending"
-    spending["household"] = households.case[spending.household].values
-    households = households.set_index("case")
-    spending.category = spending.category.map(CATEGORY_NAMES).map(
-        name_to_variable_name
+    return donor_artifact(
+        "lcf_2019", RawLCF.file(2019), lambda: process_lcfs(year)
     )
-    spending.spending *= 52
-    spending["weight"] = households.weighta[spending.household].values * 1000
-    spending = MicroDataFrame(spending, weights=spending.weight)
 
-    for category in spending.category.unique():
-        spending[category] = (
-            spending.category == category
-        ) * spending.spending
 
+def process_lcfs(year: int) -> MicroDataFrame:
+    """Process the LCF household and person tables into household donor
+    records.
+
+    Args:
+        year (int): The year of LCFS to use.
+
+    Returns:
+        MicroDataFrame: The LCF data
+    """
+    households, people = load_and_process_lcf(year)
+    households = households.set_index("case")
+    weight = households.weighta * 1000
+
+    # Weekly spending by category, annualised
     lcf_df = (
-        pd.DataFrame(spending[["household", "weight"] + CATEGORY_VARIABLES])
-        .groupby("household")
-        .sum()
-    )
+        households[list(CATEGORY_NAMES)].rename(
+            columns={
+                code: name_to_variable_name[name]
+                for code, name in CATEGORY_NAMES.items()
+            }
+        )
+        * 52
+    ).fillna(0)
+    # Matches the weight column of the previous long-format aggregation,
+    # which summed one row per category
+    lcf_df.insert(0, "weight", weight * len(CATEGORY_NAMES))
 
     # Add in LCF variables that also appear in the FRS-based microsimulation model
 
@@ -194,7 +280,7 @@ def load_lcfs(year: int) -> MicroDataFrame:
 
     # Return household-level LCF dataset with categorised consumption
     # and FRS-shared columns
-    return MicroDataFrame(lcf, weights=households.weighta[lcf.index] * 1000)
+    return MicroDataFrame(lcf, weights=weight[lcf.index])
 
 
 def load_and_process_lcf(
@@ -209,7 +295,13 @@ def load_and_process_lcf(
     Returns:
         Tuple[pd.DataFrame, pd.DataFrame]: The LCF household and person tables.
     """
-    households = RawLCF.load(2019, "lcfs_2019_dvhh_ukanon")
-    people = RawLCF.load(2019, "lcfs_2019_dvper_ukanon201920")
+    households = RawLCF.load(2019, "lcfs_2019_dvhh_ukanon")[
+        ["case", "weighta"]
+        + list(CATEGORY_NAMES)
+        + list(HOUSEHOLD_LCF_RENAMES)
+    ]
+    people = RawLCF.load(2019, "lcfs_2019_dvper_ukanon201920")[
+        ["case"] + list(PERSON_LCF_RENAMES)
+    ]
 
     return households, people
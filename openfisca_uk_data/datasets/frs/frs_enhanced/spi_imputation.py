@@ -1,14 +1,21 @@
 import logging
 from microdf import MicroDataFrame
 import pandas as pd
-import synthimpute as si
-from typing import Dict, List
+from typing import Dict, Iterator, List, Tuple
 import h5py
 import numpy as np
 from numpy.typing import ArrayLike
+from pathlib import Path
 
 from openfisca_uk_data.datasets.frs.frs import FRS
 from openfisca_uk_data.datasets.spi.spi import SPI
+from openfisca_uk_data.datasets.frs.frs_enhanced.imputation import (
+    ImputationEngine,
+    SynthimputeEngine,
+    get_engine,
+    run_imputation,
+    stored_recipients,
+)
 
 PREDICTORS = [
     "age",
@@ -28,44 +35,101 @@ IMPUTATIONS = [
 ]
 
 
-def impute_incomes(dataset: type = FRS, year: int = 2019) -> MicroDataFrame:
+def impute_incomes(
+    dataset: type = FRS,
+    year: int = 2019,
+    engine: ImputationEngine = None,
+    output_file: Path = None,
+    offset: int = 0,
+) -> MicroDataFrame:
     """Imputation of high incomes from the SPI.
 
     Args:
         dataset (type): The dataset to clone.
         year (int): The year to clone.
+        engine (ImputationEngine, optional): The imputation engine (or its
+            name or specification, see `get_engine`). Defaults to synthimpute.
+        output_file (Path, optional): If given, the imputed values are
+            written into this dataset file (from row `offset`) a chunk at a
+            time, and None is returned.
+        offset (int, optional): The row of the first recipient in the
+            output columns. Defaults to 0.
 
     Returns:
         Dict[str, ArrayLike]: The mapping from the original dataset to the cloned dataset.
     """
+    x_train, y_train, region_codes = spi_donor_data()
+    with stored_recipients(
+        spi_recipients(dataset, year, region_codes)
+    ) as x_new:
+        return run_imputation(
+            get_engine(engine, SynthimputeEngine(verbose=True)),
+            x_train,
+            y_train,
+            x_new,
+            output_file,
+            offset,
+        )
+
+
+def spi_donor_data() -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, float]]:
+    """Loads the SPI donor predictors and targets.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame, Dict[str, float]]: The donor
+            predictors, donor targets and the code of each region.
+    """
     from openfisca_uk import Microsimulation
 
     # Most recent SPI used - if it's before the FRS year then data will be uprated
     # automatically by OpenFisca-UK
     spi = Microsimulation(dataset=SPI)
-    frs = Microsimulation(
-        dataset=dataset,
-        year=year,
-        adjust_weights=False,
-        duplicate_records=False,
-        add_baseline_variables=False,
-    )
 
     regions = spi.calc("region").unique()
+    region_codes = {name: float(i) for i, name in enumerate(regions)}
 
     spi_df = spi.df(PREDICTORS + IMPUTATIONS)
-    frs_df = frs.df(PREDICTORS)
-
-    frs_df.region = frs_df.region.map(
-        {name: float(i) for i, name in enumerate(regions)}
-    )
-    spi_df.region = spi_df.region.map(
-        {name: float(i) for i, name in enumerate(regions)}
-    )
-
-    return si.rf_impute(
-        x_train=spi_df.drop(IMPUTATIONS, axis=1),
-        y_train=spi_df[IMPUTATIONS],
-        x_new=frs_df,
-        verbose=True,
-    )
+    spi_df.region = spi_df.region.map(region_codes)
+
+    return spi_df.drop(IMPUTATIONS, axis=1), spi_df[IMPUTATIONS], region_codes
+
+
+def spi_recipients(
+    dataset: type, year: int, region_codes: Dict[str, float]
+) -> Iterator[Tuple[str, np.array]]:
+    """Reads the FRS recipient predictors, one at a time.
+
+    Args:
+        dataset (type): The recipient dataset.
+        year (int): The recipient year.
+        region_codes (Dict[str, float]): The code of each region.
+
+    Yields:
+        Tuple[str, np.array]: The name and values of each predictor.
+    """
+    # The FRS predictors are stored inputs, so no simulation is needed
+    with dataset.load(year) as frs:
+        for predictor in PREDICTORS:
+            values = frs.calc(predictor, map_to="person")
+            if predictor == "region":
+                values = pd.Series(values).map(region_codes).values
+            yield predictor, values
+
+
+def spi_imputation_data(
+    dataset: type = FRS, year: int = 2019
+) -> Tuple[pd.DataFrame]:
+    """Loads the SPI donor predictors and targets, and the FRS recipient
+    predictors.
+
+    Args:
+        dataset (type): The recipient dataset.
+        year (int): The recipient year.
+
+    Returns:
+        Tuple[pd.DataFrame]: The donor predictors, donor targets and
+            recipient predictors.
+    """
+    x_train, y_train, region_codes = spi_donor_data()
+    x_new = pd.DataFrame(dict(spi_recipients(dataset, year, region_codes)))
+    return x_train, y_train, x_new
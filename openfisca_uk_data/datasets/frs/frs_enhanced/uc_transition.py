@@ -1,5 +1,6 @@
 from typing import Dict
 from openfisca_uk_data.datasets.frs.frs import FRS
+import numpy as np
 from numpy.typing import ArrayLike
 
 LEGACY_BENEFITS = [
@@ -25,25 +26,20 @@ def migrate_to_universal_credit(
     Returns:
         Dict[str, ArrayLike]: Variables with replaced values.
     """
-    from openfisca_uk import Microsimulation
-
-    frs = Microsimulation(
-        dataset=dataset,
-        year=year,
-        adjust_weights=False,
-        duplicate_records=False,
-        add_baseline_variables=False,
-    )
-
-    changes = {
-        "universal_credit_reported": frs.calc(
-            "universal_credit_reported", period=year
-        ).values
-    }
-
-    for benefit in LEGACY_BENEFITS:
-        reported_amount = frs.calc(benefit + "_reported", period=year).values
-        changes[benefit + "_reported"] = reported_amount * 0
-        changes["universal_credit_reported"] += reported_amount
+    with dataset.load(year) as frs:
+        if "universal_credit_reported" in frs:
+            universal_credit = frs.calc("universal_credit_reported")
+        else:
+            # Unreported benefits are zero
+            universal_credit = np.zeros(frs.sizes["person"])
+        changes = {"universal_credit_reported": universal_credit.astype(float)}
+
+        for benefit in LEGACY_BENEFITS:
+            if benefit + "_reported" not in frs:
+                # Unreported benefits are zero
+                continue
+            reported_amount = frs.calc(benefit + "_reported")
+            changes[benefit + "_reported"] = reported_amount * 0
+            changes["universal_credit_reported"] += reported_amount
 
     return changes
@@ -1,24 +1,95 @@
 from microdf.generic import MicroDataFrame
 from openfisca_uk_data.datasets.was.raw_was import RawWAS
 from openfisca_uk_data.datasets.frs.frs import FRS
+import numpy as np
 import pandas as pd
 import microdf as mdf
-import synthimpute as si
-
-
-def impute_wealth(year: int, dataset: type = FRS) -> pd.Series:
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+from openfisca_uk_data.datasets.frs.frs_enhanced.donors import donor_artifact
+from openfisca_uk_data.datasets.frs.frs_enhanced.imputation import (
+    ImputationEngine,
+    SynthimputeEngine,
+    get_engine,
+    run_imputation,
+    stored_recipients,
+)
+
+# The predictors shared by the WAS and the FRS
+TRAIN_COLS = [
+    "household_net_income",
+    "num_adults",
+    "num_children",
+    "pension_income",
+    "employment_income",
+    "self_employment_income",
+    "investment_income",
+    "num_bedrooms",
+    "council_tax",
+    "is_renting",
+]
+
+IMPUTE_COLS = [
+    "owned_land",
+    "property_wealth",
+    "corporate_wealth",
+    "gross_financial_wealth",
+    "net_financial_wealth",
+    "main_residence_value",
+    "other_residential_property_value",
+    "non_residential_property_value",
+]
+
+
+def impute_wealth(
+    year: int,
+    dataset: type = FRS,
+    engine: ImputationEngine = None,
+    output_file: Path = None,
+    offset: int = 0,
+) -> pd.Series:
     """Impute wealth by fitting a random forest model.
 
     Args:
         year (int): The year of simulation.
         dataset (type): The dataset to use.
+        engine (ImputationEngine, optional): The imputation engine (or its
+            name or specification, see `get_engine`). Defaults to synthimpute.
+        output_file (Path, optional): If given, the imputed values are
+            written into this dataset file (from row `offset`) a chunk at a
+            time, and None is returned.
+        offset (int, optional): The row of the first recipient in the
+            output columns. Defaults to 0.
 
     Returns:
         pd.Series: The predicted wealth values.
     """
-
     was = load_and_process_was()
+    with stored_recipients(was_recipients(year, dataset)) as x_new:
+        return run_imputation(
+            get_engine(
+                engine, SynthimputeEngine(verbose=True, ignore_target=True)
+            ),
+            was[TRAIN_COLS],
+            was[IMPUTE_COLS],
+            x_new,
+            output_file,
+            offset,
+        )
+
+
+def was_recipients(
+    year: int, dataset: type = FRS
+) -> Iterator[Tuple[str, np.array]]:
+    """Computes the FRS household recipient predictors, one at a time.
+
+    Args:
+        year (int): The year of simulation.
+        dataset (type): The recipient dataset.
 
+    Yields:
+        Tuple[str, np.array]: The name and values of each predictor.
+    """
     from openfisca_uk import Microsimulation
 
     sim = Microsimulation(
@@ -28,59 +99,78 @@ def impute_wealth(year: int, dataset: type = FRS) -> pd.Series:
         add_baseline_variables=False,
     )
 
-    TRAIN_COLS = [
-        "household_net_income",
-        "num_adults",
-        "num_children",
-        "pension_income",
-        "employment_income",
-        "self_employment_income",
-        "investment_income",
-        "num_bedrooms",
-        "council_tax",
-        "is_renting",
-    ]
-
-    IMPUTE_COLS = [
-        "owned_land",
-        "property_wealth",
-        "corporate_wealth",
-        "gross_financial_wealth",
-        "net_financial_wealth",
-        "main_residence_value",
-        "other_residential_property_value",
-        "non_residential_property_value",
-    ]
-
-    # FRS has investment income split between dividend and savings interest.
-    frs_cols = [i for i in TRAIN_COLS if i != "investment_income"]
-    frs_cols += [
-        "dividend_income",
-        "savings_interest_income",
-        "people",
-        "household_net_income",
-        "household_weight",
-    ]
-
-    frs = sim.df(frs_cols, map_to="household", period=year)
-    frs["investment_income"] = (
-        frs.savings_interest_income + frs.dividend_income
-    )
+    def household_values(variable: str) -> np.array:
+        return np.asarray(sim.calc(variable, map_to="household", period=year))
 
-    return si.rf_impute(
-        x_train=was[TRAIN_COLS],
-        y_train=was[IMPUTE_COLS],
-        x_new=frs[TRAIN_COLS],
-        verbose=True,
-        ignore_target=True,
-    )
+    for column in TRAIN_COLS:
+        if column == "investment_income":
+            # FRS has investment income split between dividend and savings
+            # interest.
+            values = household_values(
+                "savings_interest_income"
+            ) + household_values("dividend_income")
+        else:
+            values = household_values(column)
+        yield column, values
+
+
+def was_imputation_data(year: int, dataset: type = FRS) -> Tuple[pd.DataFrame]:
+    """Loads the WAS donor predictors and targets, and the FRS recipient
+    predictors.
+
+    Args:
+        year (int): The year of simulation.
+        dataset (type): The recipient dataset.
+
+    Returns:
+        Tuple[pd.DataFrame]: The donor predictors, donor targets and
+            recipient predictors.
+    """
+    was = load_and_process_was()
+    x_new = pd.DataFrame(dict(was_recipients(year, dataset)))
+    return was[TRAIN_COLS], was[IMPUTE_COLS], x_new
+
+
+def load_and_process_was() -> MicroDataFrame:
+    """Loads the processed Wealth and Assets Survey households, from the
+    stored donor artifact if the raw survey file is unchanged.
 
+    Returns:
+            MicroDataFrame: The processed dataframe.
+    """
+    return donor_artifact("was_2019", RawWAS.file(2019), process_was)
+
+
+def find_columns(columns: List[str], names: List[str]) -> Dict[str, str]:
+    """Finds the raw WAS columns for the wanted (lower-case) names, allowing
+    for the round letter differing ("r" or "w").
+
+    Args:
+        columns (List[str]): The raw (lower-case) column names.
+        names (List[str]): The wanted column names.
 
-def load_and_process_was() -> pd.DataFrame:
+    Returns:
+        Dict[str, str]: The raw column for each wanted name.
+    """
+    columns = set(columns)
+    found = {}
+    for name in names:
+        key = name
+        if key not in columns:
+            key = key.replace("r", "w")
+        if key not in columns:
+            key = key.replace("w", "r")
+        if key not in columns:
+            raise ValueError(f"Could not find column {key}")
+        found[name] = key
+    return found
+
+
+def process_was() -> MicroDataFrame:
     """Process the Wealth and Assets Survey household wealth file.
 
     Returns:
-            pd.DataFrame: The processed dataframe.
+            MicroDataFrame: The processed dataframe.
     """
     RENAMES = {
         "R7xshhwgt": "weight",
@@ -126,30 +216,13 @@ def load_and_process_was() -> pd.DataFrame:
 
     was = RawWAS.load(2019, "was_round_7_hhold_eul_jan_2022")
 
-    was = was.rename(columns={col: col.lower() for col in was.columns})
-
-    to_remove = []
-    to_add = {}
-
-    for key in RENAMES:
-        old_key = str(key)
-        if key not in was.columns:
-            key = key.replace("r", "w")
-        if key not in was.columns:
-            key = key.replace("w", "r")
-        if key not in was.columns:
-            raise ValueError(f"Could not find column {key}")
-        else:
-            to_add[key] = RENAMES[old_key]
-            to_remove.append(old_key)
-
-    for key in to_remove:
-        del RENAMES[key]
-
-    for key in to_add:
-        RENAMES[key] = to_add[key]
+    was.columns = was.columns.str.lower()
+    columns = find_columns(was.columns, list(RENAMES))
 
-    was = was.rename(columns=RENAMES).fillna(0)[list(RENAMES.values())]
+    # Keep only the needed columns before any processing
+    was = was[list(columns.values())]
+    was.columns = [RENAMES[name] for name in columns]
+    was = was.fillna(0)
 
     was["is_renting"] = was["is_renter"] == 1
 
@@ -0,0 +1,184 @@
+from openfisca_uk_data.utils import *
+from openfisca_uk_data.datasets.frs.frs import FRS
+from openfisca_uk_data.datasets.frs.frs_enhanced import FRSEnhanced
+from openfisca_uk_data.entities import (
+    ENTITY_INDEX,
+    ID_ENTITY,
+    INDEX_OFFSET_ENTITY,
+    EntityIndex,
+    normalized_ids,
+    survey_ids,
+    write_survey_ids,
+)
+from openfisca_uk_data.storage import DatasetFile
+import numpy as np
+import h5py
+import logging
+from tqdm import tqdm
+
+# The number of survey years pooled by default, ending at the given year
+POOLED_YEARS = 3
+
+SOURCE_YEAR = "source_year"
+
+
+def pooled_years(year: int, num_years: int = POOLED_YEARS) -> List[int]:
+    return list(range(int(year) - int(num_years) + 1, int(year) + 1))
+
+
+def pool_variable(
+    name: str,
+    sources: List[DatasetFile],
+    target: h5py.File,
+):
+    """Writes a variable of the pooled dataset one source at a time, so that
+    memory use is bounded by the size of the variable in a single source.
+    IDs are numbered from zero, each source's following those of the sources
+    before it, and weights are divided by the number of sources. Sources
+    without the variable are filled with zeros.
+
+    Args:
+        name (str): The variable name.
+        sources (List[DatasetFile]): The source datasets.
+        target (h5py.File): The file to write to.
+    """
+    present = [source for source in sources if name in source]
+    if len(present[-1][name]) <= 1:
+        target[name] = present[-1][name][...]
+        return
+    entity = present[0].entity(name)
+    lengths = [source.sizes[entity] for source in sources]
+    is_id = name in ID_ENTITY
+    is_weight = "_weight" in name and "state" not in name
+    if is_id:
+        dtype = np.int32
+    elif is_weight:
+        dtype = np.float64
+    else:
+        dtype = present[0][name].dtype
+        for source in present[1:]:
+            dtype = np.promote_types(dtype, source[name].dtype)
+    out = target.create_dataset(
+        name,
+        shape=(sum(lengths),),
+        dtype=dtype,
+        chunks=(min(max(lengths), 2**16),),
+    )
+    start = 0
+    offset = 0
+    for k, (source, length) in enumerate(zip(sources, lengths)):
+        if name not in source:
+            logging.warning(
+                f"{name} is missing from source {k}, filling with zeros."
+            )
+            values = np.zeros(length, dtype=dtype)
+        else:
+            values = source[name][...]
+        if is_id:
+            values = normalized_ids(source)[name] + offset
+            offset += source.sizes[ID_ENTITY[name]]
+        elif is_weight:
+            values = values / len(sources)
+        out[start : start + length] = values
+        start += length
+
+
+def pool_entity_index(indices: List[EntityIndex], target: h5py.File):
+    """Writes the entity index of the pooled dataset by offsetting each
+    source's index, rather than rebuilding it from the IDs.
+
+    Args:
+        indices (List[EntityIndex]): The source entity indices.
+        target (h5py.File): The file to write to.
+    """
+    group = target.create_group(ENTITY_INDEX)
+    for key in indices[0].arrays:
+        offsets = key.endswith("_offsets")
+        # Offsets have a leading zero, stored once
+        arrays = [index.arrays[key][int(offsets) :] for index in indices]
+        out = group.create_dataset(
+            key,
+            shape=(sum(map(len, arrays)) + int(offsets),),
+            dtype=indices[0].arrays[key].dtype,
+        )
+        start = int(offsets)
+        if offsets:
+            out[0] = 0
+        offset = 0
+        for index, values in zip(indices, arrays):
+            out[start : start + len(values)] = values + offset
+            start += len(values)
+            offset += index.sizes[INDEX_OFFSET_ENTITY[key]]
+
+
+def pool_datasets(sources: List[Tuple[type, int]], target: h5py.File):
+    """Stacks several dataset-years into one model dataset, one variable at a
+    time, with collision-free IDs, weights divided by the number of sources
+    and a household-level `source_year` variable.
+
+    Args:
+        sources (List[Tuple[type, int]]): The (dataset, year) sources.
+        target (h5py.File): The file to write to.
+    """
+    files = [dataset.load(year) for dataset, year in sources]
+    try:
+        names = list(dict.fromkeys(sum((file.keys() for file in files), [])))
+        for name in tqdm(names, desc="Pooling variables"):
+            pool_variable(name, files, target)
+        target[SOURCE_YEAR] = np.concatenate(
+            [
+                np.full(file.sizes["household"], year)
+                for file, (_, year) in zip(files, sources)
+            ]
+        )
+        file_ids = [survey_ids(file) for file in files]
+        write_survey_ids(
+            target,
+            {
+                entity: np.concatenate([ids[entity] for ids in file_ids])
+                for entity in file_ids[0]
+            },
+        )
+        pool_entity_index([file.entity_index for file in files], target)
+    finally:
+        for file in files:
+            file.close()
+
+
+@dataset
+class PooledFRS:
+    name = "pooled_frs"
+    model = UK
+
+    def requires(
+        year: int, num_years: int = POOLED_YEARS, enhanced: bool = False
+    ) -> list:
+        source = FRSEnhanced if enhanced else FRS
+        return [
+            (source, input_year)
+            for input_year in pooled_years(year, num_years)
+        ]
+
+    def generate(
+        year: int, num_years: int = POOLED_YEARS, enhanced: bool = False
+    ):
+        """Generates a pooled FRS: the survey years up to and including
+        `year`, stacked into one dataset with weights divided by the number of
+        years, for analysis of small areas and groups.
+
+        Args:
+            year (int): The last year to pool.
+            num_years (int, optional): The number of years to pool. Defaults
+                to 3.
+            enhanced (bool, optional): Whether to pool the enhanced FRS
+                rather than the FRS. Defaults to False.
+        """
+        inputs = PooledFRS.requires(year, num_years, enhanced)
+        for source, input_year in inputs:
+            if input_year not in source.years:
+                logging.info(f"Generating {source.name} ({input_year})")
+                source.generate(input_year)
+        with atomic_output(PooledFRS.file(year)) as output, h5py.File(
+            output, mode="w"
+        ) as target:
+            pool_datasets(inputs, target)
@@ -3,7 +3,12 @@ from typing import List
 from openfisca_uk_data.utils import dataset
 import pandas as pd
 import shutil
-from openfisca_uk_data.utils import DATA_DIR, safe_rmdir, data_folder
+from openfisca_uk_data.utils import (
+    DATA_DIR,
+    atomic_output,
+    data_folder,
+    scratch_folder,
+)
 import re
 from tqdm import tqdm
 import h5py
@@ -22,13 +27,13 @@ class RawFRS:
         if not folder.exists():
             raise FileNotFoundError("Invalid path supplied.")
 
-        new_folder = RawFRS.data_dir / "tmp"
-        shutil.unpack_archive(folder, new_folder)
-        folder = new_folder
+        with scratch_folder(RawFRS.data_dir) as folder:
+            shutil.unpack_archive(zipfile, folder)
 
-        main_folder = next(folder.iterdir())
-        tab_folder = main_folder / "tab"
-        if tab_folder.exists():
+            main_folder = next(folder.iterdir())
+            tab_folder = main_folder / "tab"
+            if not tab_folder.exists():
+                raise FileNotFoundError("Could not find the TAB files.")
             criterion = re.compile("[a-z]+\.tab")
             data_files = [
                 path
@@ -36,7 +41,9 @@ class RawFRS:
                 if criterion.match(path.name)
             ]
             task = tqdm(data_files, desc="Saving raw data tables")
-            with pd.HDFStore(RawFRS.file(year)) as file:
+            with atomic_output(RawFRS.file(year)) as output, pd.HDFStore(
+                output
+            ) as file:
                 for filepath in task:
                     task.set_description(
                         f"Saving raw data tables ({filepath.name})"
@@ -46,16 +53,22 @@ class RawFRS:
                         filepath, delimiter="\t", low_memory=False
                     ).apply(pd.to_numeric, errors="coerce")
                     df.columns = df.columns.str.upper()
+                    # Survey IDs, computed in integer arithmetic
+                    keys = df[
+                        df.columns.intersection(
+                            ["SERNUM", "BENUNIT", "PERSON"]
+                        )
+                    ].astype(np.int64)
                     if "PERSON" in df.columns:
                         df["person_id"] = (
-                            df.SERNUM * 1e2 + df.BENUNIT * 1e1 + df.PERSON
-                        ).astype(int)
+                            keys.SERNUM * 100 + keys.BENUNIT * 10 + keys.PERSON
+                        )
                     if "BENUNIT" in df.columns:
                         df["benunit_id"] = (
-                            df.SERNUM * 1e2 + df.BENUNIT * 1e1
-                        ).astype(int)
+                            keys.SERNUM * 100 + keys.BENUNIT * 10
+                        )
                     if "SERNUM" in df.columns:
-                        df["household_id"] = (df.SERNUM * 1e2).astype(int)
+                        df["household_id"] = keys.SERNUM * 100
                     if table_name in ("adult", "child"):
                         df.set_index("person_id", inplace=True)
                     elif table_name == "benunit":
@@ -63,9 +76,3 @@ class RawFRS:
                     elif table_name == "househol":
                         df.set_index("household_id", inplace=True)
                     file[table_name] = df
-        else:
-            raise FileNotFoundError("Could not find the TAB files.")
-
-        tmp_folder = RawFRS.data_dir / "tmp"
-        if tmp_folder.exists():
-            safe_rmdir(tmp_folder)
@@ -1,6 +1,11 @@
 from openfisca_uk_data.utils import *
 from openfisca_uk_data.datasets.frs.frs_enhanced import FRSEnhanced
-import shutil
+from openfisca_uk_data.entities import write_entity_index
+from openfisca_uk_data.storage import DatasetWriter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+import zlib
 import pandas as pd
 import numpy as np
 import h5py
@@ -9,51 +14,176 @@ from tqdm import tqdm
 
 DEFAULT_SYNTH_FILE = "https://github.com/PolicyEngine/openfisca-uk-data/releases/download/synth-frs-2019/synth_frs_2019.h5"
 
+# Identity columns are never changed, as this would break the entity structure
+ID_COLS = (
+    "person_id",
+    "person_benunit_id",
+    "person_benunit_role",
+    "person_household_id",
+    "person_household_role",
+    "person_state_id",
+    "person_state_role",
+    "benunit_id",
+    "household_id",
+    "state_id",
+)
+
+# Numeric columns are multiplied by a per-row factor in [1 - NOISE, 1 + NOISE]
+NOISE = 3e-2
+
+
+def variable_kind(name: str, values: h5py.Dataset) -> str:
+    """Classifies a stored variable by its name and storage metadata, without
+    reading its values.
+
+    Args:
+        name (str): The variable name.
+        values (h5py.Dataset): The stored variable.
+
+    Returns:
+        str: "fixed" (left unchanged), "categorical" (shuffled) or "numeric"
+            (shuffled and noised).
+    """
+    if name in ID_COLS or values.shape[0] <= 1:
+        return "fixed"
+    if values.dtype.kind == "f":
+        return "numeric"
+    # Byte strings (enums), booleans and integer codes
+    return "categorical"
+
+
+def variable_rng(seed: int, replica: int, name: str) -> np.random.Generator:
+    """Returns the random stream for a variable in a given replica. Streams are
+    independent across variables and replicas, and do not depend on the order
+    in which variables are processed.
+
+    Args:
+        seed (int): The root seed (entropy).
+        replica (int): The replica number.
+        name (str): The variable name.
+
+    Returns:
+        np.random.Generator: The random number generator.
+    """
+    sequence = np.random.SeedSequence(
+        seed, spawn_key=(replica, zlib.crc32(name.encode()))
+    )
+    return np.random.default_rng(sequence)
+
+
+def anonymise(
+    values: np.array, kind: str, rng: np.random.Generator
+) -> np.array:
+    """Shuffles a variable, adding multiplicative noise to numeric variables.
+
+    Args:
+        values (np.array): The original values.
+        kind (str): The variable kind (see `variable_kind`).
+        rng (np.random.Generator): The random stream to use.
+
+    Returns:
+        np.array: The anonymised values.
+    """
+    if kind == "fixed":
+        return values
+    result = rng.permutation(values)
+    if kind == "numeric":
+        result *= rng.uniform(1 - NOISE, 1 + NOISE, size=len(result))
+    return result
+
+
+def generate_replica(year: int, replica: int, seed: int, path: Path) -> Path:
+    """Writes one synthetic replica of the enhanced FRS, streaming one variable
+    at a time from the source file.
+
+    Args:
+        year (int): The year of the enhanced FRS to use.
+        replica (int): The replica number.
+        seed (int): The root seed.
+        path (Path): The file to write to.
+
+    Returns:
+        Path: The file written.
+    """
+    with FRSEnhanced.load(year) as source, atomic_output(
+        path
+    ) as output, h5py.File(output, mode="w") as file:
+        f = DatasetWriter(file)
+        for variable in source.keys():
+            values = source[variable]
+            kind = variable_kind(variable, values)
+            f[variable] = anonymise(
+                values[...], kind, variable_rng(seed, replica, variable)
+            )
+        write_entity_index(file)
+    return path
+
 
 @dataset
 class SynthFRS:
     name = "synth_frs"
     model = UK
 
-    def generate(year):
-        ID_COLS = (
-            "person_id",
-            "person_benunit_id",
-            "person_benunit_role",
-            "person_household_id",
-            "person_household_role",
-            "person_state_id",
-            "person_state_role",
-            "benunit_id",
-            "household_id",
-            "state_id",
-        )
+    def requires(year: int) -> list:
+        return [(FRSEnhanced, int(year))]
 
-        def anonymise(arr: np.array, name: str) -> pd.DataFrame:
-            result = pd.Series(arr)
-            if name not in ID_COLS:
-                # don't change identity columns, this breaks structures
-                if len(result.unique()) < 16:
-                    # shuffle categorical columns
-                    result = result.sample(frac=1).values
-                else:
-                    # shuffle + add noise to numeric columns
-                    # noise = between -3% and +3% added to each row
-                    noise = np.random.rand() * 3e-2 + 1.0
-                    result = result.sample(frac=1).values * noise
-            return result
-
-        data = FRSEnhanced.load(year)
-        year = int(year)
+    def generate(
+        year: int, replicas: int = 1, seed: int = None, processes: int = None
+    ):
+        """Generates synthetic versions of the enhanced FRS by shuffling each
+        variable and adding noise to numeric variables.
 
-        with h5py.File(SynthFRS.file(year), mode="w") as f:
-            for variable in data.keys():
-                try:
-                    f[variable] = anonymise(data[variable], variable)
-                except:
-                    f[variable] = anonymise(data[variable], variable).astype(
-                        "S"
+        Args:
+            year (int): The year to generate for.
+            replicas (int, optional): The number of distinct synthetic files to
+                generate. The first is stored as the main dataset file, others
+                with `SynthFRS.replica_file`, all published once every replica
+                has been written. Defaults to 1.
+            seed (int, optional): The root seed. Defaults to None (random).
+            processes (int, optional): The number of worker processes to use
+                for multiple replicas. Defaults to the number of CPUs.
+        """
+        year = int(year)
+        replicas = int(replicas)
+        seed = np.random.SeedSequence(
+            None if seed is None else int(seed)
+        ).entropy
+        if replicas == 1:
+            generate_replica(year, 0, seed, SynthFRS.file(year))
+            return
+        # Replicas after the first are written to temporary files, published
+        # together once all have been written, so a failed build leaves the
+        # previous replicas in place
+        with ExitStack() as outputs:
+            paths = [SynthFRS.file(year)] + [
+                outputs.enter_context(
+                    atomic_output(SynthFRS.replica_file(year, i))
+                )
+                for i in range(1, replicas)
+            ]
+            with ProcessPoolExecutor(
+                max_workers=None if processes is None else int(processes)
+            ) as pool:
+                list(
+                    tqdm(
+                        pool.map(
+                            generate_replica,
+                            [year] * replicas,
+                            range(replicas),
+                            [seed] * replicas,
+                            paths,
+                        ),
+                        total=replicas,
+                        desc="Generating synthetic replicas",
                     )
+                )
+
+    def replica_file(year: int, replica: int = 0) -> Path:
+        if replica == 0:
+            return SynthFRS.file(year)
+        return (
+            SynthFRS.data_dir / f"{SynthFRS.name}_{year}_replica_{replica}.h5"
+        )
 
     def download(year: int = 2019):
         if year == 2018:
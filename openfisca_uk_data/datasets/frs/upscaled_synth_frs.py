@@ -0,0 +1,188 @@
+from openfisca_uk_data.utils import *
+from openfisca_uk_data.datasets.frs.synth_frs import (
+    NOISE,
+    SynthFRS,
+    variable_kind,
+    variable_rng,
+)
+from openfisca_uk_data.entities import (
+    ENTITY_INDEX,
+    ID_ENTITY,
+    INDEX_OFFSET_ENTITY,
+    EntityIndex,
+    normalized_ids,
+    survey_ids,
+    write_survey_ids,
+)
+import numpy as np
+import h5py
+import logging
+from tqdm import tqdm
+
+
+def record_noise(seed: int, copy: int, entity: str, size: int) -> np.array:
+    """The multiplicative noise applied to the records of an entity in a
+    copy, shared by all of its numeric variables. The stream depends only on
+    the seed, copy and entity, so it is the same for every variable.
+
+    Args:
+        seed (int): The root seed (entropy).
+        copy (int): The copy number.
+        entity (str): The entity.
+        size (int): The number of records.
+
+    Returns:
+        np.array: One factor in [1 - NOISE, 1 + NOISE] per record.
+    """
+    return variable_rng(seed, copy, entity).uniform(
+        1 - NOISE, 1 + NOISE, size=size
+    )
+
+
+def upscale_variable(
+    name: str,
+    source: h5py.Dataset,
+    target: h5py.File,
+    factor: int,
+    seed: int,
+    offset: int = 0,
+    entity: str = None,
+):
+    """Writes `factor` entity-consistent copies of a variable, one copy at a
+    time, so that memory use is bounded by the size of the source variable.
+    Copy k of an ID variable (numbered from zero) is offset by `k * offset`,
+    generalising the scheme in `clone_and_replace_half`. Copies after the
+    first perturb each record as a whole: its numeric variables are all
+    scaled by the record's noise factor (see `record_noise`), and its other
+    variables kept, so records stay internally consistent.
+
+    Args:
+        name (str): The variable name.
+        source (h5py.Dataset): The source variable.
+        target (h5py.File): The file to write to.
+        factor (int): The number of copies.
+        seed (int): The root seed used to perturb copies after the first.
+        offset (int, optional): For ID variables, the number of records of
+            the entity they refer to. Defaults to 0.
+        entity (str, optional): The entity of the variable, whose record
+            noise numeric variables are scaled by.
+    """
+    values = source[...]
+    kind = variable_kind(name, source)
+    if len(values) <= 1:
+        target[name] = values
+        return
+    n = len(values)
+    is_id = name in ID_ENTITY
+    is_weight = "_weight" in name and "state" not in name
+    dtype = values.dtype
+    if is_id:
+        dtype = np.int32
+    elif is_weight:
+        dtype = np.float64
+    out = target.create_dataset(
+        name, shape=(n * factor,), dtype=dtype, chunks=(min(n, 2**16),)
+    )
+    for copy in range(factor):
+        if is_id:
+            copy_values = values + copy * offset
+        elif is_weight:
+            copy_values = values / factor
+        elif copy == 0 or kind != "numeric":
+            copy_values = values
+        else:
+            copy_values = values * record_noise(seed, copy, entity, n)
+        out[copy * n : (copy + 1) * n] = copy_values
+
+
+def upscale_entity_index(index: EntityIndex, target: h5py.File, factor: int):
+    """Writes the entity index of the upscaled dataset one copy at a time, by
+    offsetting the source index rather than rebuilding it from the IDs.
+
+    Args:
+        index (EntityIndex): The source entity index.
+        target (h5py.File): The file to write to.
+        factor (int): The number of copies.
+    """
+    group = target.create_group(ENTITY_INDEX)
+    for key, values in index.arrays.items():
+        offset = index.sizes[INDEX_OFFSET_ENTITY[key]]
+        if key.endswith("_offsets"):
+            # Offsets have a leading zero, stored once
+            values = values[1:]
+            out = group.create_dataset(
+                key, shape=(len(values) * factor + 1,), dtype=values.dtype
+            )
+            out[0] = 0
+            start = 1
+        else:
+            out = group.create_dataset(
+                key, shape=(len(values) * factor,), dtype=values.dtype
+            )
+            start = 0
+        for copy in range(factor):
+            out[
+                start + copy * len(values) : start + (copy + 1) * len(values)
+            ] = (values + copy * offset)
+
+
+@dataset
+class UpscaledSynthFRS:
+    name = "upscaled_synth_frs"
+    model = UK
+
+    def requires(year: int) -> list:
+        return [(SynthFRS, int(year))]
+
+    def generate(year: int, factor: int = 10, seed: int = None):
+        """Generates an upscaled synthetic population for load-testing, by
+        stacking `factor` copies of the synthetic FRS with IDs numbered from
+        zero and weights divided by `factor`. The numeric variables of each
+        record in copies after the first are scaled by a shared random
+        factor, so copies are not identical but records stay consistent.
+
+        Args:
+            year (int): The year of the synthetic FRS to upscale.
+            factor (int, optional): The upscaling factor. Defaults to 10.
+            seed (int, optional): The root seed. Defaults to None (random).
+        """
+        year = int(year)
+        factor = int(factor)
+        seed = np.random.SeedSequence(
+            None if seed is None else int(seed)
+        ).entropy
+        if year not in SynthFRS.years:
+            logging.info(f"Downloading synthetic FRS ({year})")
+            SynthFRS.download(year)
+        with SynthFRS.load(year) as source, atomic_output(
+            UpscaledSynthFRS.file(year)
+        ) as output, h5py.File(output, mode="w") as target:
+            ids = normalized_ids(source)
+            task = tqdm(list(source.keys()), desc="Upscaling variables")
+            for variable in task:
+                if variable in ids:
+                    upscale_variable(
+                        variable,
+                        ids[variable],
+                        target,
+                        factor,
+                        seed,
+                        source.sizes[ID_ENTITY[variable]],
+                    )
+                else:
+                    upscale_variable(
+                        variable,
+                        source[variable],
+                        target,
+                        factor,
+                        seed,
+                        entity=source.entity(variable),
+                    )
+            write_survey_ids(
+                target,
+                {
+                    entity: np.tile(values, factor)
+                    for entity, values in survey_ids(source).items()
+                },
+            )
+            upscale_entity_index(source.entity_index, target, factor)
@@ -2,7 +2,7 @@ from pathlib import Path
 from openfisca_uk_data.utils import dataset
 import pandas as pd
 import shutil
-from openfisca_uk_data.utils import safe_rmdir
+from openfisca_uk_data.utils import atomic_output, scratch_folder
 import re
 from tqdm import tqdm
 
@@ -18,21 +18,23 @@ class RawLCF:
         if not folder.exists():
             raise FileNotFoundError("Invalid path supplied.")
 
-        new_folder = RawLCF.data_dir / "tmp"
-        shutil.unpack_archive(folder, new_folder)
-        folder = new_folder
+        with scratch_folder(RawLCF.data_dir) as folder:
+            shutil.unpack_archive(zipfile, folder)
 
-        main_folder = next(folder.iterdir())
-        tab_folder = main_folder / "tab"
-        if tab_folder.exists():
-            criterion = re.compile(".*\.tab")
+            main_folder = next(folder.iterdir())
+            tab_folder = main_folder / "tab"
+            if not tab_folder.exists():
+                raise FileNotFoundError("Could not find the TAB files.")
+            criterion = re.compile(".*\\.tab")
             data_files = [
                 path
                 for path in tab_folder.iterdir()
                 if criterion.match(path.name)
             ]
             task = tqdm(data_files, desc="Saving raw data tables")
-            with pd.HDFStore(RawLCF.file(year)) as file:
+            with atomic_output(RawLCF.file(year)) as output, pd.HDFStore(
+                output
+            ) as file:
                 for filepath in task:
                     task.set_description(
                         f"Saving raw data tables ({filepath.name})"
@@ -42,9 +44,3 @@ class RawLCF:
                         filepath, delimiter="\t", low_memory=False
                     ).apply(pd.to_numeric, errors="coerce")
                     file[table_name] = df
-        else:
-            raise FileNotFoundError("Could not find the TAB files.")
-
-        tmp_folder = RawLCF.data_dir / "tmp"
-        if tmp_folder.exists():
-            safe_rmdir(tmp_folder)
@@ -14,15 +14,17 @@ class RawSPI:
         year = str(year)
         if not folder.exists():
             raise FileNotFoundError("Invalid path supplied")
-        new_folder = RawSPI.data_dir / "tmp"
-        shutil.unpack_archive(folder, new_folder)
-        folder = new_folder
-        main_folder = next(folder.iterdir())
-        with pd.HDFStore(RawSPI.file(year)) as file:
-            if (main_folder / "tab").exists():
-                data_folder = main_folder / "tab"
-                data_files = list(data_folder.glob("*.tab"))
-                task = tqdm(data_files, desc="Saving data tables")
+        with scratch_folder(RawSPI.data_dir) as folder:
+            shutil.unpack_archive(zipfile, folder)
+            main_folder = next(folder.iterdir())
+            if not (main_folder / "tab").exists():
+                raise FileNotFoundError("Could not find any TAB files.")
+            data_folder = main_folder / "tab"
+            data_files = list(data_folder.glob("*.tab"))
+            task = tqdm(data_files, desc="Saving data tables")
+            with atomic_output(RawSPI.file(year)) as output, pd.HDFStore(
+                output
+            ) as file:
                 for filepath in task:
                     task.set_description(f"Saving {filepath.name}")
                     table_name = "main"
@@ -31,11 +33,3 @@ class RawSPI:
                     ).apply(pd.to_numeric, errors="coerce")
                     df.columns = df.columns.str.upper()
                     file[table_name] = df
-            else:
-                raise FileNotFoundError("Could not find any TAB files.")
-
-        # Clean up tmp storage.
-
-        tmp_folder = RawSPI.data_dir / "tmp"
-        if tmp_folder.exists():
-            shutil.rmtree(tmp_folder)
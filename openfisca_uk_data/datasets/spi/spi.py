@@ -1,6 +1,8 @@
 from openfisca_uk_data.datasets.spi.raw_spi import RawSPI
 from openfisca_core.model_api import *
 from openfisca_uk_data.utils import *
+from openfisca_uk_data.entities import write_entity_index
+from openfisca_uk_data.storage import DatasetWriter
 import pandas as pd
 from pandas import DataFrame
 import h5py
@@ -14,6 +16,12 @@ class SPI:
     name = "spi"
     model = UK
 
+    def requires(year: int) -> list:
+        from openfisca_uk_data import FRS
+
+        # FRS records fill in the population below the SPI threshold
+        return [(RawSPI, int(year)), (FRS, int(year))]
+
     def generate(year: int) -> None:
         """Generates the SPI-based input dataset for OpenFisca-UK.
 
@@ -22,16 +30,18 @@ class SPI:
         """
 
         main = RawSPI.load(year, "main").fillna(0)
-        spi = h5py.File(SPI.file(year), mode="w")
-
         main = extend_spi_main_table(main)
 
-        add_id_variables(spi, main)
-        add_demographics(spi, main)
-        add_incomes(spi, main)
-
         # Generate OpenFisca-UK variables and save
-        spi.close()
+        with atomic_output(SPI.file(year)) as output:
+            file = h5py.File(output, mode="w")
+            spi = DatasetWriter(file)
+            add_id_variables(spi, main)
+            add_demographics(spi, main)
+            add_incomes(spi, main)
+            write_entity_index(file)
+            spi.log_report()
+            file.close()
 
 
 def extend_spi_main_table(main: DataFrame) -> DataFrame:
@@ -0,0 +1,395 @@
+from typing import Dict, Tuple
+import h5py
+import numpy as np
+
+ENTITIES = ("person", "benunit", "household", "state")
+
+ENTITY_ID_VARIABLES = dict(
+    person="person_id",
+    benunit="benunit_id",
+    household="household_id",
+    state="state_id",
+)
+
+
+def entity_sizes(data: h5py.File) -> Dict[str, int]:
+    """Finds the number of records of each entity from the stored ID arrays.
+
+    Args:
+        data (h5py.File): The model dataset file.
+
+    Returns:
+        Dict[str, int]: The number of records for each entity present.
+    """
+    return {
+        entity: len(data[key])
+        for entity, key in ENTITY_ID_VARIABLES.items()
+        if key in data
+    }
+
+
+def variable_entity(
+    name: str,
+    length: int,
+    sizes: Dict[str, int],
+    entities: Dict[str, str] = None,
+    strict: bool = False,
+) -> str:
+    """Finds the entity of a stored variable from its length, using the
+    variable name to break ties between entities with the same number of
+    records.
+
+    Args:
+        name (str): The variable name.
+        length (int): The number of values stored.
+        sizes (Dict[str, int]): The entity sizes (see `entity_sizes`).
+        entities (Dict[str, str], optional): The entity of variables whose
+            length and name may not determine it.
+        strict (bool, optional): Whether to raise an error, rather than take
+            the first entity, if the name does not break a tie. Defaults to
+            False.
+
+    Returns:
+        str: The entity key.
+    """
+    candidates = [entity for entity, size in sizes.items() if size == length]
+    if len(candidates) == 0:
+        raise ValueError(
+            f"Variable {name} has {length} values, which does not match any entity."
+        )
+    if entities is not None and name in entities:
+        if entities[name] not in candidates:
+            raise ValueError(
+                f"Variable {name} has {length} values, which does not match "
+                f"its entity ({entities[name]})."
+            )
+        return entities[name]
+    for entity in candidates:
+        if name.startswith(entity + "_"):
+            return entity
+    if strict and len(candidates) > 1:
+        raise ValueError(
+            f"Variable {name} has {length} values, which matches each of "
+            f"{', '.join(candidates)}. Give its entity explicitly."
+        )
+    return candidates[0]
+
+
+def id_positions(ids: np.array, foreign_key: np.array) -> np.array:
+    """Finds the position of each referenced ID in an entity's ID array, e.g.
+    the position of each person's household in the household arrays.
+
+    Args:
+        ids (np.array): The entity IDs, e.g. `household_id`.
+        foreign_key (np.array): The references, e.g. `person_household_id`.
+
+    Returns:
+        np.array: Indices into the entity arrays.
+    """
+    order = np.argsort(ids, kind="stable")
+    return order[np.searchsorted(ids, foreign_key, sorter=order)]
+
+
+# The entity whose records each ID variable refers to. Copies of a dataset
+# are stacked by offsetting their IDs by that entity's number of records
+ID_ENTITY = dict(
+    person_id="person",
+    benunit_id="benunit",
+    household_id="household",
+    person_benunit_id="benunit",
+    person_household_id="household",
+)
+
+# The group holding the original survey ID of each record, by entity
+SURVEY_IDS = "survey_ids"
+
+
+def normalize_ids(ids: Dict[str, np.array]) -> Dict[str, np.array]:
+    """Renumbers the records of each entity 0..n-1 in stored order, mapping
+    the foreign keys (e.g. `person_household_id`) to the same numbers, so
+    that IDs are positions and joins need no lookup.
+
+    Args:
+        ids (Dict[str, np.array]): The ID variables (see `ID_ENTITY`).
+
+    Returns:
+        Dict[str, np.array]: The renumbered ID variables, as int32.
+    """
+    normalized = {}
+    for name, entity in ID_ENTITY.items():
+        key = ENTITY_ID_VARIABLES[entity]
+        if name not in ids:
+            continue
+        if name == key:
+            positions = np.arange(len(ids[name]))
+        else:
+            positions = id_positions(ids[key], ids[name])
+        normalized[name] = positions.astype(np.int32)
+    return normalized
+
+
+def normalized_ids(data: h5py.File) -> Dict[str, np.array]:
+    """Reads the ID variables of a model dataset file, renumbered (see
+    `normalize_ids`)."""
+    return normalize_ids(
+        {name: data[name][...] for name in ID_ENTITY if name in data}
+    )
+
+
+def survey_ids(data: h5py.File) -> Dict[str, np.array]:
+    """The original survey ID of each record, by entity: the stored lookup
+    if the IDs were renumbered, or otherwise the stored IDs."""
+    if SURVEY_IDS in data:
+        return {
+            entity: values[...] for entity, values in data[SURVEY_IDS].items()
+        }
+    return {
+        entity: data[key][...]
+        for entity, key in ENTITY_ID_VARIABLES.items()
+        if entity != "state" and key in data
+    }
+
+
+def write_survey_ids(data: h5py.File, ids: Dict[str, np.array]):
+    """Stores the original survey ID of each record, by entity."""
+    group = data.create_group(SURVEY_IDS)
+    for entity, values in ids.items():
+        group[entity] = values
+
+
+# The group whose attributes give the entity of variables whose length and
+# name do not determine it
+VARIABLE_ENTITIES = "variable_entities"
+
+
+def stored_entities(data: h5py.File) -> Dict[str, str]:
+    """The entities recorded for variables of a model dataset file (see
+    `write_variable_entities`)."""
+    if VARIABLE_ENTITIES not in data:
+        return {}
+    return {
+        name: str(entity)
+        for name, entity in data[VARIABLE_ENTITIES].attrs.items()
+    }
+
+
+def write_variable_entities(data: h5py.File, entities: Dict[str, str]):
+    """Records the entity of variables whose length and name do not
+    determine it, so that readers of the file need not be told.
+
+    Args:
+        data (h5py.File): The model dataset file, open for writing.
+        entities (Dict[str, str]): The entity of each variable.
+    """
+    group = data.require_group(VARIABLE_ENTITIES)
+    for name, entity in entities.items():
+        group.attrs[name] = entity
+
+
+ENTITY_INDEX = "entity_index"
+
+# The entity each entity index array holds positions of, and so is offset by
+# when datasets are stacked
+INDEX_OFFSET_ENTITY = dict(
+    person_benunit="benunit",
+    person_household="household",
+    benunit_household="household",
+    benunit_offsets="person",
+    benunit_members="person",
+    household_offsets="person",
+    household_members="person",
+)
+
+
+def membership(positions: np.array, num_groups: int) -> Tuple[np.array]:
+    """Builds a compressed sparse row (CSR) membership list from each member's
+    group position.
+
+    Args:
+        positions (np.array): The group position of each member.
+        num_groups (int): The number of groups.
+
+    Returns:
+        Tuple[np.array]: The offsets (one more than the number of groups) and
+            the member positions, ordered by group and then by row.
+    """
+    members = np.argsort(positions, kind="stable").astype(np.int32)
+    offsets = np.zeros(num_groups + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(positions, minlength=num_groups))
+    return offsets, members
+
+
+class EntityIndex:
+    """Dense position arrays linking persons to their benefit units and
+    households, with CSR membership lists for each group. Aggregation and
+    broadcasting between entities are then plain array operations.
+    """
+
+    def __init__(self, arrays: Dict[str, np.array]):
+        self.arrays = arrays
+        self.sizes = dict(
+            person=len(arrays["person_benunit"]),
+            benunit=len(arrays["benunit_household"]),
+            household=len(arrays["household_offsets"]) - 1,
+        )
+
+    @staticmethod
+    def build(
+        person_benunit_id: np.array,
+        person_household_id: np.array,
+        benunit_id: np.array,
+        household_id: np.array,
+    ) -> "EntityIndex":
+        """Builds the index from the stored ID arrays.
+
+        Args:
+            person_benunit_id (np.array): Each person's benefit unit ID.
+            person_household_id (np.array): Each person's household ID.
+            benunit_id (np.array): The benefit unit IDs.
+            household_id (np.array): The household IDs.
+
+        Returns:
+            EntityIndex: The index.
+        """
+        person_benunit = id_positions(benunit_id, person_benunit_id)
+        person_household = id_positions(household_id, person_household_id)
+        benunit_household = np.zeros(len(benunit_id), dtype=np.int32)
+        benunit_household[person_benunit] = person_household
+        benunit_offsets, benunit_members = membership(
+            person_benunit, len(benunit_id)
+        )
+        household_offsets, household_members = membership(
+            person_household, len(household_id)
+        )
+        return EntityIndex(
+            dict(
+                person_benunit=person_benunit.astype(np.int32),
+                person_household=person_household.astype(np.int32),
+                benunit_household=benunit_household,
+                benunit_offsets=benunit_offsets,
+                benunit_members=benunit_members,
+                household_offsets=household_offsets,
+                household_members=household_members,
+            )
+        )
+
+    @staticmethod
+    def from_file(data: h5py.File) -> "EntityIndex":
+        """Reads the index from a model dataset file, building it from the ID
+        arrays if the file does not contain one.
+
+        Args:
+            data (h5py.File): The model dataset file.
+
+        Returns:
+            EntityIndex: The index.
+        """
+        if ENTITY_INDEX in data:
+            group = data[ENTITY_INDEX]
+            return EntityIndex({key: group[key][...] for key in group})
+        return EntityIndex.build(
+            *(
+                data[key][...]
+                for key in (
+                    "person_benunit_id",
+                    "person_household_id",
+                    "benunit_id",
+                    "household_id",
+                )
+            )
+        )
+
+    def write(self, data: h5py.File):
+        """Writes (or replaces) the index in a model dataset file.
+
+        Args:
+            data (h5py.File): The model dataset file, open for writing.
+        """
+        if ENTITY_INDEX in data:
+            del data[ENTITY_INDEX]
+        group = data.create_group(ENTITY_INDEX)
+        for key, values in self.arrays.items():
+            group[key] = values
+
+    def positions(self, source: str, target: str) -> np.array:
+        """The position of each source record's target group.
+
+        Args:
+            source (str): The member entity (person or benunit).
+            target (str): The group entity (benunit or household).
+
+        Returns:
+            np.array: Indices into the target entity's arrays.
+        """
+        if source == target:
+            return np.arange(self.sizes[source])
+        return self.arrays[f"{source}_{target}"]
+
+    def sum(self, values: np.array, source: str, target: str) -> np.array:
+        """Sums values over the members of each group.
+
+        Args:
+            values (np.array): Values for each source record.
+            source (str): The member entity.
+            target (str): The group entity.
+
+        Returns:
+            np.array: The total for each target record.
+        """
+        return np.bincount(
+            self.positions(source, target),
+            weights=values,
+            minlength=self.sizes[target],
+        )
+
+    def any(self, values: np.array, source: str, target: str) -> np.array:
+        """Whether any member of each group has a true value."""
+        return self.sum(values.astype(bool), source, target) > 0
+
+    def first(self, values: np.array, source: str, target: str) -> np.array:
+        """The value of the first member (in row order) of each group. Groups
+        without members of the source entity are not supported."""
+        if source == target:
+            return values
+        if source == "person":
+            offsets = self.arrays[f"{target}_offsets"]
+            return values[self.arrays[f"{target}_members"][offsets[:-1]]]
+        first = np.full(self.sizes[target], len(values))
+        np.minimum.at(
+            first, self.positions(source, target), np.arange(len(values))
+        )
+        return values[first]
+
+    def broadcast(
+        self, values: np.array, source: str, target: str
+    ) -> np.array:
+        """Gives each member record the value of its group.
+
+        Args:
+            values (np.array): Values for each source (group) record.
+            source (str): The group entity.
+            target (str): The member entity.
+
+        Returns:
+            np.array: The value for each target record.
+        """
+        return values[self.positions(target, source)]
+
+    def members(self, group: str, position: int) -> np.array:
+        """The person positions belonging to a benefit unit or household."""
+        offsets = self.arrays[f"{group}_offsets"]
+        return self.arrays[f"{group}_members"][
+            offsets[position] : offsets[position + 1]
+        ]
+
+
+def write_entity_index(data: h5py.File):
+    """Builds the entity index from the ID arrays in a writable model dataset
+    file and stores it in the file.
+
+    Args:
+        data (h5py.File): The model dataset file, open for writing.
+    """
+    if ENTITY_INDEX in data:
+        del data[ENTITY_INDEX]
+    EntityIndex.from_file(data).write(data)
@@ -0,0 +1,202 @@
+from collections import OrderedDict
+import os
+from pathlib import Path
+import threading
+from typing import Tuple
+import h5py
+from openfisca_uk_data.layers import check_layers, layers
+from openfisca_uk_data.storage import DatasetFile
+
+# The most files the handle pool keeps open once no longer in use
+MAX_OPEN_HANDLES = 32
+
+
+def file_signature(path: Path) -> Tuple[int, int, int]:
+    """Identifies a version of a file: its inode, modification time and
+    size. Atomically replacing (or rewriting) the file changes it."""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class PooledFile:
+    """An open dataset file in a `HandlePool`, with the number of handles
+    using it. For a layered file, the versions of the base files it
+    references are recorded too.
+
+    Args:
+        path (Path): The file path.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        signature = file_signature(path)
+        file = h5py.File(path, mode="r")
+        self.bases = [path.parent / file_name for file_name in layers(file)]
+        try:
+            self.signature = (signature, *map(file_signature, self.bases))
+        except FileNotFoundError:
+            # Reported by the layer check
+            self.signature = None
+        self.data = DatasetFile(file)
+        self.references = 0
+        self.retired = False
+
+    def current(self) -> bool:
+        """Whether the file and its base files on disk are still the
+        versions opened."""
+        try:
+            return (
+                file_signature(self.path),
+                *map(file_signature, self.bases),
+            ) == self.signature
+        except FileNotFoundError:
+            return False
+
+    def check(self):
+        """Checks that a layered file's base files are unchanged since it
+        was written (see `layers.check_layers`)."""
+        if self.bases:
+            check_layers(self.data.file)
+
+
+class DatasetHandle:
+    """One use of a pooled dataset file. Behaves like a `DatasetFile`, except
+    that `close()` (or leaving a `with` block) releases it to the pool rather
+    than closing the file. Handles that are never closed are released when
+    garbage collected.
+
+    Args:
+        pool (HandlePool): The pool.
+        entry (PooledFile): The pooled file.
+    """
+
+    _released = True
+
+    def __init__(self, pool: "HandlePool", entry: PooledFile):
+        self._pool = pool
+        self._entry = entry
+        self._released = False
+
+    def keys(self):
+        return self._entry.data.keys()
+
+    def __iter__(self):
+        return iter(self._entry.data)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entry.data
+
+    def __getitem__(self, key: str):
+        return self._entry.data[key]
+
+    def __getattr__(self, name: str):
+        return getattr(self._entry.data, name)
+
+    def __enter__(self) -> "DatasetHandle":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.release(self._entry)
+
+    def __del__(self):
+        self.close()
+
+
+class HandlePool:
+    """A process-wide cache of read-only dataset files, so that repeated
+    loads (from any thread) reuse an open file rather than reopening it.
+
+    Files are reference counted: a file is only closed once every handle to
+    it has been released. Of the files no longer in use, the most recently
+    used `max_handles` are kept open. A file replaced on disk since it was
+    opened (see `file_signature`), or a layered file one of whose base files
+    has been, is reopened on the next `open`, and the old version closed once
+    its handles are released. Layered files are re-checked against their base
+    files on every `open`.
+
+    Handles keep reading the version opened. Layered files reference pinned
+    versions of their base files (see `base_version`), which rebuilds of the
+    base files do not replace.
+
+    Args:
+        max_handles (int, optional): The most files to keep open once no
+            longer in use. Defaults to `MAX_OPEN_HANDLES`.
+    """
+
+    def __init__(self, max_handles: int = MAX_OPEN_HANDLES):
+        self.max_handles = max_handles
+        self.files = OrderedDict()
+        # Re-entrant, as handles may be released by garbage collection
+        # while the lock is held
+        self.lock = threading.RLock()
+
+    def open(self, path: Path) -> DatasetHandle:
+        """Provides a handle to a dataset file, opening it if it is not
+        already open or has been replaced.
+
+        Args:
+            path (Path): The file path.
+
+        Returns:
+            DatasetHandle: The handle, to be closed when no longer needed.
+        """
+        path = Path(path).resolve()
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is not None and not entry.current():
+                self.retire(entry)
+                entry = None
+            if entry is not None:
+                entry.check()
+            else:
+                entry = PooledFile(path)
+                self.files[path] = entry
+            self.files.move_to_end(path)
+            entry.references += 1
+            self.evict()
+            return DatasetHandle(self, entry)
+
+    def release(self, entry: PooledFile):
+        """Releases one handle to a pooled file."""
+        with self.lock:
+            entry.references -= 1
+            if entry.retired:
+                if entry.references == 0:
+                    entry.data.close()
+                return
+            # A file counts as used until its last handle is released
+            self.files.move_to_end(entry.path)
+            self.evict()
+
+    def retire(self, entry: PooledFile):
+        """Removes a file from the pool, closing it once it is not in use."""
+        del self.files[entry.path]
+        entry.retired = True
+        if entry.references == 0:
+            entry.data.close()
+
+    def evict(self):
+        """Closes the least recently used files not in use, beyond the
+        `max_handles` most recent."""
+        idle = [entry for entry in self.files.values() if not entry.references]
+        for entry in idle[: max(len(idle) - self.max_handles, 0)]:
+            self.retire(entry)
+
+    def clear(self):
+        """Closes every file not in use, and reopens the others on their
+        next `open`."""
+        with self.lock:
+            for entry in list(self.files.values()):
+                self.retire(entry)
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+
+# The handle pool used by `load`
+HANDLES = HandlePool()
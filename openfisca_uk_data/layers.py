@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+from typing import Dict, List, Tuple
+import h5py
+
+# The file attribute recording the base files a layered dataset references,
+# with their build fingerprints
+LAYERS = "layers"
+
+# A whole base variable referenced by a layered variable: the base file path
+# (relative to the layered file), the variable name and its length
+Block = Tuple[str, str, int]
+
+
+def virtual_blocks(dataset: h5py.Dataset) -> List[Block]:
+    """Lists the base variables a virtual variable concatenates, in order.
+
+    Args:
+        dataset (h5py.Dataset): The virtual variable.
+
+    Returns:
+        List[Block]: The referenced base variables.
+    """
+    sources = sorted(
+        dataset.virtual_sources(),
+        key=lambda source: source.vspace.get_select_bounds()[0],
+    )
+    blocks = []
+    for source in sources:
+        (start,), (stop,) = source.vspace.get_select_bounds()
+        blocks.append((source.file_name, source.dset_name, stop - start + 1))
+    return blocks
+
+
+def write_virtual(
+    target: h5py.File, name: str, blocks: List[Block], dtype: type
+):
+    """Writes a virtual variable concatenating whole base variables.
+
+    Args:
+        target (h5py.File): The layered file, open for writing.
+        name (str): The variable name.
+        blocks (List[Block]): The base variables to concatenate.
+        dtype (type): The variable type.
+    """
+    layout = h5py.VirtualLayout(
+        shape=(sum(length for _, _, length in blocks),), dtype=dtype
+    )
+    start = 0
+    for file_name, dset_name, length in blocks:
+        layout[start : start + length] = h5py.VirtualSource(
+            file_name, dset_name, shape=(length,)
+        )
+        start += length
+    target.create_virtual_dataset(name, layout)
+
+
+def link_variable(
+    target: h5py.File, name: str, base: h5py.Dataset, copies: int = 1
+):
+    """Adds a variable to a layered file which references `copies`
+    concatenated copies of a base variable, rather than storing its values.
+
+    Args:
+        target (h5py.File): The layered file, open for writing.
+        name (str): The variable name.
+        base (h5py.Dataset): The base variable, which may itself be virtual.
+        copies (int, optional): The number of copies. Defaults to 1.
+    """
+    if base.is_virtual:
+        blocks = virtual_blocks(base)
+    else:
+        # Base files are found relative to the layered file
+        file_name = os.path.relpath(
+            base.file.filename, Path(target.filename).parent
+        )
+        blocks = [(file_name, base.name, len(base))]
+    write_virtual(target, name, blocks * copies, base.dtype)
+
+
+def layers(data: h5py.File) -> Dict[str, str]:
+    """The base files (relative to the file) a layered file references, with
+    the build fingerprints they had when it was written."""
+    return json.loads(data.attrs.get(LAYERS, "{}"))
+
+
+# The folder, next to a base file, holding the versions of it that layered
+# files reference
+BASE_VERSIONS = "base_versions"
+
+
+def base_version(base: h5py.File) -> Path:
+    """Pins the current version of a base file for layered files to
+    reference: a hard link to it (or, where links are not supported, a copy)
+    named by its build fingerprint. Rebuilding the base file replaces it with
+    a new file, so the pinned version, and the layered files referencing it,
+    stay readable. Superseded versions are kept, and can be deleted once no
+    layered file references them.
+
+    Args:
+        base (h5py.File): The base file.
+
+    Returns:
+        Path: The pinned version, or the base file itself if it records no
+            build fingerprint.
+    """
+    from openfisca_uk_data.utils import FINGERPRINT, atomic_output
+
+    path = Path(base.filename)
+    fingerprint = base.attrs.get(FINGERPRINT, "")
+    if not fingerprint:
+        return path
+    digest = hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+    version = path.parent / BASE_VERSIONS / f"{path.stem}_{digest}.h5"
+    if not version.exists():
+        version.parent.mkdir(exist_ok=True)
+        with atomic_output(version) as output:
+            try:
+                os.link(path, output)
+            except OSError:
+                shutil.copyfile(path, output)
+            with h5py.File(output, mode="r") as pinned:
+                if pinned.attrs.get(FINGERPRINT, "") != fingerprint:
+                    raise ValueError(
+                        f"{path} was rebuilt while being pinned. Try again."
+                    )
+    return version
+
+
+def record_layer(target: h5py.File, base: h5py.File):
+    """Records that a layered file references a base file, with the base's
+    current build fingerprint."""
+    from openfisca_uk_data.utils import FINGERPRINT
+
+    references = layers(target)
+    file_name = os.path.relpath(base.filename, Path(target.filename).parent)
+    references[file_name] = base.attrs.get(FINGERPRINT, "")
+    target.attrs[LAYERS] = json.dumps(references)
+
+
+def check_layers(data: h5py.File):
+    """Checks that the base files referenced by a layered file exist and are
+    unchanged since it was written, as missing base values would otherwise
+    read as zeros.
+
+    Args:
+        data (h5py.File): The layered file.
+    """
+    from openfisca_uk_data.utils import FINGERPRINT
+
+    for file_name, fingerprint in layers(data).items():
+        path = Path(data.filename).parent / file_name
+        if not path.exists():
+            raise FileNotFoundError(
+                f"{data.filename} references {path}, which does not exist. "
+                "Regenerate the dataset, or materialize it while its base "
+                "files are available."
+            )
+        with h5py.File(path, mode="r") as base:
+            if base.attrs.get(FINGERPRINT, "") != fingerprint:
+                raise ValueError(
+                    f"{path} has changed since {data.filename} was "
+                    "generated from it. Regenerate the dataset."
+                )
+
+
+def copy_on_write(data: h5py.File, name: str):
+    """Replaces a virtual variable with a stored copy of its values, so that
+    it can be written to without changing the base file.
+
+    Args:
+        data (h5py.File): The layered file, open for writing.
+        name (str): The variable name.
+    """
+    if data[name].is_virtual:
+        values = data[name][...]
+        del data[name]
+        data[name] = values
+
+
+def materialize(source: h5py.File, target: h5py.File):
+    """Copies a layered file with every variable stored, one variable at a
+    time, so that it no longer depends on its base files.
+
+    Args:
+        source (h5py.File): The layered file.
+        target (h5py.File): The file to write to.
+    """
+    for name, value in source.items():
+        if isinstance(value, h5py.Dataset):
+            target[name] = value[...]
+        else:
+            source.copy(value, target, name=name)
+    for key, value in source.attrs.items():
+        if key != LAYERS:
+            target.attrs[key] = value
@@ -0,0 +1,113 @@
+import logging
+import re
+from typing import Tuple
+import numpy as np
+
+# The storage precision of each variable, from the first matching pattern:
+# "int" stores integral values as the narrowest integer type that holds them,
+# "float32" stores floats in single precision if the relative error is within
+# the tolerance (and integers as "int"), and "float64" keeps values as given.
+PRECISION_POLICY = (
+    (r"_id$", "int"),
+    (r"", "float32"),
+)
+
+# The largest relative error allowed in any single value stored as float32
+DEFAULT_TOLERANCE = 1e-6
+
+
+def variable_precision(
+    name: str, policy: Tuple[Tuple[str, str]] = PRECISION_POLICY
+) -> str:
+    """Finds the storage precision of a variable from the policy."""
+    for pattern, precision in policy:
+        if re.search(pattern, name):
+            return precision
+    return "float64"
+
+
+def narrowest_int(values: np.array) -> np.array:
+    """Casts integral values to the narrowest integer type that holds them."""
+    if len(values) == 0:
+        return values.astype(np.int8)
+    low, high = int(values.min()), int(values.max())
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+def relative_error(values: np.array, stored: np.array) -> float:
+    """The largest relative error of a stored copy of some values."""
+    values = values.astype(np.float64)
+    difference = np.abs(stored.astype(np.float64) - values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        error = np.where(values != 0, difference / np.abs(values), difference)
+    error = error[~np.isnan(values)]
+    return float(error.max()) if len(error) else 0.0
+
+
+def storage_values(
+    name: str,
+    values: np.array,
+    policy: Tuple[Tuple[str, str]] = PRECISION_POLICY,
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> np.array:
+    """Converts a variable's values to their storage precision.
+
+    Args:
+        name (str): The variable name.
+        values (np.array): The values.
+        policy (Tuple[Tuple[str, str]], optional): The (pattern, precision)
+            rules. Defaults to `PRECISION_POLICY`.
+        tolerance (float, optional): The largest relative error allowed for
+            float32 storage. Defaults to `DEFAULT_TOLERANCE`.
+
+    Returns:
+        np.array: The values to store.
+    """
+    values = np.asarray(values)
+    precision = variable_precision(name, policy)
+    if precision == "float64" or values.dtype.kind not in "iuf":
+        return values
+    if values.dtype.kind in "iu":
+        return narrowest_int(values)
+    if precision == "int":
+        if np.isfinite(values).all() and (values == np.round(values)).all():
+            return narrowest_int(values.astype(np.int64))
+        return values
+    if values.dtype == np.float32:
+        return values
+    with np.errstate(over="ignore"):
+        stored = values.astype(np.float32)
+    if relative_error(values, stored) > tolerance:
+        logging.warning(
+            f"Storing {name} as {values.dtype}, as float32 would exceed "
+            f"the relative error tolerance of {tolerance}."
+        )
+        return values
+    return stored
+
+
+def precision_drift(name: str, values: np.array, stored: np.array) -> dict:
+    """Describes the change made to a variable by storing it at a lower
+    precision: the largest relative error of any value, the relative change
+    in the total and the bytes saved."""
+    values = np.asarray(values)
+    row = dict(
+        variable=name,
+        dtype=str(values.dtype),
+        stored_dtype=str(stored.dtype),
+        bytes=values.nbytes,
+        stored_bytes=stored.nbytes,
+        max_relative_error=0.0,
+        total_drift=0.0,
+    )
+    if values.dtype.kind in "iuf" and stored.dtype != values.dtype:
+        row["max_relative_error"] = relative_error(values, stored)
+        total = np.nansum(values, dtype=np.float64)
+        stored_total = np.nansum(stored, dtype=np.float64)
+        row["total_drift"] = (
+            abs(stored_total - total) / abs(total) if total != 0 else 0.0
+        )
+    return row
@@ -0,0 +1,903 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import re
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+import h5py
+import numpy as np
+import pandas as pd
+from openfisca_uk_data.entities import (
+    EntityIndex,
+    entity_sizes,
+    membership,
+    stored_entities,
+    variable_entity,
+    write_entity_index,
+)
+from openfisca_uk_data.layers import check_layers
+from openfisca_uk_data.precision import (
+    DEFAULT_TOLERANCE,
+    PRECISION_POLICY,
+    precision_drift,
+    storage_values,
+)
+
+# Entities that group records of the entities before them
+ENTITY_LEVELS = dict(person=0, benunit=1, household=2)
+
+# The variables linking records to their entities
+ID_VARIABLES = (
+    "person_id",
+    "benunit_id",
+    "household_id",
+    "person_benunit_id",
+    "person_household_id",
+)
+
+VALUE_INDEX = "value_index"
+
+# Variables commonly used to filter households, indexed by value on generation
+INDEXED_VARIABLES = ("region", "tenure_type")
+
+# The group marking, for each entity, the zero-weight cloned records kept as
+# donors for reweighting
+DONORS = "donors"
+
+# The group holding the donor records of each variable, when stored apart
+CLONES = "clones"
+
+# The group holding variables stored as the positions and values of their
+# non-zero records
+SPARSE = "sparse"
+
+# Numeric variables with at most this share of non-zero records are written
+# in sparse form
+SPARSE_DENSITY = 0.1
+
+# Variables always stored in full, as they are read without a `DatasetFile`
+DENSE_VARIABLES = r"_id$"
+
+# The group holding, in the packed layout, one 2D block per entity and type
+# with a row for each variable, listed in its `variables` attribute
+BLOCKS = "blocks"
+
+
+def variable_names(data: h5py.File) -> List[str]:
+    """Lists the variables stored in a model dataset file, including sparse
+    variables, and skipping groups used for metadata (such as the entity
+    index).
+
+    Args:
+        data (h5py.File): The model dataset file.
+
+    Returns:
+        List[str]: The variable names.
+    """
+    names = [
+        key for key, value in data.items() if isinstance(value, h5py.Dataset)
+    ]
+    if SPARSE in data:
+        names += list(data[SPARSE])
+    if BLOCKS in data:
+        for block in data[BLOCKS].values():
+            names += [name for name in block_variables(block) if name]
+    return names
+
+
+def block_variables(block: h5py.Dataset) -> List[str]:
+    """The variable stored in each row of a packed block. Rows emptied by
+    `unpack_column` are named ""."""
+    return [
+        name.decode() if isinstance(name, bytes) else str(name)
+        for name in block.attrs["variables"]
+    ]
+
+
+class SparseVariable:
+    """A variable stored as the positions and values of its non-zero
+    records. Indexing it (e.g. `variable[...]` or `variable[start:stop]`)
+    reads dense values, like an `h5py.Dataset`.
+
+    Args:
+        group (h5py.Group): The group holding the `index` and `values`.
+    """
+
+    is_virtual = False
+
+    def __init__(self, group: h5py.Group):
+        self.group = group
+        self.shape = (int(group.attrs["length"]),)
+        self.dtype = group["values"].dtype
+
+    @property
+    def name(self) -> str:
+        return self.group.name.split("/")[-1]
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def index(self) -> np.array:
+        """The positions of the non-zero records."""
+        return self.group["index"][...]
+
+    @property
+    def values(self) -> np.array:
+        """The non-zero values."""
+        return self.group["values"][...]
+
+    def __getitem__(self, key) -> np.array:
+        index, values = self.index, self.values
+        if key is Ellipsis:
+            dense = np.zeros(len(self), dtype=self.dtype)
+            dense[index] = values
+            return dense
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self[...][key]
+            low, high = np.searchsorted(index, [start, stop])
+            dense = np.zeros(max(stop - start, 0), dtype=self.dtype)
+            dense[index[low:high] - start] = values[low:high]
+            return dense
+        positions = np.asarray(key)
+        found = np.searchsorted(index, positions).clip(0, len(index) - 1)
+        dense = np.zeros(len(positions), dtype=self.dtype)
+        if len(index):
+            matches = index[found] == positions
+            dense[matches] = values[found[matches]]
+        return dense
+
+
+def write_sparse(data: h5py.File, name: str, values: np.array):
+    """Writes a variable in sparse form, recording its length and density in
+    the attributes of its group.
+
+    Args:
+        data (h5py.File): The model dataset file, open for writing.
+        name (str): The variable name.
+        values (np.array): The dense values.
+    """
+    index = np.flatnonzero(values).astype(np.int32)
+    group = data.require_group(SPARSE).create_group(name)
+    group["index"] = index
+    group["values"] = values[index]
+    group.attrs["length"] = len(values)
+    group.attrs["density"] = len(index) / max(len(values), 1)
+
+
+def densify(data: h5py.File, name: str):
+    """Replaces a sparse variable with its dense values, so that it can be
+    written to in place."""
+    if SPARSE in data and name in data[SPARSE]:
+        values = SparseVariable(data[SPARSE][name])[...]
+        del data[SPARSE][name]
+        data[name] = values
+
+
+def packable(name: str, values: h5py.Dataset) -> bool:
+    """Whether a variable can be packed into a block: numeric, longer than
+    one record and not an ID variable."""
+    return (
+        values.dtype.kind in "biuf"
+        and len(values) > 1
+        and not re.search(DENSE_VARIABLES, name)
+    )
+
+
+class BlockColumn:
+    """A variable stored as one row of a packed block. Indexing it (e.g.
+    `variable[...]` or `variable[start:stop]`) reads only that row, like an
+    `h5py.Dataset`.
+
+    Args:
+        block (h5py.Dataset): The block.
+        row (int): The variable's row.
+    """
+
+    is_virtual = False
+
+    def __init__(self, block: h5py.Dataset, row: int):
+        self.block = block
+        self.row = row
+        self.shape = block.shape[1:]
+        self.dtype = block.dtype
+
+    @property
+    def name(self) -> str:
+        return block_variables(self.block)[self.row]
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key) -> np.array:
+        if key is Ellipsis or isinstance(key, slice):
+            return self.block[self.row, key]
+        positions = np.asarray(key)
+        if len(positions) == 0:
+            return np.zeros(0, dtype=self.dtype)
+        # h5py reads point selections only in increasing order
+        unique, inverse = np.unique(positions, return_inverse=True)
+        return self.block[self.row, unique][inverse]
+
+
+def pack(source: "DatasetFile", target: h5py.File, blocks: bool = True):
+    """Copies a model dataset file in the packed layout, with the numeric
+    variables of each entity stored as the rows of one 2D block per type, so
+    that all of them can be read in a single sequential read. Sparse
+    variables, metadata groups and attributes are copied as they are, and
+    virtual variables are stored.
+
+    Args:
+        source (DatasetFile): The dataset file.
+        target (h5py.File): The file to write to.
+        blocks (bool, optional): Whether to pack variables into blocks, or
+            store one dataset per variable (the default layout). Defaults to
+            True.
+    """
+    for name, value in source.file.items():
+        if isinstance(value, h5py.Group) and name != BLOCKS:
+            source.file.copy(value, target, name=name)
+    for key, value in source.file.attrs.items():
+        target.attrs[key] = value
+    members = {}
+    for variable in source.keys():
+        if source.is_sparse(variable):
+            continue
+        stored = source[variable]
+        if blocks and packable(variable, stored):
+            block = (source.entity(variable), stored.dtype)
+            members.setdefault(block, []).append(variable)
+        else:
+            target[variable] = stored[...]
+    for (entity, dtype), variables in members.items():
+        packed = target.require_group(BLOCKS).create_dataset(
+            f"{entity}_{dtype.name}",
+            shape=(len(variables), len(source[variables[0]])),
+            dtype=dtype,
+        )
+        packed.attrs["entity"] = entity
+        packed.attrs["variables"] = variables
+        # One variable at a time, to hold only one in memory
+        for row, variable in enumerate(variables):
+            packed[row] = source[variable][...]
+
+
+def unpack_column(data: h5py.File, name: str):
+    """Moves a packed variable to a dataset of its own, so that it can be
+    written to in place. Its block row is left unused until the file is next
+    packed."""
+    for block in data.get(BLOCKS, {}).values():
+        names = block_variables(block)
+        if name in names:
+            row = names.index(name)
+            values = block[row]
+            names[row] = ""
+            block.attrs["variables"] = names
+            data[name] = values
+            return
+
+
+def stored_variable(data: h5py.File, name: str):
+    """Finds a variable stored in full, in sparse form or in a block."""
+    if name in data:
+        return data[name]
+    if SPARSE in data and name in data[SPARSE]:
+        return SparseVariable(data[SPARSE][name])
+    for block in data.get(BLOCKS, {}).values():
+        names = block_variables(block)
+        if name in names:
+            return BlockColumn(block, names.index(name))
+    return data[name]
+
+
+class DatasetWriter:
+    """A writable model dataset file which stores each variable assigned to
+    it at the precision set by the precision policy (see `precision.py`),
+    and in sparse form if few of its values are non-zero, recording the
+    change in size and the drift introduced. Other operations are passed to
+    the underlying `h5py.File`.
+
+    Args:
+        file (h5py.File): The file, open for writing.
+        policy (Tuple[Tuple[str, str]], optional): The precision policy.
+            Defaults to `PRECISION_POLICY`.
+        tolerance (float, optional): The float32 relative error tolerance.
+            Defaults to `DEFAULT_TOLERANCE`.
+        sparse_density (float, optional): The largest share of non-zero
+            values for sparse storage. Defaults to `SPARSE_DENSITY`; 0
+            stores every variable in full.
+    """
+
+    def __init__(
+        self,
+        file: h5py.File,
+        policy: Tuple[Tuple[str, str]] = PRECISION_POLICY,
+        tolerance: float = DEFAULT_TOLERANCE,
+        sparse_density: float = SPARSE_DENSITY,
+    ):
+        self.file = file
+        self.policy = policy
+        self.tolerance = tolerance
+        self.sparse_density = sparse_density
+        self.drift = []
+
+    def __setitem__(self, name: str, values: np.array):
+        values = np.asarray(values)
+        stored = storage_values(name, values, self.policy, self.tolerance)
+        row = precision_drift(name, values, stored)
+        if (
+            stored.dtype.kind in "iuf"
+            and len(stored) > 1
+            and not re.search(DENSE_VARIABLES, name)
+            and np.count_nonzero(stored) <= self.sparse_density * len(stored)
+        ):
+            write_sparse(self.file, name, stored)
+            group = self.file[SPARSE][name]
+            row["stored_bytes"] = (
+                group["index"].nbytes + group["values"].nbytes
+            )
+            row["stored_sparse"] = True
+        else:
+            self.file[name] = stored
+            row["stored_sparse"] = False
+        self.drift.append(row)
+
+    def __getitem__(self, name: str):
+        return stored_variable(self.file, name)
+
+    def rewrite(self, name: str):
+        """Stores a variable written to in place (e.g. a chunk of rows at a
+        time) again, at the precision and in the form the policies give it.
+
+        Args:
+            name (str): The variable, stored in full.
+        """
+        values = self.file[name][...]
+        del self.file[name]
+        self[name] = values
+
+    def __delitem__(self, name: str):
+        if SPARSE in self.file and name in self.file[SPARSE]:
+            del self.file[SPARSE][name]
+        else:
+            unpack_column(self.file, name)
+            del self.file[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in variable_names(self.file) or name in self.file
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.file)
+
+    def __getattr__(self, name: str):
+        return getattr(self.file, name)
+
+    def report(self) -> pd.DataFrame:
+        """The size change and drift of each variable written (see
+        `precision_drift`)."""
+        return pd.DataFrame(self.drift)
+
+    def log_report(self):
+        """Logs the bytes saved and the largest drift introduced."""
+        if not self.drift:
+            return
+        report = self.report()
+        logging.info(
+            f"Stored {report.stored_bytes.sum() / 1e6:.1f}MB instead of "
+            f"{report.bytes.sum() / 1e6:.1f}MB ({report.stored_sparse.sum()} "
+            "sparse variables). Largest relative error: "
+            f"{report.max_relative_error.max():.1e}, largest total drift: "
+            f"{report.total_drift.max():.1e}."
+        )
+
+
+def read_rows(dataset: h5py.Dataset, positions: np.array) -> np.array:
+    """Reads the given rows (in increasing order) of a stored variable. Rows
+    that are close together are read as one hyperslab, and the selection
+    taken from it in memory.
+
+    Args:
+        dataset (h5py.Dataset): The stored variable.
+        positions (np.array): The sorted row positions.
+
+    Returns:
+        np.array: The values.
+    """
+    if len(positions) == 0:
+        return dataset[:0]
+    start, stop = positions[0], positions[-1] + 1
+    if stop - start <= 2 * len(positions):
+        return dataset[start:stop][positions - start]
+    return dataset[positions]
+
+
+def group_members(
+    offsets: np.array, members: np.array, groups: np.array
+) -> np.array:
+    """Finds the members of a set of groups from a CSR membership list.
+
+    Args:
+        offsets (np.array): The membership offsets.
+        members (np.array): The member positions, ordered by group.
+        groups (np.array): The group positions.
+
+    Returns:
+        np.array: The member positions, in increasing order.
+    """
+    starts = offsets[groups]
+    counts = offsets[groups + 1] - starts
+    first = np.cumsum(counts) - counts
+    rows = np.repeat(starts - first, counts) + np.arange(counts.sum())
+    return np.sort(members[rows])
+
+
+def write_value_index(
+    data: h5py.File, variables: List[str] = INDEXED_VARIABLES
+):
+    """Stores, for each of the given variables, the positions of the records
+    holding each distinct value, so that filtered loads need not read the
+    variable.
+
+    Args:
+        data (h5py.File): The model dataset file, open for writing.
+        variables (List[str], optional): The variables to index. Defaults to
+            `INDEXED_VARIABLES`; those not stored are skipped.
+    """
+    if VALUE_INDEX in data:
+        del data[VALUE_INDEX]
+    group = data.create_group(VALUE_INDEX)
+    for variable in variables:
+        if variable not in data:
+            continue
+        values, codes = np.unique(data[variable][...], return_inverse=True)
+        offsets, positions = membership(codes, len(values))
+        index = group.create_group(variable)
+        index["values"] = values
+        index["offsets"] = offsets
+        index["positions"] = positions
+
+
+class Batch:
+    """A set of whole households, with their benefit units and persons.
+
+    Args:
+        data (Dict[str, np.array]): The variables. ID variables are either
+            re-indexed from zero or the stored IDs (see `DatasetFile.subset`).
+        positions (Dict[str, np.array]): The position of each record in the
+            full dataset, for each entity, to place results.
+    """
+
+    def __init__(
+        self, data: Dict[str, np.array], positions: Dict[str, np.array]
+    ):
+        self.data = data
+        self.positions = positions
+
+    def __getitem__(self, variable: str) -> np.array:
+        return self.data[variable]
+
+    def __contains__(self, variable: str) -> bool:
+        return variable in self.data
+
+    def keys(self) -> List[str]:
+        return list(self.data)
+
+    def __len__(self) -> int:
+        return len(self.positions["household"])
+
+    def write(self, data: h5py.File):
+        """Writes the records as a model dataset, with its entity and value
+        indices.
+
+        Args:
+            data (h5py.File): The file to write to, open for writing.
+        """
+        writer = DatasetWriter(data)
+        for variable, values in self.data.items():
+            writer[variable] = values
+        write_entity_index(data)
+        write_value_index(data)
+
+
+class DatasetFile:
+    """A read-only model dataset file. Behaves like the underlying `h5py.File`,
+    except that `keys()` and iteration list only variables.
+
+    Stored input variables can be read with `calc` and `df`, which mirror the
+    `Microsimulation` methods of the same name but need no tax-benefit model:
+    values are mapped between entities with the entity index.
+
+    Layered files (see `layers.py`) read their base files transparently, and
+    are checked on opening to reference unchanged base files.
+
+    Each variable's entity is found from its length and name, or from the
+    entities recorded in the file (see `write_variable_entities`). Where
+    entities have the same number of records and neither says which a
+    variable belongs to, reading it by entity raises an error unless its
+    entity is added to `entities`.
+
+    Args:
+        file (h5py.File): The file, open for reading.
+        entities (Dict[str, str], optional): The entity of variables whose
+            length and name do not determine it. Defaults to None.
+    """
+
+    def __init__(self, file: h5py.File, entities: Dict[str, str] = None):
+        self.file = file
+        self.entities = dict(entities or {})
+        # Computed on first use
+        self._packed = None
+        self._stored_entities = None
+        self._entity_index = None
+        self._sizes = None
+        self._household_benunits = None
+        try:
+            check_layers(file)
+        except Exception:
+            file.close()
+            raise
+
+    def keys(self) -> List[str]:
+        return variable_names(self.file)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.file or self.is_sparse(key) or key in self.packed
+
+    def __getitem__(self, key: str):
+        if key in self.packed:
+            return BlockColumn(*self.packed[key])
+        return stored_variable(self.file, key)
+
+    @property
+    def packed(self) -> Dict[str, Tuple[h5py.Dataset, int]]:
+        """The block and row of each packed variable."""
+        if self._packed is None:
+            rows = {}
+            for block in self.file.get(BLOCKS, {}).values():
+                for row, name in enumerate(block_variables(block)):
+                    if name:
+                        rows[name] = (block, row)
+            self._packed = rows
+        return self._packed
+
+    def read_all(self, entity: str = None) -> Dict[str, np.array]:
+        """Reads every variable (or those of one entity), reading each packed
+        block in a single read.
+
+        Args:
+            entity (str, optional): The entity. Defaults to all.
+
+        Returns:
+            Dict[str, np.array]: The values of each variable.
+        """
+        values = {}
+        for block in self.file.get(BLOCKS, {}).values():
+            if entity is not None and block.attrs["entity"] != entity:
+                continue
+            rows = block[...]
+            for row, name in enumerate(block_variables(block)):
+                if name:
+                    values[name] = rows[row]
+        for variable in self.keys():
+            if variable in values:
+                continue
+            if entity is None or self.entity(variable) == entity:
+                values[variable] = self[variable][...]
+        return values
+
+    def is_sparse(self, variable: str) -> bool:
+        """Whether a variable is stored in sparse form."""
+        return SPARSE in self.file and variable in self.file[SPARSE]
+
+    def sparse(self, variable: str) -> Tuple[np.array, np.array, int]:
+        """Reads a variable as the positions and values of its non-zero
+        records, without densifying it.
+
+        Args:
+            variable (str): The variable name.
+
+        Returns:
+            Tuple[np.array, np.array, int]: The positions, the values and the
+                number of records.
+        """
+        stored = self[variable]
+        if isinstance(stored, SparseVariable):
+            return stored.index, stored.values, len(stored)
+        values = stored[...]
+        index = np.flatnonzero(values)
+        return index, values[index], len(values)
+
+    def __getattr__(self, name: str):
+        return getattr(self.file, name)
+
+    def __enter__(self) -> "DatasetFile":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def entity_index(self) -> EntityIndex:
+        if self._entity_index is None:
+            self._entity_index = EntityIndex.from_file(self.file)
+        return self._entity_index
+
+    @property
+    def sizes(self) -> Dict[str, int]:
+        if self._sizes is None:
+            self._sizes = entity_sizes(self.file)
+        return self._sizes
+
+    @property
+    def variable_entities(self) -> Dict[str, str]:
+        """The entities known for variables: those recorded in the file or
+        its packed blocks, and those given in `entities`."""
+        if self._stored_entities is None:
+            known = stored_entities(self.file)
+            for name, (block, _) in self.packed.items():
+                known[name] = block.attrs["entity"]
+            self._stored_entities = known
+        return {**self._stored_entities, **self.entities}
+
+    def entity(self, variable: str) -> str:
+        """The entity of a stored variable. Raises an error if entities with
+        its number of records remain ambiguous (see the class docstring)."""
+        return variable_entity(
+            variable,
+            len(self[variable]),
+            self.sizes,
+            self.variable_entities,
+            strict=True,
+        )
+
+    def calc(
+        self, variable: str, map_to: str = None, how: str = "sum"
+    ) -> np.array:
+        """Reads a stored variable, optionally mapped to another entity.
+
+        Args:
+            variable (str): The variable name.
+            map_to (str, optional): The entity to map to. Defaults to the
+                variable's own entity.
+            how (str, optional): How to combine the members of a group when
+                mapping to a larger entity: "sum", "any" or "first". Defaults
+                to "sum".
+
+        Returns:
+            np.array: The values. Enum values stored as bytes are decoded.
+        """
+        values = self[variable][...]
+        if values.dtype.kind == "S":
+            values = values.astype(str)
+        entity = self.entity(variable)
+        if map_to is None or map_to == entity:
+            return values
+        if entity not in ENTITY_LEVELS or map_to not in ENTITY_LEVELS:
+            raise ValueError(
+                f"Cannot map {variable} from {entity} to {map_to}."
+            )
+        if ENTITY_LEVELS[map_to] > ENTITY_LEVELS[entity]:
+            return getattr(self.entity_index, how)(values, entity, map_to)
+        return self.entity_index.broadcast(values, entity, map_to)
+
+    def df(
+        self, variables: List[str], map_to: str = None, how: str = "sum"
+    ) -> pd.DataFrame:
+        """Reads stored variables into a data frame.
+
+        Args:
+            variables (List[str]): The variable names.
+            map_to (str, optional): The entity to map to. Defaults to the
+                entity of the first variable.
+            how (str, optional): See `calc`. Defaults to "sum".
+
+        Returns:
+            pd.DataFrame: The values, one column per variable.
+        """
+        map_to = map_to or self.entity(variables[0])
+        return pd.DataFrame(
+            {
+                variable: self.calc(variable, map_to, how)
+                for variable in variables
+            }
+        )
+
+    def value_positions(
+        self, variable: str, values: Union[object, List[object]]
+    ) -> np.array:
+        """Finds the records of a variable's entity holding any of the given
+        values, using the stored value index if there is one.
+
+        Args:
+            variable (str): The variable name.
+            values (Union[object, List[object]]): The value or values.
+
+        Returns:
+            np.array: The record positions, in increasing order.
+        """
+        values = np.atleast_1d(values)
+        stored = self[variable]
+        if stored.dtype.kind == "S" and values.dtype.kind == "U":
+            values = np.char.encode(values)
+        if variable not in self.file.get(VALUE_INDEX, {}):
+            return np.flatnonzero(np.isin(stored[...], values))
+        index = self.file[VALUE_INDEX][variable]
+        offsets = index["offsets"][...]
+        groups = np.flatnonzero(np.isin(index["values"][...], values))
+        return group_members(offsets, index["positions"][...], groups)
+
+    def donors(self, entity: str) -> np.array:
+        """Whether each record of an entity is a zero-weight clone kept as a
+        donor (see `clone_and_replace_half`). None if none are recorded."""
+        if DONORS not in self.file:
+            return None
+        return self.file[DONORS][entity][...]
+
+    def households(
+        self,
+        where: Union[
+            Dict[str, object], Callable[["DatasetFile"], np.array]
+        ] = None,
+        donors: bool = True,
+    ) -> np.array:
+        """Finds the households matching a condition. A household matches if
+        any of its members (or the household itself) does.
+
+        Args:
+            where (Union[Dict[str, object], Callable], optional): Either a
+                mapping from stored variables to a value or list of values,
+                all of which must match, e.g. `dict(region="SCOTLAND")`; or a
+                function of this file returning a boolean array for persons,
+                benefit units or households, e.g.
+                `lambda data: data.calc("age") >= 65`. Defaults to None (all
+                households).
+            donors (bool, optional): Whether to include zero-weight donor
+                households. Defaults to True.
+
+        Returns:
+            np.array: The household positions, in increasing order.
+        """
+        index = self.entity_index
+        households = np.arange(index.sizes["household"])
+        if not donors and DONORS in self.file:
+            households = households[~self.donors("household")]
+        if where is None:
+            conditions = []
+        elif callable(where):
+            mask = np.asarray(where(self), dtype=bool)
+            entity = variable_entity("", len(mask), self.sizes, strict=True)
+            conditions = [(np.flatnonzero(mask), entity)]
+        else:
+            conditions = [
+                (self.value_positions(variable, values), self.entity(variable))
+                for variable, values in where.items()
+            ]
+        for positions, entity in conditions:
+            if entity not in ENTITY_LEVELS:
+                raise ValueError(
+                    f"Cannot select households by a {entity} condition."
+                )
+            households = np.intersect1d(
+                households,
+                index.positions(entity, "household")[positions],
+            )
+        return households
+
+    def subset(
+        self,
+        households: np.array,
+        variables: List[str] = None,
+        reindex: bool = False,
+    ) -> Batch:
+        """Reads a set of households, with their benefit units and persons.
+
+        Args:
+            households (np.array): The household positions, in increasing
+                order.
+            variables (List[str], optional): The variables to read. Defaults
+                to all. ID variables are always included.
+            reindex (bool, optional): Whether to number the IDs from zero
+                within the subset, rather than keep the stored IDs. Defaults
+                to False.
+
+        Returns:
+            Batch: The records.
+        """
+        index = self.entity_index
+        persons = group_members(
+            index.arrays["household_offsets"],
+            index.arrays["household_members"],
+            households,
+        )
+        benunits = group_members(*self.household_benunits, households)
+        positions = dict(
+            person=persons, benunit=benunits, household=households
+        )
+        data = {}
+        if reindex:
+            data = dict(
+                person_id=np.arange(len(persons)),
+                benunit_id=np.arange(len(benunits)),
+                household_id=np.arange(len(households)),
+                person_benunit_id=np.searchsorted(
+                    benunits, index.arrays["person_benunit"][persons]
+                ),
+                person_household_id=np.searchsorted(
+                    households, index.arrays["person_household"][persons]
+                ),
+            )
+        variables = variables or self.keys()
+        for variable in list(ID_VARIABLES) + list(variables):
+            if variable in data or variable not in self:
+                continue
+            entity = self.entity(variable)
+            if entity in positions:
+                data[variable] = read_rows(self[variable], positions[entity])
+            else:
+                data[variable] = self[variable][...]
+        return Batch(data, positions)
+
+    def batch(
+        self, first: int, last: int, variables: List[str] = None
+    ) -> Batch:
+        """Reads the households at positions `first` to `last` (exclusive),
+        with their benefit units and persons, and IDs re-indexed from zero.
+        """
+        return self.subset(np.arange(first, last), variables, reindex=True)
+
+    @property
+    def household_benunits(self) -> np.array:
+        """The CSR offsets and positions of the benefit units in each
+        household."""
+        if self._household_benunits is None:
+            index = self.entity_index
+            self._household_benunits = membership(
+                index.arrays["benunit_household"], index.sizes["household"]
+            )
+        return self._household_benunits
+
+    def iter_batches(
+        self,
+        households_per_batch: int = 10_000,
+        variables: List[str] = None,
+        prefetch: bool = True,
+    ) -> Iterator[Batch]:
+        """Iterates over batches of whole households (see `batch`). The next
+        batch is read on a background thread while the current one is used.
+
+        Args:
+            households_per_batch (int, optional): The households in each
+                batch. Defaults to 10,000.
+            variables (List[str], optional): The variables to read. Defaults
+                to all.
+            prefetch (bool, optional): Whether to read ahead on a background
+                thread. Defaults to True.
+
+        Yields:
+            Batch: The batches, in household order.
+        """
+        num_households = self.entity_index.sizes["household"]
+        starts = range(0, num_households, households_per_batch)
+        bounds = [
+            (start, min(start + households_per_batch, num_households))
+            for start in starts
+        ]
+        if not prefetch:
+            for first, last in bounds:
+                yield self.batch(first, last, variables)
+            return
+        with ThreadPoolExecutor(max_workers=1) as reader:
+            pending = None
+            for first, last in bounds:
+                upcoming = reader.submit(self.batch, first, last, variables)
+                if pending is not None:
+                    yield pending.result()
+                pending = upcoming
+            if pending is not None:
+                yield pending.result()
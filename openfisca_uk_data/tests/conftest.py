@@ -0,0 +1,69 @@
+from pathlib import Path
+import h5py
+import numpy as np
+import pytest
+from openfisca_uk_data.storage import DatasetFile
+
+
+def write_toy_dataset(path: Path, num_households: int = 200, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    household_size = rng.integers(1, 5, num_households)
+    household_id = (np.arange(num_households) + 1) * 100
+    person_household_id = np.repeat(household_id, household_size)
+    # Up to two benefit units per household
+    person_index = np.concatenate([np.arange(size) for size in household_size])
+    num_benunits = np.minimum(household_size, 2)
+    person_benunit_id = person_household_id + 10 * (
+        1 + person_index % np.repeat(num_benunits, household_size)
+    )
+    person_id = person_benunit_id + person_index + 1
+    benunit_id = np.unique(person_benunit_id)
+    num_people = len(person_id)
+    with h5py.File(path, mode="w") as f:
+        f["person_id"] = person_id
+        f["person_benunit_id"] = person_benunit_id
+        f["person_household_id"] = person_household_id
+        f["benunit_id"] = benunit_id
+        f["household_id"] = household_id
+        f["state_id"] = np.array([1])
+        f["person_state_id"] = np.ones(num_people, dtype=int)
+        f["state_weight"] = np.array([1])
+        f["age"] = rng.integers(0, 90, num_people).astype(float)
+        f["employment_income"] = rng.exponential(2e4, num_people) * (
+            rng.random(num_people) < 0.5
+        )
+        f["raw_person_weight"] = np.repeat(
+            rng.uniform(500, 2000, num_households), household_size
+        )
+        f["household_weight"] = f["raw_person_weight"][...][
+            np.cumsum(household_size) - household_size
+        ]
+        f["benunit_weight"] = rng.uniform(500, 2000, len(benunit_id))
+        f["benunit_rent"] = rng.uniform(0, 1e4, len(benunit_id))
+        f["region"] = rng.choice(
+            [b"LONDON", b"SCOTLAND", b"WALES"], num_households
+        )
+        f["tenure_type"] = rng.choice(
+            [b"RENT_PRIVATELY", b"OWNED_OUTRIGHT"], num_households
+        )
+
+
+@pytest.fixture
+def toy_dataset(tmp_path):
+    """A small model dataset with the same ID structure as the FRS, with the
+    `load` and `file` interface of a `dataset` class."""
+
+    class ToyDataset:
+        name = "toy"
+
+        def file(year):
+            return tmp_path / f"toy_{year}.h5"
+
+        def load(year, key: str = None):
+            if key is None:
+                return DatasetFile(h5py.File(ToyDataset.file(year), mode="r"))
+            with h5py.File(ToyDataset.file(year), mode="r") as f:
+                return f[key][...]
+
+    write_toy_dataset(ToyDataset.file(2019))
+    return ToyDataset
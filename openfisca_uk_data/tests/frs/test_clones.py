@@ -0,0 +1,64 @@
+import h5py
+import numpy as np
+from openfisca_uk_data.datasets.frs.frs_enhanced.general import (
+    append_clones,
+    clone_and_replace_half,
+    split_clones,
+)
+from openfisca_uk_data.entities import survey_ids
+from openfisca_uk_data.layers import link_variable
+
+
+def read_all(dataset, year):
+    with dataset.load(year) as data:
+        return {name: data[name][...] for name in data.keys()}
+
+
+def test_zero_weight_clones_stored_apart(toy_dataset):
+    # A layered copy of the toy dataset, cloned twice as in FRSEnhanced
+    with h5py.File(toy_dataset.file(2019), mode="r") as base, h5py.File(
+        toy_dataset.file(2020), mode="w"
+    ) as layered:
+        for name in base:
+            link_variable(layered, name, base[name])
+    original = read_all(toy_dataset, 2019)
+    clone_and_replace_half(toy_dataset, 2020, {}, weighting=0)
+    clone_and_replace_half(toy_dataset, 2020, {}, weighting=0)
+    cloned = read_all(toy_dataset, 2020)
+    num_households = len(original["household_id"])
+    # IDs stay dense, with the survey IDs kept as a lookup
+    assert (cloned["household_id"] == np.arange(4 * num_households)).all()
+    assert cloned["person_household_id"].max() < 4 * num_households
+    with toy_dataset.load(2020) as data:
+        assert (
+            survey_ids(data)["household"]
+            == np.tile(original["household_id"], 4)
+        ).all()
+
+    with toy_dataset.load(2020) as data:
+        donors = data.donors("household")
+        assert donors.sum() == 3 * num_households
+        assert (data["household_weight"][...][donors] == 0).all()
+        assert (
+            data.households(donors=False) == np.arange(num_households)
+        ).all()
+
+    split_clones(toy_dataset, 2020)
+    with toy_dataset.load(2020) as data:
+        assert data.sizes["household"] == num_households
+        assert data["employment_income"].is_virtual
+        assert np.isclose(
+            data["household_weight"][...].sum(),
+            original["household_weight"].sum(),
+        )
+        assert len(data["clones"]["person_id"]) == 3 * len(
+            original["person_id"]
+        )
+
+    append_clones(toy_dataset, 2020)
+    restored = read_all(toy_dataset, 2020)
+    assert restored.keys() == cloned.keys()
+    for name, values in cloned.items():
+        assert (restored[name] == values).all()
+    with toy_dataset.load(2020) as data:
+        assert (data.donors("household") == donors).all()
@@ -0,0 +1,43 @@
+import h5py
+import numpy as np
+import pandas as pd
+from openfisca_uk_data.datasets.frs.frs_enhanced.diagnostics import (
+    household_diagnostics,
+    weighted_deciles,
+    write_diagnostics,
+)
+
+
+def test_weighted_deciles_split_weight_evenly():
+    rng = np.random.default_rng(0)
+    values = rng.exponential(size=10_000)
+    weights = rng.uniform(1, 3, size=10_000)
+    deciles = weighted_deciles(values, weights)
+    shares = np.bincount(deciles, weights=weights)[1:] / weights.sum()
+    assert np.allclose(shares, 0.1, atol=0.01)
+    # Deciles are ordered by value
+    assert values[deciles == 1].max() <= values[deciles == 2].min()
+
+
+def test_diagnostics_from_stored_arrays(toy_dataset, tmp_path):
+    with h5py.File(toy_dataset.file(2019), mode="a") as f:
+        num_households = len(f["household_id"])
+        f["property_wealth"] = np.arange(num_households, dtype=float)
+    with toy_dataset.load(2019) as data:
+        households = household_diagnostics(data)
+        employment_income = data["employment_income"][...]
+        household_id = data["person_household_id"][...]
+    expected = pd.Series(employment_income).groupby(household_id).sum().values
+    assert np.allclose(households.household_market_income, expected)
+    assert households.decile.between(1, 10).all()
+
+    files = write_diagnostics(toy_dataset, 2019, tmp_path)
+    assert [file.suffix for file in files] == [".parquet", ".parquet"]
+    summary = pd.read_parquet(files[1]).set_index("variable")
+    weight = households.weight
+    assert np.isclose(
+        summary.loc["property_wealth", "mean"],
+        (households.property_wealth * weight).sum() / weight.sum(),
+    )
+    assert summary.loc["employment_income", "imputation"] == "spi"
+    assert summary.loc["employment_income", "entity"] == "person"
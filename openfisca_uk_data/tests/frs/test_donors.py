@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+import numpy as np
+import pandas as pd
+from microdf import MicroDataFrame
+from openfisca_uk_data.datasets.frs.frs_enhanced import donors, lcf_imputation
+
+
+def test_donor_artifact_is_reused_until_raw_file_changes(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(donors, "DONOR_DIR", tmp_path / "donors")
+    raw_file = tmp_path / "raw.h5"
+    raw_file.write_bytes(b"first release")
+    builds = []
+
+    def build():
+        builds.append(1)
+        frame = pd.DataFrame(dict(income=[1.0, 2.0], region=["A", "B"]))
+        return MicroDataFrame(frame, weights=np.array([10.0, 20.0]))
+
+    first = donors.donor_artifact("test", raw_file, build)
+    second = donors.donor_artifact("test", raw_file, build)
+    assert len(builds) == 1
+    assert list(second.columns) == ["income", "region"]
+    assert (second.weights.values == [10, 20]).all()
+    assert (second.income.values == first.income.values).all()
+
+    raw_file.write_bytes(b"second release")
+    donors.donor_artifact("test", raw_file, build)
+    assert len(builds) == 2
+    # The previous artifact is replaced
+    assert len(list((tmp_path / "donors").glob("test_*.parquet"))) == 1
+
+
+def test_concurrent_donor_builds_take_turns(tmp_path, monkeypatch):
+    monkeypatch.setattr(donors, "DONOR_DIR", tmp_path / "donors")
+    raw_file = tmp_path / "raw.h5"
+    raw_file.write_bytes(b"first release")
+    builds = []
+
+    def build():
+        builds.append(1)
+        time.sleep(0.1)
+        frame = pd.DataFrame(dict(income=[1.0, 2.0]))
+        return MicroDataFrame(frame, weights=np.array([10.0, 20.0]))
+
+    with ThreadPoolExecutor(max_workers=4) as threads:
+        results = list(
+            threads.map(
+                lambda _: donors.donor_artifact("test", raw_file, build),
+                range(4),
+            )
+        )
+    assert len(builds) == 1
+    assert all((result.income.values == [1, 2]).all() for result in results)
+
+
+def test_lcf_processing_annualises_spending(monkeypatch):
+    households = pd.DataFrame(
+        dict(case=[2, 1], weighta=[1.5, 2.0], G018=[2, 1], G019=[1, 0])
+    )
+    households["Gorx"] = [7, 11]
+    for i, code in enumerate(lcf_imputation.CATEGORY_NAMES):
+        households[code] = [i, np.nan]
+    people = pd.DataFrame(dict(case=[1, 2, 2]))
+    for variable in lcf_imputation.PERSON_LCF_RENAMES:
+        people[variable] = [1.0, 2.0, 3.0]
+    monkeypatch.setattr(
+        lcf_imputation,
+        "load_and_process_lcf",
+        lambda year: (households, people),
+    )
+    lcf = lcf_imputation.process_lcfs(2019)
+    assert list(lcf.index) == [1, 2]
+    assert (lcf.weights.values == [2000, 1500]).all()
+    assert list(lcf.region) == ["SCOTLAND", "LONDON"]
+    petrol = lcf_imputation.name_to_variable_name["Petrol spending"]
+    assert list(lcf[petrol]) == [0, 12 * 52]
+    assert list(lcf.employment_income) == [52, 5 * 52]
@@ -0,0 +1,60 @@
+import os
+import h5py
+import numpy as np
+from openfisca_uk_data.datasets.frs.frs_enhanced.frs_enhanced import (
+    copy_base,
+)
+from openfisca_uk_data.datasets.frs.frs_enhanced.uc_transition import (
+    migrate_to_universal_credit,
+)
+from openfisca_uk_data.entities import survey_ids, write_survey_ids
+from openfisca_uk_data.utils import FINGERPRINT
+
+
+def test_enhanced_datasets_keep_the_base_survey_ids(toy_dataset):
+    with h5py.File(toy_dataset.file(2019), mode="a") as base:
+        write_survey_ids(
+            base,
+            dict(
+                person=base["person_id"][...] + 1,
+                benunit=base["benunit_id"][...] + 1,
+                household=base["household_id"][...] + 1,
+            ),
+        )
+    with toy_dataset.load(2019) as base, h5py.File(
+        toy_dataset.file(2020), mode="w"
+    ) as enhanced:
+        copy_base(base, enhanced)
+    with toy_dataset.load(2019) as base, toy_dataset.load(2020) as enhanced:
+        expected, copied = survey_ids(base), survey_ids(enhanced)
+        assert copied.keys() == expected.keys()
+        for entity, values in expected.items():
+            assert (copied[entity] == values).all()
+        assert not (copied["household"] == base["household_id"][...]).any()
+
+
+def test_enhanced_datasets_survive_rebuilds_of_the_base(toy_dataset):
+    with h5py.File(toy_dataset.file(2019), mode="a") as base:
+        base.attrs[FINGERPRINT] = "first"
+    with toy_dataset.load(2019) as base, h5py.File(
+        toy_dataset.file(2020), mode="w"
+    ) as enhanced:
+        age = base["age"][...]
+        copy_base(base, enhanced)
+    # Rebuilds publish a new file in place of the old one
+    rebuilt = toy_dataset.file(2019).with_name("rebuilt.h5")
+    with h5py.File(rebuilt, mode="w") as base:
+        base["age"] = age + 1
+        base.attrs[FINGERPRINT] = "second"
+    os.replace(rebuilt, toy_dataset.file(2019))
+    with toy_dataset.load(2020) as enhanced:
+        assert enhanced["age"].is_virtual
+        assert (enhanced["age"][...] == age).all()
+
+
+def test_uc_migration_treats_unreported_benefits_as_zero(toy_dataset):
+    with h5py.File(toy_dataset.file(2019), mode="a") as data:
+        data["housing_benefit_reported"] = np.full(len(data["person_id"]), 5.0)
+    changes = migrate_to_universal_credit(toy_dataset, 2019)
+    assert (changes["universal_credit_reported"] == 5).all()
+    assert (changes["housing_benefit_reported"] == 0).all()
@@ -0,0 +1,120 @@
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+from openfisca_uk_data.datasets.frs.frs_enhanced.imputation import (
+    ENGINES,
+    HDF5Source,
+    get_engine,
+    stored_recipients,
+)
+from openfisca_uk_data.benchmarks.imputation import compare_imputations
+
+TEST_ARGUMENTS = dict(
+    random_forest=dict(n_estimators=20),
+    gradient_boosting=dict(max_iter=20),
+)
+
+
+def synthetic_survey(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    x = pd.DataFrame(
+        dict(age=rng.integers(16, 90, n), region=rng.integers(0, 12, n))
+    )
+    income = np.exp(8 + x.age / 40 + x.region / 20 + rng.normal(0, 0.5, n))
+    y = pd.DataFrame(
+        dict(income=income, wealth=income * rng.uniform(1, 10, n))
+    )
+    return x, y
+
+
+@pytest.mark.parametrize(
+    "engine", [engine for engine in ENGINES if engine != "synthimpute"]
+)
+def test_engine_preserves_distribution(engine):
+    x_train, y_train = synthetic_survey(2_000, seed=0)
+    x_new, y_new = synthetic_survey(2_000, seed=1)
+    imputed = get_engine(
+        dict(name=engine, random_state=0, **TEST_ARGUMENTS.get(engine, {}))
+    ).impute(x_train, y_train, x_new)
+    assert list(imputed.columns) == ["income", "wealth"]
+    assert len(imputed) == len(x_new)
+    comparison = compare_imputations(imputed, y_new)
+    assert (comparison.ks < 0.15).all()
+
+
+def test_max_donors_subsamples_by_weight():
+    x, y = synthetic_survey(1_000)
+    engine = get_engine(dict(name="random_forest", max_donors=100))
+    x_sample, y_sample, weights = engine.donors(x, y, np.ones(len(x)))
+    assert len(x_sample) == len(y_sample) == 100
+    assert weights is None
+
+
+def test_recipient_predictors_are_selected_by_name():
+    x_train, y_train = synthetic_survey(1_000, seed=0)
+    x_new, _ = synthetic_survey(500, seed=1)
+    engine = get_engine(dict(name="random_forest", n_estimators=10))
+    engine.fit(x_train, y_train)
+    reordered = x_new[["region", "age"]].assign(weight=1.0)
+    expected = engine.predict(x_new, np.random.default_rng(0))
+    imputed = engine.predict(reordered, np.random.default_rng(0))
+    assert (imputed.values == expected.values).all()
+
+
+def test_nearest_neighbour_transfers_donor_vectors_within_cells():
+    x_train, y_train = synthetic_survey(2_000, seed=0)
+    x_new, _ = synthetic_survey(1_000, seed=1)
+    imputed = get_engine("nearest_neighbour").impute(x_train, y_train, x_new)
+    donors = pd.concat([x_train, y_train], axis=1)
+    matches = pd.concat([x_new, imputed], axis=1).merge(
+        donors, on=["income", "wealth"], suffixes=("", "_donor")
+    )
+    # Every imputed vector is a whole donor record from the same region
+    assert len(matches) == len(x_new)
+    assert (matches.region == matches.region_donor).all()
+
+
+def test_chunked_imputation_writes_into_dataset_columns(tmp_path):
+    x_train, y_train = synthetic_survey(2_000, seed=0)
+    x_new, _ = synthetic_survey(1_000, seed=1)
+    with h5py.File(tmp_path / "recipients.h5", mode="w") as f:
+        for column in x_new.columns:
+            f[column] = x_new[column].values
+        f["income"] = np.full(1_500, -1.0)
+    results = []
+    for threads in (1, 4):
+        with h5py.File(tmp_path / "recipients.h5", mode="a") as f:
+            get_engine(
+                dict(name="nearest_neighbour", random_state=0)
+            ).impute_to(
+                x_train,
+                y_train,
+                HDF5Source(f, list(x_new.columns)),
+                f,
+                offset=500,
+                chunk_size=128,
+                threads=threads,
+            )
+            results.append((f["income"][...], f["wealth"][...]))
+            # Written columns are stored by the precision policy
+            assert f["wealth"].dtype == np.float32
+    income, wealth = results[0]
+    # Rows before the offset are untouched, and new columns are created
+    assert (income[:500] == -1).all()
+    assert np.isin(income[500:], y_train.income.astype(np.float32)).all()
+    assert len(wealth) == 1_500
+    # Each chunk has its own random stream, so threading does not matter
+    assert all((a == b).all() for a, b in zip(results[0], results[1]))
+
+
+def test_stored_recipients_impute_like_frames():
+    x_train, y_train = synthetic_survey(1_000, seed=0)
+    x_new, _ = synthetic_survey(500, seed=1)
+    spec = dict(name="nearest_neighbour", random_state=0)
+    expected = get_engine(spec).impute(x_train, y_train, x_new)
+    columns = ((column, x_new[column].values) for column in x_new.columns)
+    with stored_recipients(columns) as source:
+        assert len(source) == len(x_new)
+        imputed = get_engine(spec).impute(x_train, y_train, source)
+    assert (imputed.values == expected.values).all()
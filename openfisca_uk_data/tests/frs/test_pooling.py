@@ -0,0 +1,68 @@
+import h5py
+import numpy as np
+from openfisca_uk_data.datasets.frs.frs import FRS
+from openfisca_uk_data.datasets.frs.frs_enhanced import FRSEnhanced
+from openfisca_uk_data.datasets.frs.pooled_frs import (
+    PooledFRS,
+    pool_datasets,
+)
+from openfisca_uk_data.entities import EntityIndex
+from openfisca_uk_data.storage import DatasetFile
+from openfisca_uk_data.tests.conftest import write_toy_dataset
+from openfisca_uk_data.utils import required_inputs
+
+
+def test_pooled_ids_and_weights(toy_dataset, tmp_path):
+    # A second year with the same IDs, and a variable missing from the first
+    write_toy_dataset(toy_dataset.file(2020), num_households=150, seed=1)
+    with h5py.File(toy_dataset.file(2020), mode="a") as f:
+        f["pension_income"] = np.ones(len(f["person_id"]))
+    sources = [(toy_dataset, 2019), (toy_dataset, 2020)]
+    with h5py.File(tmp_path / "pooled.h5", mode="w") as target:
+        pool_datasets(sources, target)
+    with DatasetFile(h5py.File(tmp_path / "pooled.h5", mode="r")) as pooled:
+        originals = [dataset.load(year) for dataset, year in sources]
+        for id_variable in ("person_id", "benunit_id", "household_id"):
+            ids = pooled[id_variable][...]
+            assert (ids == np.arange(len(ids))).all()
+        assert np.isclose(
+            pooled["household_weight"][...].sum(),
+            sum(data["household_weight"][...].sum() for data in originals) / 2,
+        )
+        assert (
+            np.bincount(pooled["source_year"][...] - 2019)
+            == [data.sizes["household"] for data in originals]
+        ).all()
+        num_persons = originals[0].sizes["person"]
+        assert (pooled["pension_income"][:num_persons] == 0).all()
+        assert (pooled["pension_income"][num_persons:] == 1).all()
+        # The stacked entity index matches one rebuilt from the IDs
+        rebuilt = EntityIndex.build(
+            *(
+                pooled[key][...]
+                for key in (
+                    "person_benunit_id",
+                    "person_household_id",
+                    "benunit_id",
+                    "household_id",
+                )
+            )
+        )
+        for key, values in rebuilt.arrays.items():
+            assert (pooled.entity_index.arrays[key] == values).all()
+        for data in originals:
+            data.close()
+
+
+def test_pooled_inputs_follow_generation_arguments():
+    assert required_inputs(PooledFRS, 2019) == [
+        (FRS, 2017),
+        (FRS, 2018),
+        (FRS, 2019),
+    ]
+    assert required_inputs(PooledFRS, 2019, 2, enhanced=True) == [
+        (FRSEnhanced, 2018),
+        (FRSEnhanced, 2019),
+    ]
+    # Generation arguments that do not change the inputs are not passed on
+    assert required_inputs(FRSEnhanced, 2019, engines={})[0] == (FRS, 2019)
@@ -0,0 +1,57 @@
+import h5py
+import numpy as np
+from openfisca_uk_data.datasets.frs.frs import merge_shards, shard_ranges
+from openfisca_uk_data.entities import (
+    entity_sizes,
+    normalize_ids,
+    survey_ids,
+    variable_entity,
+)
+
+
+def test_shard_ranges_cover_households():
+    household_id = np.arange(1, 101) * 100
+    ranges = shard_ranges(household_id[::-1], 3)
+    assert ranges == [(100, 3400), (3500, 6700), (6800, 10000)]
+    assert len(shard_ranges(household_id[:2], 5)) == 2
+
+
+def test_merged_shards_match_unsharded(toy_dataset, tmp_path):
+    with toy_dataset.load(2019) as data:
+        original = {key: data[key][...] for key in data.keys()}
+        sizes = entity_sizes(data)
+    household_of = dict(
+        person=original["person_household_id"],
+        benunit=original["benunit_id"] // 100 * 100,
+        household=original["household_id"],
+    )
+    paths = []
+    for i, (first, last) in enumerate(
+        shard_ranges(original["household_id"], 3)
+    ):
+        paths.append(tmp_path / f"shard_{i}.h5")
+        with h5py.File(paths[-1], mode="w") as shard:
+            for key, values in original.items():
+                entity = variable_entity(key, len(values), sizes)
+                if entity == "state":
+                    # Every shard stores the state variables in full
+                    shard[key] = values
+                    continue
+                in_shard = (household_of[entity] >= first) & (
+                    household_of[entity] <= last
+                )
+                shard[key] = values[in_shard]
+    merge_shards(paths, tmp_path / "merged.h5")
+    normalized = normalize_ids(original)
+    with h5py.File(tmp_path / "merged.h5", mode="r") as merged:
+        for key, values in original.items():
+            expected = normalized.get(key, values)
+            assert merged[key].shape == expected.shape
+            assert (merged[key][...] == expected).all()
+        assert (merged["state_id"][...] == [1]).all()
+        assert (merged["state_weight"][...] == [1]).all()
+        # The survey IDs are kept as a lookup
+        survey = survey_ids(merged)
+        assert (survey["person"] == original["person_id"]).all()
+        assert (survey["household"] == original["household_id"]).all()
+        assert "entity_index" in merged
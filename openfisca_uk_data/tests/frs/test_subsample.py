@@ -0,0 +1,68 @@
+import h5py
+import numpy as np
+import pytest
+from openfisca_uk_data.datasets.frs.frs_enhanced.general import subsample
+
+
+def test_subsample_is_entity_consistent(toy_dataset):
+    original_weight = toy_dataset.load(2019, "household_weight").sum()
+    subsample(toy_dataset, 2019, frac=0.1, seed=0)
+    with toy_dataset.load(2019) as f:
+        household_id = f["household_id"][...]
+        assert 10 < len(household_id) < 40
+        assert np.isin(f["person_household_id"][...], household_id).all()
+        assert np.isin(f["benunit_id"][...], f["person_benunit_id"][...]).all()
+        assert np.isin(f["person_benunit_id"][...], f["benunit_id"][...]).all()
+        assert len(f["age"]) == len(f["person_id"])
+        assert len(f["benunit_rent"]) == len(f["benunit_id"])
+        assert np.isclose(f["household_weight"][...].sum(), original_weight)
+
+
+def test_subsample_needs_entities_of_ambiguous_variables(toy_dataset):
+    # One benefit unit per household, stored in the reverse order, so that
+    # household variables cannot be told from benefit unit variables by
+    # length
+    household_id = np.arange(20)
+    benunit_id = household_id[::-1].copy()
+    with h5py.File(toy_dataset.file(2019), mode="w") as f:
+        f["person_id"] = np.arange(40)
+        f["person_household_id"] = np.repeat(household_id, 2)
+        f["person_benunit_id"] = 19 - np.repeat(household_id, 2)
+        f["benunit_id"] = benunit_id
+        f["household_id"] = household_id
+        f["household_weight"] = np.ones(20)
+        f["rent"] = household_id * 10.0
+    with pytest.raises(ValueError, match="rent"):
+        subsample(toy_dataset, 2019, frac=0.5, seed=0, stratify_by=())
+    subsample(
+        toy_dataset,
+        2019,
+        frac=0.5,
+        seed=0,
+        stratify_by=(),
+        entities=dict(rent="household"),
+    )
+    with toy_dataset.load(2019) as f:
+        assert len(f["household_id"]) == 10
+        survey_household = f["survey_ids"]["household"][...]
+        assert (f["rent"][...] == survey_household * 10).all()
+        # The given entity is recorded for later readers
+        assert f.entity("rent") == "household"
+
+
+def test_subsample_keeps_donors(toy_dataset):
+    with h5py.File(toy_dataset.file(2019), mode="a") as f:
+        donors = f.create_group("donors")
+        for entity, key in (
+            ("person", "person_id"),
+            ("benunit", "benunit_id"),
+            ("household", "household_id"),
+        ):
+            donors[entity] = f[key][...] % 3 == 0
+        f.attrs["layers"] = "{}"
+    subsample(toy_dataset, 2019, frac=0.5, seed=0)
+    with toy_dataset.load(2019) as f:
+        assert f.attrs["layers"] == "{}"
+        for entity in ("person", "benunit", "household"):
+            survey = f["survey_ids"][entity][...]
+            assert (f.donors(entity) == (survey % 3 == 0)).all()
@@ -18,3 +18,19 @@ def test_synth_works_with_openfisca_uk():
         adjust_weights=False,
     )
     assert not sim.calc("net_income", 2022).isna().any()
+
+
+def test_synth_anonymisation_is_seeded():
+    import numpy as np
+    from openfisca_uk_data.datasets.frs.synth_frs import (
+        anonymise,
+        variable_rng,
+    )
+
+    values = np.arange(100, dtype=float)
+    first = anonymise(values, "numeric", variable_rng(0, 1, "age"))
+    second = anonymise(values, "numeric", variable_rng(0, 1, "age"))
+    other_replica = anonymise(values, "numeric", variable_rng(0, 2, "age"))
+    assert (first == second).all()
+    assert (first != other_replica).any()
+    assert abs(first.sum() / values.sum() - 1) < 3e-2
@@ -0,0 +1,33 @@
+import h5py
+import numpy as np
+from openfisca_uk_data.datasets.frs.upscaled_synth_frs import upscale_variable
+
+
+def test_upscaled_copies_perturb_whole_records(toy_dataset, tmp_path):
+    with toy_dataset.load(2019) as source, h5py.File(
+        tmp_path / "upscaled.h5", mode="w"
+    ) as target:
+        for name in ("age", "employment_income", "region"):
+            upscale_variable(
+                name,
+                source[name],
+                target,
+                factor=3,
+                seed=0,
+                entity=source.entity(name),
+            )
+        n = source.sizes["person"]
+        age, income = target["age"][...], target["employment_income"][...]
+        assert (age[:n] == source["age"][...]).all()
+        # Each person's numeric variables share one noise factor per copy
+        both = (age[:n] > 0) & (income[:n] > 0)
+        for copy in (1, 2):
+            rows = slice(copy * n, (copy + 1) * n)
+            assert np.allclose(
+                age[rows][both] / age[:n][both],
+                income[rows][both] / income[:n][both],
+            )
+        assert not np.allclose(age[n : 2 * n], age[2 * n :])
+        # Non-numeric variables are kept with their record
+        region = target["region"][...]
+        assert (region == np.tile(source["region"][...], 3)).all()
@@ -7,7 +7,7 @@ TEST_YEAR = 2018
 
 FRS.generate(2018)
 
-with h5py.File(FRS.file(TEST_YEAR)) as f:
+with FRS.load(TEST_YEAR) as f:
     VARIABLES = list(f.keys())
 
 
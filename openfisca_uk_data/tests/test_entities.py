@@ -0,0 +1,54 @@
+import h5py
+import numpy as np
+import pandas as pd
+from openfisca_uk_data.entities import (
+    EntityIndex,
+    normalized_ids,
+    write_entity_index,
+)
+
+
+def test_entity_index_aggregates_and_broadcasts(toy_dataset):
+    with h5py.File(toy_dataset.file(2019), mode="a") as f:
+        write_entity_index(f)
+    with toy_dataset.load(2019) as f:
+        assert "entity_index" not in f.keys()
+        index = f.entity_index
+        income = f["employment_income"][...]
+        person_household_id = f["person_household_id"][...]
+        household_id = f["household_id"][...]
+        region = f["region"][...]
+    expected = (
+        pd.Series(income).groupby(person_household_id).sum()[household_id]
+    )
+    assert np.allclose(index.sum(income, "person", "household"), expected)
+    person_region = index.broadcast(region, "household", "person")
+    assert (
+        person_region
+        == pd.Series(region, index=household_id)[person_household_id].values
+    ).all()
+    first = index.first(person_household_id, "person", "household")
+    assert (first == household_id).all()
+    members = index.members("household", 3)
+    assert (person_household_id[members] == household_id[3]).all()
+
+
+def test_normalized_ids_are_positions(toy_dataset):
+    with toy_dataset.load(2019) as f:
+        ids = normalized_ids(f)
+        household_id = f["household_id"][...]
+        person_household_id = f["person_household_id"][...]
+    assert (ids["household_id"] == np.arange(len(household_id))).all()
+    assert ids["person_household_id"].dtype == np.int32
+    assert (
+        household_id[ids["person_household_id"]] == person_household_id
+    ).all()
+    rebuilt = EntityIndex.build(
+        ids["person_benunit_id"],
+        ids["person_household_id"],
+        ids["benunit_id"],
+        ids["household_id"],
+    )
+    assert (
+        rebuilt.arrays["person_household"] == ids["person_household_id"]
+    ).all()
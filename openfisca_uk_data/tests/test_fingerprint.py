@@ -0,0 +1,171 @@
+import h5py
+import numpy as np
+import pytest
+from openfisca_uk_data.utils import dataset, UK
+
+generated_years = []
+
+
+@dataset
+class FingerprintTest:
+    name = "fingerprint_test"
+    model = UK
+
+    def generate(year: int):
+        generated_years.append(year)
+        with h5py.File(FingerprintTest.file(year), mode="w") as f:
+            f["person_id"] = np.arange(3)
+
+
+def test_generate_skips_up_to_date_datasets():
+    try:
+        FingerprintTest.generate(2019)
+        FingerprintTest.generate(2019)
+        assert generated_years == [2019]
+        assert FingerprintTest.stored_fingerprint(2019) is not None
+        FingerprintTest.generate(2019, force=True)
+        assert generated_years == [2019, 2019]
+    finally:
+        FingerprintTest.remove(2019)
+
+
+@dataset
+class RawChainTest:
+    name = "raw_chain_test"
+
+    def generate(year: int, value: int = 0):
+        with h5py.File(RawChainTest.file(year), mode="w") as f:
+            f["value"] = np.full(3, value)
+
+
+@dataset
+class RawArchiveTest:
+    name = "raw_archive_test"
+
+    def generate(zipfile, year) -> None:
+        with h5py.File(RawArchiveTest.file(year), mode="w") as f:
+            f["source"] = str(zipfile)
+
+
+def test_raw_generation_finds_the_year_by_name(tmp_path):
+    try:
+        RawArchiveTest.generate(tmp_path / "archive.zip", 2019)
+        assert RawArchiveTest.file(2019).exists()
+        assert RawArchiveTest.years == [2019]
+    finally:
+        RawArchiveTest.remove(2019)
+
+
+@dataset
+class ChainTest:
+    name = "chain_test"
+    model = UK
+
+    def requires(year: int) -> list:
+        return [(RawChainTest, year)]
+
+    def generate(year: int):
+        with h5py.File(RawChainTest.file(year), mode="r") as raw, h5py.File(
+            ChainTest.file(year), mode="w"
+        ) as f:
+            f["person_id"] = np.arange(3)
+            f["value"] = raw["value"][...]
+
+
+@dataset
+class DerivedChainTest:
+    name = "derived_chain_test"
+    model = UK
+
+    def requires(year: int) -> list:
+        return [(ChainTest, year)]
+
+    def generate(year: int):
+        with ChainTest.load(year) as source, h5py.File(
+            DerivedChainTest.file(year), mode="w"
+        ) as f:
+            f["person_id"] = source["person_id"][...]
+            f["value"] = source["value"][...] * 2
+
+
+def test_generate_updates_changed_inputs():
+    try:
+        RawChainTest.generate(2019, value=1)
+        ChainTest.generate(2019)
+        DerivedChainTest.generate(2019)
+        assert DerivedChainTest.load(2019, "value")[0] == 2
+        # Changing the raw data leaves the intermediate dataset stale, which
+        # is rebuilt before the derived dataset is compared
+        RawChainTest.generate(2019, value=5)
+        DerivedChainTest.generate(2019)
+        assert ChainTest.load(2019, "value")[0] == 5
+        assert DerivedChainTest.load(2019, "value")[0] == 10
+    finally:
+        for test_dataset in (RawChainTest, ChainTest, DerivedChainTest):
+            test_dataset.remove(2019)
+
+
+@dataset
+class OptionalInputTest:
+    name = "optional_input_test"
+    model = UK
+
+    def requires(year: int) -> list:
+        return [(RawChainTest, year)]
+
+    def generate(year: int):
+        with h5py.File(OptionalInputTest.file(year), mode="w") as f:
+            f["person_id"] = np.arange(3)
+
+
+def test_generate_records_missing_inputs():
+    try:
+        assert not RawChainTest.file(2019).exists()
+        OptionalInputTest.generate(2019)
+        assert OptionalInputTest.stored_fingerprint(2019) is not None
+        RawChainTest.generate(2019, value=1)
+        assert OptionalInputTest.fingerprint(
+            2019
+        ) != OptionalInputTest.stored_fingerprint(2019)
+    finally:
+        for test_dataset in (RawChainTest, OptionalInputTest):
+            test_dataset.remove(2019)
+
+
+observed_values = []
+
+
+@dataset
+class StagedTest:
+    name = "staged_test"
+    model = UK
+
+    def generate(year: int, value: int = 0, fail: bool = False):
+        with h5py.File(StagedTest.file(year), mode="w") as f:
+            f["person_id"] = np.arange(3)
+            f["value"] = np.full(3, value)
+        published = StagedTest.data_dir / StagedTest.filename(year)
+        if published.exists():
+            with h5py.File(published, mode="r") as f:
+                observed_values.append(f["value"][0])
+        if fail:
+            raise RuntimeError("Generation failed")
+
+
+def test_generate_publishes_atomically():
+    try:
+        StagedTest.generate(2019, value=1)
+        reader = StagedTest.load(2019)
+        StagedTest.generate(2019, value=2)
+        # The published file was unchanged until generation completed, and
+        # open readers keep their snapshot
+        assert observed_values == [1]
+        assert reader["value"][0] == 1
+        reader.close()
+        assert StagedTest.load(2019, "value")[0] == 2
+        with pytest.raises(RuntimeError):
+            StagedTest.generate(2019, value=3, fail=True)
+        assert StagedTest.load(2019, "value")[0] == 2
+        assert not list(StagedTest.data_dir.glob(".staged_test_*.tmp"))
+    finally:
+        StagedTest.remove(2019)
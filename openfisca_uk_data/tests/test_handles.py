@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import h5py
+import numpy as np
+import pytest
+from openfisca_uk_data.handles import HandlePool
+from openfisca_uk_data.layers import link_variable, record_layer
+from openfisca_uk_data.tests.conftest import write_toy_dataset
+from openfisca_uk_data.utils import FINGERPRINT
+
+
+def test_handles_are_shared_and_reference_counted(toy_dataset):
+    pool = HandlePool()
+    path = toy_dataset.file(2019)
+    first = pool.open(path)
+    with pool.open(path) as second:
+        assert second.file is first.file
+        assert len(pool) == 1
+    # Releasing one handle leaves the file open for the other
+    assert len(first["age"][...]) == first.sizes["person"]
+    first.close()
+    first.close()
+    assert pool.files[path.resolve()].references == 0
+    with ThreadPoolExecutor(max_workers=8) as threads:
+        totals = list(
+            threads.map(lambda _: pool.open(path)["age"][...].sum(), range(32))
+        )
+    assert len(set(totals)) == 1
+    assert pool.files[path.resolve()].references == 0
+    pool.clear()
+    assert len(pool) == 0
+
+
+def test_replaced_files_are_reopened(toy_dataset, tmp_path):
+    pool = HandlePool()
+    path = toy_dataset.file(2019)
+    old = pool.open(path)
+    num_households = old.sizes["household"]
+    write_toy_dataset(tmp_path / "new.h5", num_households=50)
+    os.replace(tmp_path / "new.h5", path)
+    with pool.open(path) as new:
+        assert new.sizes["household"] == 50
+    # The previous version stays readable until its last handle is released
+    assert len(old["household_id"][...]) == num_households
+    old_file = old.file
+    old.close()
+    assert not old_file.id.valid
+
+
+def test_idle_files_are_evicted_least_recently_used_first(tmp_path):
+    pool = HandlePool(max_handles=2)
+    paths = [tmp_path / f"toy_{i}.h5" for i in range(3)]
+    for path in paths:
+        write_toy_dataset(path, num_households=10)
+    in_use = pool.open(paths[0])
+    for path in paths[1:]:
+        pool.open(path).close()
+    assert len(pool) == 3
+    pool.open(paths[1]).close()
+    in_use.close()
+    # Of the idle files, the least recently used (paths[2]) is closed
+    assert set(pool.files) == {paths[0].resolve(), paths[1].resolve()}
+    assert isinstance(pool.open(paths[2]).file, h5py.File)
+
+
+def test_layered_files_track_their_base_files(toy_dataset, tmp_path):
+    pool = HandlePool()
+    base_path, path = toy_dataset.file(2019), toy_dataset.file(2020)
+    with h5py.File(base_path, mode="a") as base:
+        base.attrs[FINGERPRINT] = "base"
+    with h5py.File(base_path, mode="r") as base, h5py.File(
+        path, mode="w"
+    ) as layered:
+        for name in base:
+            link_variable(layered, name, base[name])
+        record_layer(layered, base)
+    first = pool.open(path)
+    first.close()
+    # A base file rewritten with the same build is reopened
+    write_toy_dataset(tmp_path / "new.h5")
+    with h5py.File(tmp_path / "new.h5", mode="a") as base:
+        base.attrs[FINGERPRINT] = "base"
+    os.replace(tmp_path / "new.h5", base_path)
+    with pool.open(path) as second:
+        assert second.file is not first.file
+    # A cached layered file is re-checked against its base files
+    with h5py.File(base_path, mode="a") as base:
+        base.attrs[FINGERPRINT] = "rebuilt"
+    with pytest.raises(ValueError):
+        pool.open(path)
@@ -0,0 +1,61 @@
+import h5py
+import numpy as np
+import pytest
+from openfisca_uk_data.datasets.frs.frs_enhanced.general import (
+    clone_and_replace_half,
+)
+from openfisca_uk_data.layers import (
+    copy_on_write,
+    link_variable,
+    materialize,
+    record_layer,
+)
+from openfisca_uk_data.utils import FINGERPRINT
+
+
+def test_layered_clones_read_like_copies(toy_dataset, tmp_path):
+    with h5py.File(toy_dataset.file(2019), mode="a") as base:
+        base.attrs[FINGERPRINT] = "base"
+    with h5py.File(toy_dataset.file(2019), mode="r") as base, h5py.File(
+        toy_dataset.file(2020), mode="w"
+    ) as layered:
+        for name in base:
+            link_variable(layered, name, base[name])
+        record_layer(layered, base)
+    with toy_dataset.load(2019) as base:
+        original = {name: base[name][...] for name in base.keys()}
+    age = np.zeros_like(original["age"])
+    clone_and_replace_half(toy_dataset, 2020, dict(age=age), weighting=0)
+    with toy_dataset.load(2020) as layered:
+        assert layered["employment_income"].is_virtual
+        assert not layered["age"].is_virtual
+        assert not layered["person_id"].is_virtual
+        assert (
+            layered["employment_income"][...]
+            == np.tile(original["employment_income"], 2)
+        ).all()
+        assert (
+            layered["age"][...] == np.concatenate([original["age"], age])
+        ).all()
+        assert (layered["state_id"][...] == original["state_id"]).all()
+
+    # Writes to a referenced variable do not reach the base file
+    with h5py.File(toy_dataset.file(2020), mode="a") as layered:
+        copy_on_write(layered, "benunit_rent")
+        layered["benunit_rent"][0] = -1
+    assert toy_dataset.load(2019, "benunit_rent")[0] >= 0
+
+    with h5py.File(toy_dataset.file(2020), mode="r") as layered, h5py.File(
+        tmp_path / "flat.h5", mode="w"
+    ) as flat:
+        materialize(layered, flat)
+        assert not flat["employment_income"].is_virtual
+        assert (
+            flat["employment_income"][...] == layered["employment_income"][...]
+        ).all()
+
+    # Loads fail once the base file has changed
+    with h5py.File(toy_dataset.file(2019), mode="a") as base:
+        base.attrs[FINGERPRINT] = "changed"
+    with pytest.raises(ValueError):
+        toy_dataset.load(2020)
@@ -0,0 +1,27 @@
+import h5py
+import numpy as np
+from openfisca_uk_data.precision import storage_values
+from openfisca_uk_data.storage import DatasetWriter
+
+
+def test_storage_precision(tmp_path):
+    rng = np.random.default_rng(0)
+    income = rng.exponential(2e4, 1_000)
+    assert storage_values("employment_income", income).dtype == np.float32
+    # Integral IDs stored as floats become narrow integers
+    ids = np.arange(1_000, dtype=float) * 100
+    assert storage_values("person_id", ids).dtype == np.int32
+    assert storage_values("num_bedrooms", np.arange(5)).dtype == np.int8
+    # Values float32 cannot hold within the tolerance are kept
+    assert storage_values("x", np.array([1e300])).dtype == np.float64
+    strings = np.array([b"LONDON", b"WALES"])
+    assert storage_values("region", strings) is strings
+
+    with h5py.File(tmp_path / "data.h5", mode="w") as file:
+        data = DatasetWriter(file)
+        data["employment_income"] = income
+        data["person_id"] = ids
+        report = data.report().set_index("variable")
+    assert report.stored_bytes.sum() <= report.bytes.sum() / 2
+    assert report.max_relative_error.max() < 1e-6
+    assert report.total_drift.max() < 1e-6
@@ -0,0 +1,191 @@
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+from openfisca_uk_data.entities import write_variable_entities
+from openfisca_uk_data.storage import (
+    DatasetFile,
+    DatasetWriter,
+    densify,
+    pack,
+    unpack_column,
+    write_value_index,
+)
+from openfisca_uk_data.datasets.frs.frs_enhanced.uc_transition import (
+    migrate_to_universal_credit,
+)
+
+
+def test_calc_maps_between_entities(toy_dataset):
+    with toy_dataset.load(2019) as data:
+        person_household_id = data["person_household_id"][...]
+        employment_income = data["employment_income"][...]
+        household_income = data.calc("employment_income", map_to="household")
+        expected = (
+            pd.Series(employment_income)
+            .groupby(person_household_id)
+            .sum()
+            .loc[data["household_id"][...]]
+        )
+        assert np.allclose(household_income, expected)
+        assert data.entity("benunit_rent") == "benunit"
+        assert data.calc("region").dtype.kind == "U"
+        people = data.df(["age", "region"], map_to="person")
+        assert len(people) == len(person_household_id)
+        first = people.groupby(person_household_id, sort=False).region.first()
+        assert (first.values == data.calc("region")).all()
+        assert (
+            data.calc("employment_income", map_to="household", how="any").dtype
+            == bool
+        )
+
+
+def test_ambiguous_entities_must_be_given(tmp_path):
+    # One benefit unit per household, so that household and benefit unit
+    # variables have the same length
+    with h5py.File(tmp_path / "ambiguous.h5", mode="w") as f:
+        f["person_id"] = np.arange(4)
+        f["person_benunit_id"] = np.arange(4) // 2
+        f["person_household_id"] = np.arange(4) // 2
+        f["benunit_id"] = np.arange(2)
+        f["household_id"] = np.arange(2)
+        f["rent"] = np.array([100.0, 200.0])
+        f["benefits"] = np.array([1.0, 2.0])
+        write_variable_entities(f, dict(benefits="benunit"))
+    with DatasetFile(h5py.File(tmp_path / "ambiguous.h5", mode="r")) as data:
+        assert data.entity("benefits") == "benunit"
+        with pytest.raises(ValueError, match="rent"):
+            data.calc("rent", map_to="person")
+        data.entities["rent"] = "household"
+        assert (
+            data.calc("rent", map_to="person") == [100, 100, 200, 200]
+        ).all()
+
+
+def test_uc_migration_reads_stored_inputs(toy_dataset):
+    with h5py.File(toy_dataset.file(2019), mode="a") as f:
+        num_people = len(f["person_id"])
+        f["universal_credit_reported"] = np.ones(num_people)
+        f["housing_benefit_reported"] = np.full(num_people, 2.0)
+    changes = migrate_to_universal_credit(toy_dataset, 2019)
+    assert (changes["universal_credit_reported"] == 3).all()
+    assert (changes["housing_benefit_reported"] == 0).all()
+    assert "child_tax_credit_reported" not in changes
+
+
+def test_batches_hold_whole_households(toy_dataset):
+    with toy_dataset.load(2019) as data:
+        household_id = data["household_id"][...]
+        person_household_id = data["person_household_id"][...]
+        benunit_id = data["benunit_id"][...]
+        person_benunit_id = data["person_benunit_id"][...]
+        age = data["age"][...]
+        benunit_rent = data["benunit_rent"][...]
+        seen = dict(person=[], benunit=[], household=[])
+        for batch in data.iter_batches(households_per_batch=30):
+            for entity in seen:
+                seen[entity].append(batch.positions[entity])
+            persons = batch.positions["person"]
+            benunits = batch.positions["benunit"]
+            households = batch.positions["household"]
+            # Local IDs point to the same records as the original IDs
+            assert (
+                household_id[households][batch["person_household_id"]]
+                == person_household_id[persons]
+            ).all()
+            assert (
+                benunit_id[benunits][batch["person_benunit_id"]]
+                == person_benunit_id[persons]
+            ).all()
+            assert (batch["age"] == age[persons]).all()
+            assert (batch["benunit_rent"] == benunit_rent[benunits]).all()
+            assert len(batch["state_id"]) == 1
+        for entity, positions in seen.items():
+            positions = np.concatenate(positions)
+            assert (np.sort(positions) == np.arange(data.sizes[entity])).all()
+
+
+def test_filtered_subset_keeps_whole_households(toy_dataset):
+    with h5py.File(toy_dataset.file(2019), mode="a") as f:
+        write_value_index(f)
+    with toy_dataset.load(2019) as data:
+        region = data.calc("region")
+        households = data.households(dict(region="SCOTLAND"))
+        assert (households == np.flatnonzero(region == "SCOTLAND")).all()
+        scotland = data.subset(households)
+        assert (scotland["region"] == b"SCOTLAND").all()
+        assert np.isin(
+            scotland["person_household_id"], scotland["household_id"]
+        ).all()
+        assert np.isin(
+            scotland["benunit_id"], scotland["person_benunit_id"]
+        ).all()
+        # Person conditions select the households of matching persons
+        older = data.households(lambda data: data.calc("age") >= 80)
+        expected = np.unique(
+            data.entity_index.arrays["person_household"][
+                data.calc("age") >= 80
+            ]
+        )
+        assert (older == expected).all()
+        all_ages = data.subset(older)["age"]
+        assert len(all_ages) == len(
+            data.subset(older, reindex=True)["person_id"]
+        )
+        assert (all_ages < 80).any()
+
+
+def test_sparse_variables_read_densely(tmp_path):
+    rng = np.random.default_rng(0)
+    values = rng.exponential(1e3, 1_000) * (rng.random(1_000) < 0.05)
+    with h5py.File(tmp_path / "sparse.h5", mode="w") as file:
+        data = DatasetWriter(file)
+        data["person_id"] = np.arange(1_000)
+        data["lump_sum_income"] = values
+        data["employment_income"] = values + 1
+        assert (
+            data.report().set_index("variable").stored_sparse.lump_sum_income
+        )
+    with DatasetFile(h5py.File(tmp_path / "sparse.h5", mode="r")) as data:
+        assert data.is_sparse("lump_sum_income")
+        assert not data.is_sparse("employment_income")
+        assert "lump_sum_income" in data.keys()
+        stored = values.astype(np.float32)
+        assert (data["lump_sum_income"][...] == stored).all()
+        assert (data["lump_sum_income"][100:300] == stored[100:300]).all()
+        positions = np.array([0, 5, 17, 999])
+        assert (data["lump_sum_income"][positions] == stored[positions]).all()
+        index, nonzero, length = data.sparse("lump_sum_income")
+        assert length == 1_000
+        assert (index == np.flatnonzero(values)).all()
+    with h5py.File(tmp_path / "sparse.h5", mode="a") as file:
+        densify(file, "lump_sum_income")
+        assert (file["lump_sum_income"][...] == stored).all()
+
+
+def test_packed_blocks_serve_variables_by_name(toy_dataset, tmp_path):
+    with toy_dataset.load(2019) as data, h5py.File(
+        tmp_path / "packed.h5", mode="w"
+    ) as target:
+        columns = data.read_all()
+        pack(data, target)
+    with DatasetFile(h5py.File(tmp_path / "packed.h5", mode="r")) as data:
+        assert set(data.keys()) == set(columns)
+        assert "age" in data and "age" not in data.file
+        assert data["age"].block.name == "/blocks/person_float64"
+        for variable, values in columns.items():
+            assert (data[variable][...] == values).all()
+        assert (data["age"][10:20] == columns["age"][10:20]).all()
+        positions = np.array([3, 1, 40])
+        assert (data["age"][positions] == columns["age"][positions]).all()
+        people = data.read_all("person")
+        assert "age" in people and "benunit_rent" not in people
+        households = data.households(dict(region="WALES"))
+        subset = data.subset(households, ["age", "benunit_rent"])
+        assert len(subset["age"]) == len(subset["person_id"])
+    with h5py.File(tmp_path / "packed.h5", mode="a") as file:
+        unpack_column(file, "age")
+        file["age"][:5] = -1
+    with DatasetFile(h5py.File(tmp_path / "packed.h5", mode="r")) as data:
+        assert (data["age"][:5] == -1).all()
+        assert data.keys().count("age") == 1
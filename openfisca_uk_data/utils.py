@@ -16,8 +16,25 @@ import requests
 from tqdm import tqdm
 import numpy as np
 import warnings
+import tempfile
+import uuid
+import hashlib
+import inspect
+import json
+import sys
+from functools import lru_cache
+from contextlib import contextmanager
 from google.cloud import storage
 
+try:
+    import fcntl
+except ImportError:  # Advisory locks are not available on Windows
+    fcntl = None
+from openfisca_uk_data.entities import EntityIndex
+from openfisca_uk_data.handles import HANDLES
+from openfisca_uk_data.layers import LAYERS, materialize
+from openfisca_uk_data.storage import DatasetFile, pack, write_value_index
+
 VERSION = "0.9.0"
 
 UK = "openfisca_uk"
@@ -68,22 +85,39 @@ def dataset(cls):
 
     cls.filename = staticmethod(filename)
 
-    def load(year, key: str = None) -> pd.DataFrame:
+    def load(
+        year, key: str = None, where=None, donors: bool = True
+    ) -> pd.DataFrame:
         try:
             year = int(year)
         except:
             pass
-        if year not in cls.years:
+        # Files being generated by this process are not yet listed
+        if year not in cls.years and not cls.file(year).exists():
             raise Exception(
                 f"\n\nNo data available for year {year}. To download, run:\n\n\topenfisca-uk-data {cls.name} download {year}\n\nThis may require signing in with Google authentication if it is not publicly available."
             )
         file = cls.file(year)
         if cls.model:
+
+            def open_file():
+                if file in STAGED_FILES.values():
+                    # Files being generated are written to between loads
+                    return DatasetFile(h5py.File(file, mode="r"))
+                return HANDLES.open(file)
+
+            if where is not None or not donors:
+                # Read only the matching households' rows
+                with open_file() as data:
+                    households = data.households(where, donors)
+                    if key is None:
+                        return data.subset(households)
+                    return data.subset(households, [key])[key]
             if key is None:
-                return h5py.File(file, mode="r")
+                return open_file()
             else:
-                with h5py.File(file, mode="r") as f:
-                    values = np.array(f[key])
+                with open_file() as data:
+                    values = data[key][...]
                 return values
         else:
             if key is None:
@@ -105,24 +139,159 @@ def dataset(cls):
 
     cls.remove = staticmethod(remove)
 
-    def remove_first_then(generate_func):
-        def new_generate_func(year, *args):
-            cls.remove(year)
-            return generate_func(year, *args)
+    def fingerprint(year: int, *args, **kwargs) -> str:
+        return build_fingerprint(cls, year, *args, **kwargs)
+
+    cls.fingerprint = staticmethod(fingerprint)
+
+    def stored_fingerprint(year: int) -> str:
+        if not cls.file(year).exists():
+            return None
+        with h5py.File(cls.file(year), mode="r") as f:
+            return f.attrs.get(FINGERPRINT)
+
+    cls.stored_fingerprint = staticmethod(stored_fingerprint)
+
+    def update_inputs(year: int, *args, **kwargs):
+        # Input fingerprints are those stored when the inputs were built, so
+        # model inputs are first regenerated if their own inputs changed.
+        # Inputs whose own inputs are not available locally are used as they
+        # are.
+        for input_dataset, input_year in required_inputs(
+            cls, year, *args, **kwargs
+        ):
+            if (
+                input_dataset.model is not None
+                and input_dataset.file(input_year).exists()
+                and all(
+                    source.file(source_year).exists()
+                    for source, source_year in input_dataset.requires(
+                        input_year
+                    )
+                )
+            ):
+                input_dataset.generate(input_year)
+
+    def generate_if_changed(generate_func):
+        parameters = inspect.signature(generate_func)
+
+        def new_generate_func(*args, force: bool = False, **kwargs):
+            # Raw datasets take the archive before the year, so the year is
+            # found by name
+            year = parameters.bind_partial(*args, **kwargs).arguments["year"]
+            path = cls.file(year)
+            # Concurrent builds of a dataset-year wait for each other, and
+            # readers see the previous file until the new one is published
+            with file_lock(path):
+                if cls.model is None:
+                    # Raw datasets are generated from an explicitly given
+                    # archive
+                    with staged_output(path):
+                        return generate_func(*args, **kwargs)
+                # Model datasets take the year first
+                if "year" in kwargs:
+                    del kwargs["year"]
+                else:
+                    args = args[1:]
+                update_inputs(year, *args, **kwargs)
+                stored = stored_fingerprint(year)
+                if (
+                    not force
+                    and stored is not None
+                    and stored == fingerprint(year, *args, **kwargs)
+                ):
+                    logging.info(
+                        f"{cls.name} ({year}) is up to date, skipping "
+                        "generation"
+                    )
+                    return
+                with staged_output(path) as staged:
+                    result = generate_func(year, *args, **kwargs)
+                    # Inputs may have been generated during generation
+                    with h5py.File(staged, mode="a") as f:
+                        write_value_index(f)
+                        f.attrs[FINGERPRINT] = fingerprint(
+                            year, *args, **kwargs
+                        )
+                return result
 
         return new_generate_func
 
     if hasattr(cls, "generate"):
-        cls.generate = staticmethod(remove_first_then(cls.generate))
+        cls.generate = staticmethod(generate_if_changed(cls.generate))
     else:
         cls.generate = staticmethod(generate)
 
     cls.load = staticmethod(load)
 
+    if cls.model:
+
+        def entity_index(year: int) -> EntityIndex:
+            with cls.load(year) as data:
+                return data.entity_index
+
+        cls.entity_index = staticmethod(entity_index)
+
+        def iter_batches(
+            year: int,
+            households_per_batch: int = 10_000,
+            variables: List[str] = None,
+            prefetch: bool = True,
+        ):
+            """Iterates over batches of whole households, with locally
+            re-indexed IDs (see `DatasetFile.iter_batches`)."""
+            with cls.load(year) as data:
+                yield from data.iter_batches(
+                    households_per_batch, variables, prefetch
+                )
+
+        cls.iter_batches = staticmethod(iter_batches)
+
+        def materialize_layers(year: int):
+            """Stores every variable of a layered dataset-year in its own
+            file, so that it no longer references its base files."""
+            path = cls.file(int(year))
+            with file_lock(path), h5py.File(path, mode="r") as source:
+                if LAYERS not in source.attrs:
+                    return
+                with atomic_output(path) as output, h5py.File(
+                    output, mode="w"
+                ) as target:
+                    materialize(source, target)
+
+        cls.materialize = staticmethod(materialize_layers)
+
+        def pack_layout(year: int, layout: str = "blocks"):
+            """Rewrites a dataset-year in the given storage layout: "blocks"
+            packs the numeric variables of each entity into one block per
+            type, and "columns" stores one dataset per variable."""
+            if layout not in ("blocks", "columns"):
+                raise ValueError(f"Unknown storage layout {layout}.")
+            path = cls.file(int(year))
+            with file_lock(path), DatasetFile(
+                h5py.File(path, mode="r")
+            ) as source:
+                with atomic_output(path) as output, h5py.File(
+                    output, mode="w"
+                ) as target:
+                    pack(source, target, blocks=layout == "blocks")
+
+        cls.pack = staticmethod(pack_layout)
+
+    if not hasattr(cls, "requires"):
+        # The (dataset, year) inputs needed to generate a given year. A
+        # dataset's `requires` may also take the leading parameters of its
+        # `generate` that change its inputs (see `required_inputs`)
+        cls.requires = lambda year: []
+
     if not hasattr(cls, "input_reform_from_year"):
         cls.input_reform_from_year = lambda year: ()
 
-    cls.file = staticmethod(lambda year: cls.data_dir / cls.filename(year))
+    def file(year) -> Path:
+        path = cls.data_dir / cls.filename(year)
+        return STAGED_FILES.get(path, path)
+
+    cls.file = staticmethod(file)
 
     def save(data_file: str, year: int):
         if "https://" in data_file:
@@ -134,13 +303,16 @@ def dataset(cls):
             progress_bar = tqdm(
                 total=total_size_in_bytes, unit="iB", unit_scale=True
             )
-            with open(cls.file(year), "wb") as file:
+            with atomic_output(cls.file(year)) as output, open(
+                output, "wb"
+            ) as file:
                 for data in response.iter_content(block_size):
                     progress_bar.update(len(data))
                     file.write(data)
             progress_bar.close()
         else:
-            shutil.copyfile(data_file, cls.file(year))
+            with atomic_output(cls.file(year)) as output:
+                shutil.copyfile(data_file, output)
 
     if not hasattr(cls, "save"):
         cls.save = staticmethod(save)
@@ -148,6 +320,9 @@ def dataset(cls):
     if not hasattr(cls, "upload"):
 
         def upload(year):
+            if cls.model:
+                # Uploaded files must not depend on local base files
+                cls.materialize(year)
             bucket = get_storage_bucket()
             blob = bucket.blob(
                 cls.file(year).name[:-3]
@@ -181,7 +356,9 @@ def dataset(cls):
                     f"Found dataset with match type: {match_type}, saving..."
                 )
             blob = bucket.blob(selected_file)
-            with open(cls.file(year), "wb") as f:
+            with atomic_output(cls.file(year)) as output, open(
+                output, "wb"
+            ) as f:
                 blob.download_to_file(f)
             logging.info("Successfully downloaded and saved dataset.")
 
@@ -190,6 +367,142 @@ def dataset(cls):
     return cls
 
 
+FINGERPRINT = "fingerprint"
+
+# Recorded in place of the contents of an input that does not exist
+MISSING_INPUT = "missing"
+
+
+@lru_cache(maxsize=None)
+def _cached_file_hash(path: str, size: int, modified: int) -> str:
+    hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            hash.update(block)
+    return hash.hexdigest()
+
+
+def file_hash(path: Path) -> str:
+    """Hashes the contents of a file, reusing the result while the file's
+    size and modification time are unchanged.
+
+    Args:
+        path (Path): The file to hash.
+
+    Returns:
+        str: The SHA-256 hex digest.
+    """
+    stat = os.stat(path)
+    return _cached_file_hash(str(path), stat.st_size, stat.st_mtime_ns)
+
+
+# The modules (relative to the package) that every dataset's generation
+# shares, such as storage and the imputation engines
+SHARED_MODULES = (
+    "utils.py",
+    "storage.py",
+    "entities.py",
+    "precision.py",
+    "layers.py",
+    "datasets/frs/frs_enhanced/imputation.py",
+    "datasets/frs/frs_enhanced/donors.py",
+)
+
+
+def code_hash(cls: type) -> str:
+    """Hashes the source code defining a dataset: its module, or the whole
+    folder if the dataset has its own subpackage (e.g. `frs_enhanced/`),
+    together with the `SHARED_MODULES`.
+
+    Args:
+        cls (type): The dataset class.
+
+    Returns:
+        str: The SHA-256 hex digest.
+    """
+    module_file = Path(sys.modules[cls.__module__].__file__)
+    if module_file.parent.name == module_file.stem:
+        files = sorted(module_file.parent.rglob("*.py"))
+    else:
+        files = [module_file]
+    package = Path(__file__).parent
+    files += [
+        package / module
+        for module in SHARED_MODULES
+        if package / module not in files
+    ]
+    hash = hashlib.sha256()
+    for file in files:
+        hash.update(file.read_bytes())
+    return hash.hexdigest()
+
+
+def required_inputs(cls: type, year: int, *args, **kwargs) -> list:
+    """Finds the inputs of a dataset-year for the given generation
+    arguments, passing `requires` those of its parameters it accepts: the
+    leading positional arguments and the keyword arguments it names.
+
+    Args:
+        cls (type): The dataset class.
+        year (int): The year.
+
+    Returns:
+        list: The (dataset, year) inputs.
+    """
+    parameters = list(inspect.signature(cls.requires).parameters)[1:]
+    return cls.requires(
+        year,
+        *args[: len(parameters)],
+        **{
+            name: value for name, value in kwargs.items() if name in parameters
+        },
+    )
+
+
+def build_fingerprint(cls: type, year: int, *args, **kwargs) -> str:
+    """Computes the build fingerprint of a dataset-year from the package
+    version, the dataset's code, the generation parameters and its inputs
+    (using their own fingerprints where they have one, else their contents,
+    and `MISSING_INPUT` for those that do not exist).
+
+    Args:
+        cls (type): The dataset class.
+        year (int): The year.
+
+    Returns:
+        str: The SHA-256 hex digest.
+    """
+    inputs = {}
+    for input_dataset, input_year in required_inputs(
+        cls, year, *args, **kwargs
+    ):
+        path = input_dataset.file(input_year)
+        if not path.exists():
+            # Generation may produce the input itself, after which the
+            # fingerprint is recomputed
+            inputs[path.name] = MISSING_INPUT
+            continue
+        stored = None
+        if input_dataset.model is not None:
+            stored = input_dataset.stored_fingerprint(input_year)
+        inputs[path.name] = stored or file_hash(path)
+    try:
+        year = int(year)
+    except ValueError:
+        pass
+    description = dict(
+        version=VERSION,
+        code=code_hash(cls),
+        year=year,
+        args=list(args),
+        kwargs=kwargs,
+        inputs=inputs,
+    )
+    return hashlib.sha256(
+        json.dumps(description, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
 def get_storage_bucket() -> storage.Bucket:
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
@@ -232,6 +545,119 @@ def safe_rmdir(path: str):
         shutil.rmtree(path)
 
 
+@contextmanager
+def atomic_output(path: Path) -> Path:
+    """Provides a temporary path next to `path` to write a file to, which is
+    moved into place with an atomic rename only if writing succeeds. Readers
+    therefore never see a partially written file.
+
+    Args:
+        path (Path): The final file path.
+
+    Yields:
+        Path: The temporary path to write to.
+    """
+    path = Path(path)
+    temporary = path.with_name(f".{path.stem}.{uuid.uuid4().hex}.tmp")
+    try:
+        yield temporary
+        os.replace(temporary, path)
+    finally:
+        if temporary.exists():
+            os.remove(temporary)
+
+
+# The temporary files that dataset-years are being generated into by this
+# process, by final path. `Dataset.file` returns them until generation ends
+STAGED_FILES = {}
+
+
+@contextmanager
+def staged_output(path: Path) -> Path:
+    """Redirects a dataset-year's file path, within this process, to a new
+    temporary file next to it, which is moved into place with an atomic
+    rename if generation succeeds. Every step of a multi-step generation
+    then writes to the temporary file, and other processes keep reading the
+    previous file until the new one is complete.
+
+    Args:
+        path (Path): The final file path.
+
+    Yields:
+        Path: The temporary path.
+    """
+    path = Path(path)
+    temporary = path.with_name(f".{path.stem}.{uuid.uuid4().hex}.tmp")
+    STAGED_FILES[path] = temporary
+    try:
+        yield temporary
+        if temporary.exists():
+            os.replace(temporary, path)
+    finally:
+        del STAGED_FILES[path]
+        if temporary.exists():
+            os.remove(temporary)
+
+
+@contextmanager
+def atomic_update(path: Path) -> Path:
+    """Provides a copy of a file to modify, moved into place with an atomic
+    rename only if modifying it succeeds. A file being generated by this
+    process (see `staged_output`) is modified directly, as no other process
+    reads it.
+
+    Args:
+        path (Path): The file path.
+
+    Yields:
+        Path: The path to modify.
+    """
+    path = Path(path)
+    if path in STAGED_FILES.values():
+        yield path
+        return
+    with atomic_output(path) as temporary:
+        shutil.copyfile(path, temporary)
+        yield temporary
+
+
+@contextmanager
+def file_lock(path: Path):
+    """Holds an exclusive advisory lock on a file path, through a lock file
+    next to it, so that processes rebuilding or rewriting the same file take
+    turns. Readers need no lock, as files are only ever replaced by atomic
+    renames. Does nothing where advisory locks are not available.
+
+    Args:
+        path (Path): The file path.
+    """
+    if fcntl is None:
+        yield
+        return
+    path = Path(path)
+    with open(path.with_name(f".{path.name}.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+@contextmanager
+def scratch_folder(parent: Path) -> Path:
+    """Provides a uniquely named temporary folder inside `parent`, removed
+    afterwards, so that concurrent jobs do not share scratch space.
+
+    Args:
+        parent (Path): The folder to create the scratch folder in.
+
+    Yields:
+        Path: The scratch folder.
+    """
+    with tempfile.TemporaryDirectory(dir=parent, prefix="tmp_") as folder:
+        yield Path(folder)
+
+
 def extract_version_info(filename: str) -> Tuple[int, int, int]:
     filename = filename.split(".")[0]
     if "v" in filename:
@@ -13,6 +13,7 @@ setup(
     packages=find_packages(exclude="microdata"),
     install_requires=[
         "pandas",
+        "pyarrow",
         "pathlib",
         "tqdm",
         "h5py",
@@ -21,6 +22,8 @@ setup(
         "jupyter-book>=0.11.1",
         "sphinxcontrib-bibtex>=1.0.0",
         "synthimpute>=0.1.0",
+        "scikit-learn>=1.0",
+        "scipy>=1.6",
         "OpenFisca-Tools>=0.1.3",
     ],
     entry_points={